@@ -0,0 +1,143 @@
+import errno
+import hashlib
+import os
+import shutil
+from typing import Any, Dict, Iterable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# ioctl FICLONE của Linux (_IOW(0x94, 9, int)): file đích dùng chung extent với file nguồn
+FICLONE = 0x40049409
+
+# Các cách sao chép, theo thứ tự ưu tiên
+METHODS = ('reflink', 'copy_file_range', 'sendfile', 'userspace')
+
+# Kích thước mỗi lần sao chép trong kernel và bộ đệm của sao chép userspace
+KERNEL_CHUNK = 1 << 30
+BUFFER_SIZE = 1 << 20
+
+# Lỗi cho biết hệ thống file/kernel không hỗ trợ cách sao chép này (thử cách tiếp theo)
+_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EBADF, errno.ENOTTY,
+                errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOTSOCK, errno.ETXTBSY, errno.EPERM}
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def _reflink(src: int, dst: int, size: int) -> None:
+    if fcntl is None:
+        raise _Unsupported()
+    try:
+        fcntl.ioctl(dst, FICLONE, src)
+    except OSError as e:
+        if e.errno in _UNSUPPORTED:
+            raise _Unsupported()
+        raise
+
+
+def _kernel_copy(copy_chunk, size: int) -> None:
+    """Sao chép trong kernel theo từng khúc; chỉ chuyển sang cách khác nếu lỗi ngay khúc đầu"""
+    offset = 0
+    while offset < size:
+        try:
+            copied = copy_chunk(offset, min(KERNEL_CHUNK, size - offset))
+        except OSError as e:
+            if offset == 0 and e.errno in _UNSUPPORTED:
+                raise _Unsupported()
+            raise
+        if copied == 0:
+            # File nguồn bị cắt ngắn trong lúc sao chép
+            break
+        offset += copied
+    if offset != size:
+        raise RuntimeError(f"Sao chép không đủ dữ liệu: {offset}/{size} byte")
+
+
+def _copy_file_range(src: int, dst: int, size: int) -> None:
+    if not hasattr(os, 'copy_file_range'):
+        raise _Unsupported()
+    _kernel_copy(lambda offset, count: os.copy_file_range(src, dst, count, offset, offset), size)
+
+
+def _sendfile(src: int, dst: int, size: int) -> None:
+    if not hasattr(os, 'sendfile'):
+        raise _Unsupported()
+    _kernel_copy(lambda offset, count: os.sendfile(dst, src, offset, count), size)
+
+
+def _userspace(src_file, dst_file, digest) -> None:
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    src_file.seek(0)
+    while True:
+        read = src_file.readinto(buffer)
+        if not read:
+            break
+        if digest is not None:
+            digest.update(view[:read])
+        dst_file.write(view[:read])
+
+
+def _reset(dst_file) -> None:
+    # Xóa phần đã ghi của lần thử trước trước khi thử cách khác
+    dst_file.seek(0)
+    dst_file.truncate(0)
+
+
+def copy_file(source, target, methods: Optional[Iterable[str]] = None,
+              compute_hash: bool = True) -> Dict[str, Any]:
+    """Sao chép file nguồn sang file đích mới (không ghi đè), giữ metadata (copystat)
+
+    Thử lần lượt: reflink (FICLONE, không sao chép dữ liệu), copy_file_range
+    và sendfile (sao chép trong kernel), cuối cùng là đọc/ghi ở userspace;
+    khi sao chép ở userspace, hash SHA-256 được tính ngay trong lần đọc đó.
+    Trả về {'method', 'size', 'hash'}; hash là None với các cách sao chép
+    không đưa dữ liệu qua userspace. File đích dở dang bị xóa nếu lỗi.
+    """
+    methods = [method for method in (methods or METHODS) if method in METHODS]
+    if not methods:
+        raise ValueError("Không có cách sao chép hợp lệ")
+
+    with open(source, 'rb') as src_file:
+        size = os.fstat(src_file.fileno()).st_size
+        if size == 0:
+            # File rỗng (hoặc file ảo như /proc báo kích thước 0): chỉ đọc ở userspace
+            methods = ['userspace']
+        dst_file = open(target, 'xb')
+        try:
+            with dst_file:
+                src, dst = src_file.fileno(), dst_file.fileno()
+                digest = None
+                for method in methods:
+                    try:
+                        if method == 'reflink':
+                            _reflink(src, dst, size)
+                        elif method == 'copy_file_range':
+                            _copy_file_range(src, dst, size)
+                        elif method == 'sendfile':
+                            _sendfile(src, dst, size)
+                        else:
+                            digest = hashlib.sha256() if compute_hash else None
+                            _userspace(src_file, dst_file, digest)
+                        break
+                    except _Unsupported:
+                        _reset(dst_file)
+                else:
+                    raise RuntimeError(f"Không sao chép được bằng các cách: {', '.join(methods)}")
+            shutil.copystat(str(source), str(target))
+        except BaseException:
+            try:
+                os.remove(str(target))
+            except OSError:
+                pass
+            raise
+
+    return {
+        'method': method,
+        'size': size,
+        'hash': digest.hexdigest() if digest is not None else None
+    }
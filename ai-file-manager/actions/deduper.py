@@ -0,0 +1,189 @@
+import filecmp
+import os
+import stat
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Tuple
+
+from actions.journal import ActionJournal
+from actions.mover import FileMover
+
+# Số luồng kiểm tra và thay thế file trùng lặp mặc định
+DEFAULT_WORKERS = 8
+
+# Số kết quả được ghi vào database trong một transaction
+BATCH_SIZE = 500
+
+# Loại liên kết dùng để thay file trùng lặp
+LINK_TYPES = ('hard', 'reflink')
+
+# Cách xác minh nội dung trước khi thay: so từng byte, hoặc tin hash đã lưu (chỉ kiểm tra kích thước)
+VERIFY_MODES = ('bytes', 'hash')
+
+
+class DedupeTask:
+    """Thay một file trùng lặp bằng liên kết tới file được giữ lại (cùng nội dung, cùng thiết bị)"""
+
+    __slots__ = ('file_id', 'keeper', 'duplicate', 'size', 'reclaimable')
+
+    def __init__(self, file_id: int, keeper: str, duplicate: str, size: int, reclaimable: bool):
+        self.file_id = file_id
+        self.keeper = keeper
+        self.duplicate = duplicate
+        self.size = size
+        # Hard link: inode của bản trùng còn liên kết khác thì dung lượng chưa được giải phóng
+        self.reclaimable = reclaimable
+
+
+class Deduper:
+    """Khử trùng lặp: thay các file cùng hash bằng hard link hoặc reflink
+
+    Đường dẫn của file không đổi nên database không cần cập nhật. Mỗi nhóm
+    trùng lặp (theo hash trong database) được chia theo thiết bị; trên mỗi
+    thiết bị giữ lại một file (file có nhiều liên kết nhất) và thay các file
+    còn lại. Nội dung được xác minh lại ngay trước khi thay. Các thao tác chạy
+    song song, được ghi trước vào nhật ký (ActionJournal) nên có thể phục hồi
+    và hoàn tác. Với hard link, file thay thế dùng chung quyền và thời gian
+    sửa đổi với file được giữ lại.
+    """
+
+    def __init__(self, db, link_type: str = 'hard', verify: str = 'bytes',
+                 workers: int = DEFAULT_WORKERS, batch_size: int = BATCH_SIZE):
+        """Khởi tạo với database, loại liên kết, cách xác minh và số luồng"""
+        if link_type not in LINK_TYPES:
+            raise ValueError(f"Loại liên kết không hợp lệ: {link_type}")
+        if verify not in VERIFY_MODES:
+            raise ValueError(f"Cách xác minh không hợp lệ: {verify}")
+        self.db = db
+        self.link_type = link_type
+        self.verify = verify
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.mover = FileMover()
+        self.journal = ActionJournal(db)
+        self.batch_id = None
+        self.stats = {'groups': 0, 'planned': 0, 'skipped': 0, 'linked': 0, 'bytes_reclaimed': 0}
+
+    def plan(self, groups: List[List[Dict[str, Any]]]) -> List[DedupeTask]:
+        """Lập danh sách thay thế từ các nhóm file trùng lặp (kết quả search_duplicates)
+
+        Bỏ qua file không còn tồn tại, symlink, file rỗng, kích thước khác với
+        database và file đã là liên kết tới file được giữ lại.
+        """
+        tasks = []
+        for group in groups:
+            by_device: Dict[int, List[Tuple[Dict[str, Any], os.stat_result]]] = {}
+            for file_info in group:
+                try:
+                    st = os.lstat(file_info['abs_path'])
+                except OSError:
+                    self.stats['skipped'] += 1
+                    continue
+                if not stat.S_ISREG(st.st_mode) or st.st_size == 0 \
+                        or file_info.get('size') not in (None, st.st_size):
+                    self.stats['skipped'] += 1
+                    continue
+                by_device.setdefault(st.st_dev, []).append((file_info, st))
+
+            for members in by_device.values():
+                if len(members) < 2:
+                    continue
+                self.stats['groups'] += 1
+                # Giữ file có nhiều liên kết nhất để ít inode còn lại nhất
+                members.sort(key=lambda member: (-member[1].st_nlink, member[0]['abs_path']))
+                (keeper, keeper_st), duplicates = members[0], members[1:]
+                for file_info, st in duplicates:
+                    if (st.st_dev, st.st_ino) == (keeper_st.st_dev, keeper_st.st_ino):
+                        self.stats['skipped'] += 1
+                        continue
+                    tasks.append(DedupeTask(
+                        file_info['id'], keeper['abs_path'], file_info['abs_path'], st.st_size,
+                        self.link_type == 'reflink' or st.st_nlink == 1))
+
+        self.stats['planned'] += len(tasks)
+        return tasks
+
+    def execute(self, tasks: List[DedupeTask], dry_run: bool = False) -> Iterator[Dict[str, Any]]:
+        """Xác minh và thay thế song song, trả về kết quả từng file (thứ tự hoàn thành)"""
+        if dry_run:
+            for task in tasks:
+                yield self._result(task, success=True, dry_run=True)
+            return
+        if not tasks:
+            return
+
+        action_type = f'dedupe_{self.link_type}'
+        self.batch_id = self.journal.begin('dedupe')
+        action_ids = self.journal.record_intents(self.batch_id, (
+            (task.file_id, action_type, task.keeper, task.duplicate) for task in tasks))
+        task_ids = {id(task): action_id for task, action_id in zip(tasks, action_ids)}
+
+        statuses = []
+
+        def record(task, result):
+            statuses.append(('completed' if result['success'] else 'failed', task_ids[id(task)]))
+            if result['success']:
+                self.stats['linked'] += 1
+                self.stats['bytes_reclaimed'] += result['reclaimed']
+
+        max_pending = self.workers * 4
+        remaining = iter(tasks)
+        pending = set()
+        finished = False
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='dedupe') as executor:
+            try:
+                while True:
+                    for task in remaining:
+                        pending.add(executor.submit(self._run_task, task))
+                        if len(pending) >= max_pending:
+                            break
+                    if not pending:
+                        break
+
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    # Ghi nhận mọi task đã xong trước khi trả kết quả (generator có thể bị đóng)
+                    completed = []
+                    for future in done:
+                        task, result = future.result()
+                        record(task, result)
+                        completed.append(result)
+                    yield from completed
+
+                    if len(statuses) >= self.batch_size:
+                        self.journal.complete(statuses)
+                        statuses.clear()
+                finished = True
+            finally:
+                for future in pending:
+                    if not future.cancel():
+                        record(*future.result())
+                self.journal.complete(statuses)
+                self.journal.finish(self.batch_id, 'completed' if finished else 'interrupted')
+
+    def _run_task(self, task: DedupeTask) -> Tuple[DedupeTask, Dict[str, Any]]:
+        """Xác minh nội dung rồi thay file trùng lặp (ở luồng phụ)"""
+        try:
+            if self.verify == 'bytes':
+                same = filecmp.cmp(task.keeper, task.duplicate, shallow=False)
+            else:
+                same = os.path.getsize(task.keeper) == os.path.getsize(task.duplicate) == task.size
+            if not same:
+                raise ValueError(f"Nội dung khác với file được giữ lại: {task.keeper}")
+            self.mover.replace_with_link(task.keeper, task.duplicate, self.link_type)
+            return task, self._result(task, success=True)
+        except Exception as e:
+            return task, self._result(task, success=False, error=str(e))
+
+    def _result(self, task: DedupeTask, success: bool, dry_run: bool = False, error: str = None) -> Dict[str, Any]:
+        result = {
+            'success': success,
+            'action_type': f'dedupe_{self.link_type}',
+            'source': task.keeper,
+            'target': task.duplicate,
+            'size': task.size,
+            'reclaimed': task.size if success and task.reclaimable else 0,
+            'dry_run': dry_run
+        }
+        if error:
+            result['error'] = error
+        return result
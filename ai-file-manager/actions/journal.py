@@ -0,0 +1,277 @@
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from actions.mover import LINK_TEMP_SUFFIX, FileMover
+
+# Số hành động được đánh dấu hoàn tất trong một transaction
+BATCH_SIZE = 500
+
+# Hành động di chuyển file (hoàn tác bằng cách di chuyển ngược lại)
+_MOVES = ('move', 'rename')
+
+# Hành động tạo file mới ở đích (hoàn tác bằng cách xóa file đích)
+_CREATES = ('copy', 'link_hard', 'link_symbolic', 'link_reflink')
+
+# Hành động thay file trùng lặp bằng liên kết (hoàn tác bằng cách tách thành bản sao độc lập)
+_DEDUPES = ('dedupe_hard', 'dedupe_reflink')
+
+
+def _process_alive(pid: Optional[int]) -> bool:
+    """Tiến trình pid còn chạy không (để không phục hồi lô của tiến trình đang chạy)"""
+    if not pid:
+        return False
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        import ctypes
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ActionJournal:
+    """Nhật ký ghi trước (write-ahead) cho các lô thao tác file
+
+    Trước khi thực hiện, mọi thao tác của lô được ghi vào actions_log với
+    trạng thái 'pending' (ý định). Khi thao tác xong, trạng thái và đường dẫn
+    mới của file được cập nhật trong cùng một transaction. Nếu tiến trình bị
+    dừng giữa chừng, lần khởi động sau so các ý định còn dang dở với trạng
+    thái thực trên đĩa để đồng bộ lại database (recover). Một lô đã hoàn tất
+    có thể được hoàn tác (undo); bản thân lần hoàn tác cũng là một lô.
+    """
+
+    def __init__(self, db):
+        """Khởi tạo với kết nối database"""
+        self.db = db
+
+    def begin(self, command: str) -> int:
+        """Mở một lô mới, trả về id của lô"""
+        cursor = self.db.conn.cursor()
+        cursor.execute('''
+        INSERT INTO action_batches (command, status, pid, started_ts)
+        VALUES (?, 'running', ?, ?)
+        ''', (command, os.getpid(), datetime.now()))
+        self.db.conn.commit()
+        return cursor.lastrowid
+
+    def record_intents(self, batch_id: int, entries: Iterable[Tuple[Any, str, str, Optional[str]]]) -> List[int]:
+        """Ghi ý định của các thao tác (file_id, action_type, nguồn, đích) trước khi thực hiện
+
+        Tất cả được ghi trong một transaction; trả về id của từng dòng nhật ký.
+        """
+        cursor = self.db.conn.cursor()
+        timestamp = datetime.now()
+        action_ids = []
+        for file_id, action_type, source, target in entries:
+            cursor.execute('''
+            INSERT INTO actions_log (
+                file_id, action_type, source_path, target_path, timestamp, status, batch_id
+            ) VALUES (?, ?, ?, ?, ?, 'pending', ?)
+            ''', (file_id, action_type, source, target, timestamp, batch_id))
+            action_ids.append(cursor.lastrowid)
+        self.db.conn.commit()
+        return action_ids
+
+    def complete(self, statuses: List[Tuple[str, int]], path_updates: List[Tuple[Any, str]] = ()) -> None:
+        """Đánh dấu trạng thái (status, action_id) và cập nhật đường dẫn file trong cùng transaction"""
+        if not statuses and not path_updates:
+            return
+        self.db.conn.executemany("UPDATE actions_log SET status = ? WHERE id = ?", statuses)
+        self.db.update_file_paths(path_updates)
+        self.db.conn.commit()
+
+    def finish(self, batch_id: int, status: str = 'completed') -> None:
+        """Đóng lô với trạng thái cuối cùng"""
+        self.db.conn.execute(
+            "UPDATE action_batches SET status = ?, finished_ts = ? WHERE id = ?",
+            (status, datetime.now(), batch_id))
+        self.db.conn.commit()
+
+    def get_batch(self, batch_id: int) -> Optional[Dict[str, Any]]:
+        """Thông tin một lô (None nếu không có)"""
+        row = self.db.conn.execute("SELECT * FROM action_batches WHERE id = ?", (batch_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list_batches(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Các lô gần đây nhất kèm số thao tác theo trạng thái"""
+        cursor = self.db.conn.execute('''
+        SELECT b.*,
+               SUM(CASE WHEN l.status = 'completed' THEN 1 ELSE 0 END) AS completed,
+               SUM(CASE WHEN l.status = 'failed' THEN 1 ELSE 0 END) AS failed,
+               SUM(CASE WHEN l.status = 'undone' THEN 1 ELSE 0 END) AS undone,
+               COUNT(l.id) AS total
+        FROM action_batches b
+        LEFT JOIN actions_log l ON l.batch_id = b.id
+        GROUP BY b.id
+        ORDER BY b.id DESC
+        LIMIT ?
+        ''', (limit,))
+        return [dict(row) for row in cursor.fetchall()]
+
+    def recover(self) -> Dict[str, int]:
+        """Đồng bộ lại các lô bị gián đoạn
+
+        Gồm lô 'interrupted' (đã dừng, các bước bị hủy còn 'pending') và lô
+        'running' của tiến trình không còn chạy (bị dừng đột ngột).
+
+        Mỗi thao tác còn 'pending' được đối chiếu với đĩa: thao tác đã diễn ra
+        được đánh dấu hoàn tất (kèm đường dẫn mới), thao tác chưa diễn ra bị
+        đánh dấu thất bại; bản sao dở dang (đích do chính lô tạo ra) bị xóa.
+        Mọi cập nhật database được ghi hàng loạt.
+        """
+        stats = {'batches': 0, 'completed': 0, 'failed': 0}
+        batches = [row['id'] for row in self.db.conn.execute(
+            "SELECT id, pid, status FROM action_batches WHERE status IN ('running', 'interrupted')").fetchall()
+            if row['status'] == 'interrupted' or not _process_alive(row['pid'])]
+
+        for batch_id in batches:
+            rows = self.db.conn.execute('''
+            SELECT id, file_id, action_type, source_path, target_path FROM actions_log
+            WHERE batch_id = ? AND status = 'pending' ORDER BY id
+            ''', (batch_id,)).fetchall()
+
+            # Đích là nguồn của thao tác khác trong lô: file đã được di chuyển tiếp từ đó
+            later_sources = {(row['file_id'], row['source_path']) for row in self.db.conn.execute(
+                "SELECT file_id, source_path FROM actions_log WHERE batch_id = ?", (batch_id,))}
+
+            statuses = []
+            path_updates = {}
+            for row in rows:
+                done = self._reconcile(row, later_sources)
+                statuses.append(('completed' if done else 'failed', row['id']))
+                if done and row['action_type'] in _MOVES:
+                    path_updates[row['file_id']] = row['target_path']
+
+            for start in range(0, len(statuses), BATCH_SIZE):
+                self.complete(statuses[start:start + BATCH_SIZE])
+            self.complete([], list(path_updates.items()))
+            self.finish(batch_id, 'recovered')
+
+            stats['batches'] += 1
+            stats['completed'] += sum(1 for status, _ in statuses if status == 'completed')
+            stats['failed'] += sum(1 for status, _ in statuses if status == 'failed')
+
+        return stats
+
+    def _reconcile(self, row, later_sources) -> bool:
+        """Thao tác dang dở đã thực sự diễn ra trên đĩa chưa (dọn bản sao dở dang nếu chưa)"""
+        action_type = row['action_type']
+        source, target = row['source_path'], row['target_path']
+
+        if action_type == 'delete':
+            return not os.path.lexists(source)
+
+        if action_type in _DEDUPES:
+            # File trùng lặp được thay bằng os.replace nên luôn còn; chỉ dọn liên kết tạm
+            self._remove(target + LINK_TEMP_SUFFIX)
+            if action_type == 'dedupe_hard':
+                try:
+                    return os.path.samefile(source, target)
+                except OSError:
+                    return False
+            # Không phân biệt được reflink với bản sao: nội dung như nhau nên coi như chưa thay
+            return False
+
+        source_exists = os.path.lexists(source)
+        target_exists = bool(target) and os.path.lexists(target)
+
+        if action_type in _MOVES:
+            if target_exists and not source_exists:
+                return True
+            if target_exists and source_exists:
+                # Di chuyển khác thiết bị bị dừng khi đang sao chép: nguồn còn nguyên
+                self._remove(target)
+                return False
+            if not source_exists and (row['file_id'], target) in later_sources:
+                return True
+            return False
+
+        if target_exists and action_type == 'copy' and source_exists:
+            if os.path.getsize(target) != os.path.getsize(source):
+                self._remove(target)
+                return False
+        return target_exists
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def undo(self, batch_id: int) -> Dict[str, Any]:
+        """Hoàn tác các thao tác đã hoàn tất của một lô (theo thứ tự ngược)
+
+        Di chuyển/đổi tên được đưa file về vị trí cũ; bản sao và liên kết bị
+        xóa; file trùng lặp đã thay bằng liên kết được tách thành bản sao độc
+        lập. Lần hoàn tác được ghi như một lô mới nên cũng phục hồi được.
+        """
+        batch = self.get_batch(batch_id)
+        if not batch:
+            raise ValueError(f"Không tìm thấy lô: {batch_id}")
+        if batch['status'] == 'running':
+            raise ValueError(f"Lô {batch_id} đang chạy hoặc chưa được phục hồi")
+        if batch['status'] == 'undone':
+            raise ValueError(f"Lô {batch_id} đã được hoàn tác")
+
+        rows = self.db.conn.execute('''
+        SELECT id, file_id, action_type, source_path, target_path FROM actions_log
+        WHERE batch_id = ? AND status = 'completed' ORDER BY id DESC
+        ''', (batch_id,)).fetchall()
+
+        if any(row['action_type'] not in _MOVES + _CREATES + _DEDUPES for row in rows):
+            raise ValueError(f"Lô {batch_id} có thao tác không hoàn tác được (xóa file, tách liên kết)")
+
+        inverse = []
+        for row in rows:
+            if row['action_type'] in _MOVES:
+                inverse.append((row['file_id'], row['action_type'], row['target_path'], row['source_path']))
+            elif row['action_type'] in _DEDUPES:
+                inverse.append((row['file_id'], 'split', row['source_path'], row['target_path']))
+            else:
+                inverse.append((row['file_id'], 'delete', row['target_path'], None))
+
+        undo_batch = self.begin(f"undo {batch_id}")
+        action_ids = self.record_intents(undo_batch, inverse)
+
+        mover = FileMover()
+        stats = {'batch_id': undo_batch, 'undone': 0, 'failed': 0, 'errors': []}
+        statuses = []
+        path_updates = []
+        for row, (file_id, action_type, source, target), action_id in zip(rows, inverse, action_ids):
+            try:
+                if action_type == 'delete':
+                    if os.path.isdir(source) and not os.path.islink(source):
+                        raise IsADirectoryError(f"Không xóa thư mục: {source}")
+                    os.remove(source)
+                elif action_type == 'split':
+                    mover.replace_with_copy(source, target)
+                else:
+                    mover.move_file(source, target, verify=False)
+                    path_updates.append((file_id, target))
+                statuses.append(('completed', action_id))
+                statuses.append(('undone', row['id']))
+                stats['undone'] += 1
+            except Exception as e:
+                statuses.append(('failed', action_id))
+                stats['failed'] += 1
+                stats['errors'].append(f"{source}: {e}")
+
+            if len(statuses) >= BATCH_SIZE:
+                self.complete(statuses, path_updates)
+                statuses, path_updates = [], []
+
+        self.complete(statuses, path_updates)
+        self.finish(undo_batch, 'completed' if not stats['failed'] else 'interrupted')
+        if not stats['failed']:
+            self.finish(batch_id, 'undone')
+        return stats
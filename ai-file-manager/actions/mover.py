@@ -3,15 +3,29 @@ import shutil
 from pathlib import Path
 import hashlib
 
+from actions import copy_engine
+
+# Hậu tố của liên kết tạm trước khi thay thế file trùng lặp (replace_with_link)
+LINK_TEMP_SUFFIX = '.link-tmp'
+
 class FileMover:
     """Lớp thực hiện các thao tác di chuyển, sao chép, đổi tên và liên kết file"""
     
     def __init__(self, db=None):
         """Khởi tạo với kết nối database (tùy chọn)"""
         self.db = db
+        # Các cách sao chép được phép dùng (None: mọi cách, xem copy_engine.METHODS)
+        self.copy_methods = None
     
-    def move_file(self, source, target, verify=True):
-        """Di chuyển file từ source đến target"""
+    def move_file(self, source, target, verify=True, source_hash=None):
+        """Di chuyển file từ source đến target
+        
+        Trên cùng thiết bị, file được đổi tên (rename) nên không cần xác minh
+        hash. Khi khác thiết bị, bản sao được xác minh trước khi xóa file nguồn
+        (xem _verify_copy): hash tính ngay trong lúc sao chép được so với hash
+        nguồn đã biết (source_hash hoặc hash trong database) mà không đọc lại
+        file đích.
+        """
         source_path = Path(source)
         target_path = Path(target)
         
@@ -25,45 +39,50 @@ class FileMover:
         if target_path.exists():
             raise FileExistsError(f"File đích đã tồn tại: {target}")
         
-        # Tính hash trước khi di chuyển nếu cần xác minh
-        source_hash = None
-        if verify:
-            source_hash = self._calculate_hash(source_path)
-        
-        # Di chuyển file
-        try:
-            shutil.move(str(source_path), str(target_path))
-        except Exception as e:
-            raise RuntimeError(f"Lỗi khi di chuyển file: {e}")
-        
-        # Xác minh hash sau khi di chuyển
-        if verify and source_hash:
-            target_hash = self._calculate_hash(target_path)
-            if source_hash != target_hash:
-                # Nếu hash không khớp, thử khôi phục file nguồn
-                try:
-                    shutil.move(str(target_path), str(source_path))
-                except Exception:
-                    pass
+        # Dùng lại hash đã lưu trong database làm hash nguồn
+        file_info = self.db.get_file_by_path(str(source_path)) if self.db else None
+        if source_hash is None and file_info:
+            source_hash = file_info['hash_sha256']
+        
+        if self._same_device(source_path, target_path) or source_path.is_symlink() or not source_path.is_file():
+            # Đổi tên trên cùng thiết bị không thay đổi nội dung file
+            try:
+                shutil.move(str(source_path), str(target_path))
+            except Exception as e:
+                raise RuntimeError(f"Lỗi khi di chuyển file: {e}")
+        else:
+            # Khác thiết bị: sao chép (kèm tính hash nếu qua userspace), xác minh rồi mới xóa file nguồn
+            try:
+                copied_hash = self._copy_with_hash(source_path, target_path)
+            except Exception as e:
+                raise RuntimeError(f"Lỗi khi di chuyển file: {e}")
+            
+            if verify and not self._verify_copy(source_path, target_path, source_hash, copied_hash):
+                self._remove_partial(target_path)
                 raise RuntimeError(f"Lỗi xác minh hash sau khi di chuyển: {source} -> {target}")
+            
+            try:
+                os.remove(str(source_path))
+            except Exception as e:
+                raise RuntimeError(f"Lỗi khi xóa file nguồn sau khi di chuyển: {e}")
         
         # Ghi log vào database nếu có
-        if self.db:
-            file_info = self.db.get_file_by_path(str(source_path))
-            if file_info:
-                action_id = self.db.log_action(
-                    file_info['id'], 'move', str(source_path), str(target_path))
-                
-                # Cập nhật đường dẫn trong database
-                self.db.conn.execute(
-                    "UPDATE files SET abs_path = ? WHERE id = ?",
-                    (str(target_path), file_info['id']))
-                self.db.conn.commit()
+        if file_info:
+            action_id = self.db.log_action(
+                file_info['id'], 'move', str(source_path), str(target_path))
+            
+            # Cập nhật đường dẫn trong database
+            self.db.update_file_path(file_info['id'], str(target_path))
         
         return str(target_path)
     
-    def copy_file(self, source, target, verify=True):
-        """Sao chép file từ source đến target"""
+    def copy_file(self, source, target, verify=True, source_hash=None):
+        """Sao chép file từ source đến target
+        
+        Dùng copy_engine (reflink, sao chép trong kernel hoặc userspace). Khi
+        dữ liệu đi qua userspace, hash được tính trong cùng lần đọc và so với
+        hash nguồn đã biết (source_hash hoặc hash trong database).
+        """
         source_path = Path(source)
         target_path = Path(target)
         
@@ -77,39 +96,31 @@ class FileMover:
         if target_path.exists():
             raise FileExistsError(f"File đích đã tồn tại: {target}")
         
-        # Tính hash trước khi sao chép nếu cần xác minh
-        source_hash = None
-        if verify:
-            source_hash = self._calculate_hash(source_path)
+        # Dùng lại hash đã lưu trong database làm hash nguồn
+        file_info = self.db.get_file_by_path(str(source_path)) if self.db else None
+        if source_hash is None and file_info:
+            source_hash = file_info['hash_sha256']
         
         # Sao chép file
         try:
-            shutil.copy2(str(source_path), str(target_path))
+            copied_hash = self._copy_with_hash(source_path, target_path)
         except Exception as e:
             raise RuntimeError(f"Lỗi khi sao chép file: {e}")
         
-        # Xác minh hash sau khi sao chép
-        if verify and source_hash:
-            target_hash = self._calculate_hash(target_path)
-            if source_hash != target_hash:
-                # Nếu hash không khớp, xóa file đích
-                try:
-                    os.remove(str(target_path))
-                except Exception:
-                    pass
-                raise RuntimeError(f"Lỗi xác minh hash sau khi sao chép: {source} -> {target}")
+        # Xác minh hash tính được trong lúc sao chép
+        if verify and source_hash and copied_hash and copied_hash != source_hash:
+            self._remove_partial(target_path)
+            raise RuntimeError(f"Lỗi xác minh hash sau khi sao chép: {source} -> {target}")
         
         # Ghi log vào database nếu có
-        if self.db:
-            file_info = self.db.get_file_by_path(str(source_path))
-            if file_info:
-                self.db.log_action(
-                    file_info['id'], 'copy', str(source_path), str(target_path))
+        if file_info:
+            self.db.log_action(
+                file_info['id'], 'copy', str(source_path), str(target_path))
         
         return str(target_path)
     
     def rename_file(self, source, new_name, verify=True):
-        """Đổi tên file"""
+        """Đổi tên file (trong cùng thư mục nên không cần xác minh hash)"""
         source_path = Path(source)
         target_path = source_path.parent / new_name
         
@@ -120,28 +131,12 @@ class FileMover:
         if target_path.exists():
             raise FileExistsError(f"File đích đã tồn tại: {target_path}")
         
-        # Tính hash trước khi đổi tên nếu cần xác minh
-        source_hash = None
-        if verify:
-            source_hash = self._calculate_hash(source_path)
-        
         # Đổi tên file
         try:
             os.rename(str(source_path), str(target_path))
         except Exception as e:
             raise RuntimeError(f"Lỗi khi đổi tên file: {e}")
         
-        # Xác minh hash sau khi đổi tên
-        if verify and source_hash:
-            target_hash = self._calculate_hash(target_path)
-            if source_hash != target_hash:
-                # Nếu hash không khớp, thử khôi phục tên cũ
-                try:
-                    os.rename(str(target_path), str(source_path))
-                except Exception:
-                    pass
-                raise RuntimeError(f"Lỗi xác minh hash sau khi đổi tên: {source} -> {target_path}")
-        
         # Ghi log vào database nếu có
         if self.db:
             file_info = self.db.get_file_by_path(str(source_path))
@@ -150,15 +145,16 @@ class FileMover:
                     file_info['id'], 'rename', str(source_path), str(target_path))
                 
                 # Cập nhật đường dẫn trong database
-                self.db.conn.execute(
-                    "UPDATE files SET abs_path = ?, filename = ? WHERE id = ?",
-                    (str(target_path), target_path.name, file_info['id']))
-                self.db.conn.commit()
+                self.db.update_file_path(file_info['id'], str(target_path))
         
         return str(target_path)
     
     def create_link(self, source, target, link_type='hard'):
-        """Tạo liên kết (hard link hoặc symbolic link)"""
+        """Tạo liên kết (hard link, symbolic link hoặc reflink)
+        
+        Reflink là bản sao dùng chung extent với file nguồn (FICLONE), chỉ có
+        trên hệ thống file hỗ trợ (Btrfs, XFS, ...); không hỗ trợ thì báo lỗi.
+        """
         source_path = Path(source)
         target_path = Path(target)
         
@@ -178,6 +174,8 @@ class FileMover:
                 os.link(str(source_path), str(target_path))
             elif link_type == 'symbolic':
                 os.symlink(str(source_path), str(target_path))
+            elif link_type == 'reflink':
+                copy_engine.copy_file(source_path, target_path, methods=('reflink',), compute_hash=False)
             else:
                 raise ValueError(f"Loại liên kết không hợp lệ: {link_type}")
         except Exception as e:
@@ -192,6 +190,80 @@ class FileMover:
         
         return str(target_path)
     
+    def replace_with_link(self, source, target, link_type='hard'):
+        """Thay file target (đã tồn tại) bằng liên kết tới source
+        
+        Liên kết được tạo ở đường dẫn tạm cạnh target rồi đổi tên đè lên target
+        (os.replace) nên target luôn tồn tại, kể cả khi bị dừng giữa chừng.
+        """
+        target_path = Path(target)
+        if not target_path.is_file() or target_path.is_symlink():
+            raise FileNotFoundError(f"File đích không tồn tại: {target}")
+        
+        temp_path = target_path.with_name(target_path.name + LINK_TEMP_SUFFIX)
+        self._remove_partial(temp_path)
+        self.create_link(source, temp_path, link_type)
+        try:
+            os.replace(str(temp_path), str(target_path))
+        except OSError:
+            self._remove_partial(temp_path)
+            raise
+        
+        return str(target_path)
+    
+    def replace_with_copy(self, source, target):
+        """Thay file target bằng bản sao độc lập của source (tách liên kết do replace_with_link tạo)"""
+        target_path = Path(target)
+        temp_path = target_path.with_name(target_path.name + LINK_TEMP_SUFFIX)
+        self._remove_partial(temp_path)
+        copy_engine.copy_file(source, temp_path, methods=('copy_file_range', 'sendfile', 'userspace'),
+                              compute_hash=False)
+        try:
+            os.replace(str(temp_path), str(target_path))
+        except OSError:
+            self._remove_partial(temp_path)
+            raise
+        
+        return str(target_path)
+    
+    def _same_device(self, source_path, target_path):
+        """Nguồn và thư mục đích có nằm trên cùng thiết bị (di chuyển bằng rename) không"""
+        try:
+            return os.stat(source_path).st_dev == os.stat(target_path.parent).st_dev
+        except OSError:
+            return False
+    
+    def _copy_with_hash(self, source_path, target_path):
+        """Sao chép nội dung và metadata bằng copy_engine
+        
+        Trả về hash SHA-256 nếu dữ liệu được sao chép qua userspace (tính trong
+        cùng lần đọc), None nếu sao chép bằng reflink hoặc trong kernel.
+        """
+        return copy_engine.copy_file(source_path, target_path, methods=self.copy_methods)['hash']
+    
+    def _verify_copy(self, source_path, target_path, source_hash, copied_hash):
+        """Bản sao có khớp với file nguồn không (trước khi xóa file nguồn)
+        
+        Có hash tính trong lúc sao chép: so trực tiếp với hash nguồn. Sao chép
+        không qua userspace (reflink, trong kernel): tính hash file đích. Không
+        biết hash nguồn: ít nhất so kích thước hai file.
+        """
+        if source_hash:
+            if copied_hash is None:
+                copied_hash = self._calculate_hash(target_path)
+            return copied_hash == source_hash
+        try:
+            return os.path.getsize(source_path) == os.path.getsize(target_path)
+        except OSError:
+            return False
+    
+    def _remove_partial(self, target_path):
+        """Xóa file đích dở dang sau khi sao chép lỗi"""
+        try:
+            os.remove(str(target_path))
+        except OSError:
+            pass
+    
     def _calculate_hash(self, file_path):
         """Tính toán hash SHA-256 của file"""
         h = hashlib.sha256()
@@ -223,9 +295,9 @@ class FileMover:
         # Thực thi hành động
         try:
             if action_type == 'move':
-                result = self.move_file(source, target)
+                result = self.move_file(source, target, source_hash=action_plan.get('source_hash'))
             elif action_type == 'copy':
-                result = self.copy_file(source, target)
+                result = self.copy_file(source, target, source_hash=action_plan.get('source_hash'))
             elif action_type == 'rename':
                 new_name = os.path.basename(target)
                 result = self.rename_file(source, new_name)
@@ -260,6 +332,7 @@ class FileMover:
                             # Bỏ qua nếu liên kết đã tồn tại
                             pass
                     
+                    self.db.bump_generation()
                     self.db.conn.commit()
             
             return {
@@ -0,0 +1,253 @@
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Tuple
+
+from actions.journal import ActionJournal
+from actions.mover import FileMover
+
+# Số luồng thực hiện thao tác file mặc định (thao tác chủ yếu chờ I/O)
+DEFAULT_WORKERS = 8
+
+# Số thao tác chạy đồng thời tối đa trên cùng một thiết bị lưu trữ
+PER_DEVICE_LIMIT = 4
+
+# Số kết quả được ghi vào database trong một transaction
+BATCH_SIZE = 500
+
+# Tên hành động trong actions_log (giống FileMover)
+_LOG_ACTIONS = {'move': 'move', 'copy': 'copy', 'rename': 'rename', 'link': 'link_hard'}
+
+
+def _path_key(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+class OrganizeTask:
+    """Các bước (theo thứ tự quy tắc) áp dụng cho một file
+
+    Các bước của cùng một file chạy tuần tự; bước sau dùng vị trí mới của file
+    nếu bước trước đã di chuyển hoặc đổi tên nó.
+    """
+
+    __slots__ = ('file_id', 'source', 'steps', 'tags', 'devices')
+
+    def __init__(self, file_id: int, source: str):
+        self.file_id = file_id
+        self.source = source
+        self.steps: List[Dict[str, Any]] = []
+        self.tags: List[str] = []
+        self.devices: Tuple[int, ...] = ()
+
+
+class Organizer:
+    """Tổ chức file theo quy tắc: lập kế hoạch một lần rồi thực hiện song song
+
+    Giai đoạn lập kế hoạch (luồng chính) tính mọi đường dẫn đích, phát hiện
+    xung đột (đích đã tồn tại hoặc hai file cùng một đích) và tạo mỗi thư mục
+    đích một lần. Giai đoạn thực hiện chạy các thao tác file trên nhiều luồng,
+    giới hạn số thao tác đồng thời trên mỗi thiết bị; nhật ký, đường dẫn mới
+    và thẻ được ghi vào database theo lô ở luồng chính (kết nối SQLite gắn với
+    luồng tạo ra nó).
+
+    Mọi thao tác của một lần thực hiện được ghi trước vào nhật ký (ActionJournal)
+    nên có thể phục hồi khi bị gián đoạn và hoàn tác bằng lệnh undo.
+    """
+
+    def __init__(self, db, rules_engine, workers: int = DEFAULT_WORKERS,
+                 per_device: int = PER_DEVICE_LIMIT, batch_size: int = BATCH_SIZE):
+        """Khởi tạo với database, máy luật và các giới hạn song song"""
+        self.db = db
+        self.rules_engine = rules_engine
+        self.workers = max(1, workers)
+        self.per_device = max(1, per_device)
+        self.batch_size = max(1, batch_size)
+        # Thao tác file ở luồng phụ không chạm vào database
+        self.mover = FileMover()
+        self.journal = ActionJournal(db)
+        self.batch_id = None
+        self.stats = {'planned': 0, 'conflicts': 0, 'skipped': 0, 'directories': 0}
+
+    def plan(self, matched_files, dry_run: bool = False) -> Tuple[List[OrganizeTask], List[Dict[str, Any]]]:
+        """Lập kế hoạch cho các cặp (file, quy tắc khớp)
+
+        Trả về (các task, các kết quả lỗi do xung đột). Bước có đích trùng vị trí
+        hiện tại của file bị bỏ qua.
+        """
+        tasks = []
+        conflicts = []
+        claimed = set()
+        directories = set()
+
+        for file_info, rules in matched_files:
+            task = OrganizeTask(file_info['id'], file_info['abs_path'])
+            current = task.source
+
+            for rule in rules:
+                plan = self.rules_engine.build_action_plan(
+                    rule.name, rule.action, dict(file_info, abs_path=current))
+                task.tags.extend(plan.get('tags', []))
+                if not plan['action_type']:
+                    continue
+
+                target = plan['target']
+                key = _path_key(target)
+                if key == _path_key(current):
+                    self.stats['skipped'] += 1
+                    continue
+                if key in claimed or os.path.lexists(target):
+                    error = f"Trùng đích với file khác: {target}" if key in claimed else f"File đích đã tồn tại: {target}"
+                    conflicts.append({
+                        'success': False,
+                        'source': current,
+                        'target': target,
+                        'action_type': plan['action_type'],
+                        'error': error
+                    })
+                    continue
+
+                claimed.add(key)
+                directories.add(os.path.dirname(target))
+                # Nội dung file không đổi qua các bước: hash trong database là hash nguồn
+                plan['source_hash'] = file_info.get('hash_sha256')
+                task.steps.append(plan)
+                if plan['action_type'] in ('move', 'rename'):
+                    current = target
+
+            if task.steps or task.tags:
+                tasks.append(task)
+
+        if not dry_run:
+            for directory in sorted(directories):
+                try:
+                    os.makedirs(directory, exist_ok=True)
+                except OSError:
+                    # Lỗi được báo lại khi thực hiện thao tác ghi vào thư mục này
+                    pass
+
+        device_cache = {}
+        for task in tasks:
+            paths = [task.source] + [step['target'] for step in task.steps]
+            task.devices = tuple(sorted({self._device(os.path.dirname(path), device_cache) for path in paths}))
+
+        self.stats['planned'] += sum(len(task.steps) for task in tasks)
+        self.stats['conflicts'] += len(conflicts)
+        self.stats['directories'] += len(directories)
+        return tasks, conflicts
+
+    def _device(self, directory: str, cache: Dict[str, int]) -> int:
+        """Thiết bị chứa thư mục (thư mục chưa tồn tại: thiết bị của thư mục cha gần nhất)"""
+        if directory in cache:
+            return cache[directory]
+        try:
+            device = os.stat(directory).st_dev
+        except OSError:
+            parent = os.path.dirname(directory)
+            device = self._device(parent, cache) if parent and parent != directory else 0
+        cache[directory] = device
+        return device
+
+    def execute(self, tasks: List[OrganizeTask], dry_run: bool = False) -> Iterator[Dict[str, Any]]:
+        """Thực hiện các task, trả về kết quả từng bước (thứ tự hoàn thành)"""
+        if dry_run:
+            for task in tasks:
+                for step in task.steps:
+                    yield self.mover.execute_action_plan(step, dry_run=True)
+            return
+
+        semaphores = {}
+        for task in tasks:
+            for device in task.devices:
+                if device not in semaphores:
+                    semaphores[device] = threading.BoundedSemaphore(self.per_device)
+
+        # Ghi ý định của mọi bước trước khi thực hiện
+        self.batch_id = self.journal.begin('organize')
+        action_ids = iter(self.journal.record_intents(self.batch_id, (
+            (task.file_id, _LOG_ACTIONS[step['action_type']], step['source'], step['target'])
+            for task in tasks for step in task.steps)))
+        step_ids = {id(task): [next(action_ids) for _ in task.steps] for task in tasks}
+
+        statuses = []
+        path_updates = []
+        tag_pairs = []
+
+        def record(task, results):
+            final_path = None
+            for index, action_id in enumerate(step_ids.pop(id(task))):
+                if index >= len(results):
+                    # Bước sau bước lỗi không được thực hiện
+                    statuses.append(('skipped', action_id))
+                    continue
+                result = results[index]
+                statuses.append(('completed' if result['success'] else 'failed', action_id))
+                if result['success'] and result['action_type'] in ('move', 'rename'):
+                    final_path = result['target']
+            if final_path:
+                path_updates.append((task.file_id, final_path))
+            if all(result['success'] for result in results):
+                tag_pairs.extend((task.file_id, tag) for tag in dict.fromkeys(task.tags))
+
+        def flush():
+            # Trạng thái và đường dẫn mới được ghi trong cùng transaction
+            self.journal.complete(statuses, path_updates)
+            self.db.add_file_tags(tag_pairs)
+            statuses.clear()
+            path_updates.clear()
+            tag_pairs.clear()
+
+        # Giữ số task đang chờ có giới hạn thay vì submit toàn bộ một lúc
+        max_pending = self.workers * 4
+        remaining = iter(tasks)
+        pending = set()
+        finished = False
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='organize') as executor:
+            try:
+                while True:
+                    for task in remaining:
+                        pending.add(executor.submit(self._run_task, task, semaphores))
+                        if len(pending) >= max_pending:
+                            break
+                    if not pending:
+                        break
+
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    # Ghi nhận mọi task đã xong trước khi trả kết quả: generator có thể bị đóng
+                    # ở bất kỳ lần yield nào
+                    completed = []
+                    for future in done:
+                        task, results = future.result()
+                        record(task, results)
+                        completed.extend(results)
+                    yield from completed
+
+                    if len(statuses) + len(tag_pairs) >= self.batch_size:
+                        flush()
+                finished = True
+            finally:
+                # Khi bị gián đoạn: hủy task chưa chạy, vẫn ghi lại các thao tác đã thực hiện;
+                # các bước chưa chạy giữ trạng thái 'pending' và được đối chiếu khi phục hồi
+                # (recover xử lý cả lô 'interrupted')
+                for future in pending:
+                    if not future.cancel():
+                        record(*future.result())
+                flush()
+                self.journal.finish(self.batch_id, 'completed' if finished else 'interrupted')
+
+    def _run_task(self, task: OrganizeTask, semaphores) -> Tuple[OrganizeTask, List[Dict[str, Any]]]:
+        """Chạy tuần tự các bước của một file (ở luồng phụ), giữ suất của các thiết bị liên quan"""
+        # Lấy semaphore theo thứ tự thiết bị cố định để tránh deadlock
+        for device in task.devices:
+            semaphores[device].acquire()
+        try:
+            results = []
+            for step in task.steps:
+                result = self.mover.execute_action_plan(step)
+                results.append(result)
+                if not result['success']:
+                    break
+            return task, results
+        finally:
+            for device in reversed(task.devices):
+                semaphores[device].release()
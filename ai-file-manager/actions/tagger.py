@@ -1,6 +1,8 @@
 import sqlite3
 from pathlib import Path
 
+from search.hydrate import fetch_tags
+
 class FileTagger:
     """Lớp xử lý việc gắn thẻ cho các tập tin"""
     
@@ -44,6 +46,7 @@ class FileTagger:
             cursor.execute(
                 "INSERT INTO file_tags (file_id, tag_id) VALUES (?, ?)",
                 (file_info['id'], tag_id))
+            self.db.bump_generation()
             self.db.conn.commit()
             
             # Ghi log
@@ -81,6 +84,7 @@ class FileTagger:
             if cursor.rowcount == 0:
                 return {'success': False, 'error': f"File không có tag '{tag_name}'"}
             
+            self.db.bump_generation()
             self.db.conn.commit()
             
             # Ghi log
@@ -124,6 +128,14 @@ class FileTagger:
         tags = [row['name'] for row in cursor.fetchall()]
         return tags
     
+    def get_tags_for_files(self, file_ids):
+        """Lấy thẻ của nhiều file cùng lúc: {file_id: [tên thẻ]}
+        
+        Dùng một truy vấn join cho mỗi lô id (search.hydrate.fetch_tags) thay vì
+        một truy vấn cho từng file.
+        """
+        return fetch_tags(self.db.conn, file_ids)
+    
     def get_files_by_tag(self, tag_name):
         """Lấy danh sách file có thẻ cụ thể"""
         # Lấy ID của tag
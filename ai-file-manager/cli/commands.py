@@ -1,6 +1,7 @@
 import os
 import sys
 import argparse
+import itertools
 import yaml
 from pathlib import Path
 from typing import List, Dict, Any, Optional
@@ -8,19 +9,21 @@ from typing import List, Dict, Any, Optional
 # Thêm thư mục gốc vào sys.path để import các module khác
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from core.cache import query_cache
 from core.ingest import FileIngestor
 from core.db import Database
-from core.mimetype import MimeTypeDetector
-from extractors.images import ImageExtractor
-from extractors.pdfs import PDFExtractor
-from extractors.videos import VideoExtractor
 from rules.engine import RulesEngine
-from rules.schemas import get_rule_template
+from rules.planner import RulePlanner
+from actions.deduper import LINK_TYPES, VERIFY_MODES, Deduper
+from actions.journal import ActionJournal
 from actions.mover import FileMover
+from actions.organizer import DEFAULT_WORKERS, PER_DEVICE_LIMIT, Organizer
 from actions.tagger import FileTagger
-from search.indexer import ContentIndexer
 from search.searcher import FileSearcher
 
+# Các module nặng (numpy, FAISS, sentence-transformers, pdfplumber, marshmallow)
+# chỉ được import trong lệnh cần tới để các lệnh như `tag` khởi động nhanh
+
 class CommandHandler:
     """Lớp xử lý các lệnh từ giao diện dòng lệnh"""
     
@@ -31,10 +34,23 @@ class CommandHandler:
         self.ingestor = None
         self.rules_engine = None
         self.file_mover = None
+        self.journal = None
         self.file_tagger = None
         self.content_indexer = None
         self.file_searcher = None
     
+    @property
+    def content_indexer(self):
+        """ContentIndexer chỉ được tạo khi một lệnh thực sự cần tới chỉ mục nội dung"""
+        if self._content_indexer is None and self.db is not None:
+            from search.indexer import ContentIndexer
+            self._content_indexer = ContentIndexer(self.db)
+        return self._content_indexer
+    
+    @content_indexer.setter
+    def content_indexer(self, value):
+        self._content_indexer = value
+    
     def setup(self, db_path: str):
         """Thiết lập các đối tượng cần thiết"""
         self.db_path = db_path
@@ -45,8 +61,15 @@ class CommandHandler:
         self.rules_engine = RulesEngine()
         self.file_mover = FileMover(self.db)
         self.file_tagger = FileTagger(self.db)
-        self.content_indexer = ContentIndexer(self.db)
+        self.content_indexer = None
         self.file_searcher = FileSearcher(self.db)
+        
+        # Đồng bộ lại các lô thao tác bị gián đoạn ở lần chạy trước
+        self.journal = ActionJournal(self.db)
+        recovered = self.journal.recover()
+        if recovered['batches']:
+            print(f"Đã phục hồi {recovered['batches']} lô bị gián đoạn: "
+                  f"{recovered['completed']} thao tác đã hoàn tất, {recovered['failed']} thao tác chưa thực hiện")
     
     def ingest_command(self, args):
         """Xử lý lệnh ingest"""
@@ -90,95 +113,168 @@ class CommandHandler:
         print(f"Đang tải quy tắc từ: {rules_path}")
         self.rules_engine.load_rules(str(rules_path))
         
-        # Lấy danh sách file cần tổ chức
-        cursor = self.db.conn.cursor()
+        # Giới hạn tập file theo đường dẫn nguồn (nếu có)
+        scope = None
         if args.source:
             source_path = Path(args.source)
             if source_path.is_file():
-                cursor.execute(
-                    "SELECT * FROM files WHERE abs_path = ?",
-                    (str(source_path),))
+                scope = ("abs_path = ?", [str(source_path)])
             else:
-                cursor.execute(
-                    "SELECT * FROM files WHERE abs_path LIKE ?",
-                    (f"{str(source_path)}%",))
-        else:
-            cursor.execute("SELECT * FROM files")
+                scope = ("abs_path LIKE ?", [f"{str(source_path)}%"])
+        
+        # Chỉ đọc các file ứng viên của từng quy tắc (điều kiện được đẩy xuống SQL)
+        planner = RulePlanner(self.db, self.rules_engine.compiled_rules)
+        matched_files = planner.match(scope)
+        print(f"Tìm thấy {len(matched_files)} file khớp quy tắc")
         
-        files = cursor.fetchall()
-        print(f"Tìm thấy {len(files)} file để tổ chức")
+        # Lập kế hoạch (đích, xung đột, thư mục) rồi thực hiện song song
+        organizer = Organizer(self.db, self.rules_engine, workers=args.workers,
+                              per_device=args.per_device)
+        tasks, conflicts = organizer.plan(matched_files, dry_run=args.dry_run)
         
-        # Áp dụng quy tắc và thực hiện hành động
         success_count = 0
         error_count = 0
         
-        for file_info in files:
-            file_info = dict(file_info)
-            action_plans = self.rules_engine.apply_rules(file_info)
-            
-            if not action_plans:
-                continue
-            
-            # Xử lý từng action plan trong danh sách
-            for action_plan in action_plans:
-                action = action_plan.get('action')
-                if not action:
-                    continue
-                    
-                result = self.file_mover.execute_action_plan(action, dry_run=args.dry_run)
-            
-                if result and result.get('success'):
-                    success_count += 1
-                    if args.verbose:
-                        print(f"Thành công: {result['action_type']}: {result['source']} -> {result['target']}")
-                else:
-                    error_count += 1
-                    if args.verbose or args.show_errors:
-                        print(f"Lỗi: {result.get('error', 'Không rõ')} - {result.get('source')}")
+        for result in itertools.chain(conflicts, organizer.execute(tasks, dry_run=args.dry_run)):
+            if result and result.get('success'):
+                success_count += 1
+                if args.verbose:
+                    print(f"Thành công: {result['action_type']}: {result['source']} -> {result['target']}")
+            else:
+                error_count += 1
+                if args.verbose or args.show_errors:
+                    print(f"Lỗi: {result.get('error', 'Không rõ')} - {result.get('source')}")
         
         print(f"Kết quả: {success_count} thành công, {error_count} lỗi")
+        if organizer.batch_id:
+            print(f"Mã lô: {organizer.batch_id} (hoàn tác bằng: undo {organizer.batch_id})")
+        if args.verbose:
+            print(f"Kế hoạch thực hiện: {organizer.stats['planned']} thao tác, "
+                  f"{organizer.stats['conflicts']} xung đột, {organizer.stats['skipped']} file đã đúng vị trí, "
+                  f"{organizer.stats['directories']} thư mục đích")
+            plan_stats = planner.stats()
+            print(f"Lọc quy tắc: {plan_stats['pushed_down_rules']}/{plan_stats['rules']} quy tắc lọc bằng SQL, "
+                  f"{plan_stats['rows_fetched']} dòng được đọc qua {plan_stats['queries']} truy vấn")
+        if args.verbose and planner.full_scan:
+            stats = self.rules_engine.get_stats()
+            print(f"Quy tắc: trung bình {stats['rules_per_file']:.1f}/{stats['rules']} quy tắc "
+                  f"được đánh giá cho mỗi file ({stats['unindexed_rules']} quy tắc không đánh chỉ mục)")
         return 0
     
+    def dedupe_command(self, args):
+        """Xử lý lệnh dedupe"""
+        if not self.db or not self.file_searcher:
+            self.setup(args.db_path)
+        
+        # Nhóm file trùng lặp theo hash nội dung trong database
+        duplicate_groups = self.file_searcher.search_duplicates(by_content=True)
+        deduper = Deduper(self.db, link_type=args.link_type, verify=args.verify, workers=args.workers)
+        tasks = deduper.plan(duplicate_groups)
+        print(f"Tìm thấy {len(duplicate_groups)} nhóm file trùng lặp, {len(tasks)} file sẽ được thay bằng liên kết")
+        
+        success_count = 0
+        error_count = 0
+        reclaimed = 0
+        
+        for result in deduper.execute(tasks, dry_run=args.dry_run):
+            if result['success']:
+                success_count += 1
+                reclaimed += result['reclaimed']
+                if args.verbose:
+                    print(f"Thành công: {result['target']} -> {result['source']}")
+            else:
+                error_count += 1
+                print(f"Lỗi: {result.get('error', 'Không rõ')} - {result['target']}")
+        
+        verb = "Có thể giải phóng" if args.dry_run else "Đã giải phóng"
+        print(f"Kết quả: {success_count} thành công, {error_count} lỗi, {deduper.stats['skipped']} file bỏ qua")
+        print(f"{verb} {reclaimed} bytes ({reclaimed / (1 << 20):.1f} MB)")
+        if deduper.batch_id:
+            print(f"Mã lô: {deduper.batch_id} (hoàn tác bằng: undo {deduper.batch_id})")
+        return 0
+    
+    def undo_command(self, args):
+        """Xử lý lệnh undo"""
+        if not self.db or not self.journal:
+            self.setup(args.db_path)
+        
+        if args.list or args.batch is None:
+            batches = self.journal.list_batches(args.limit)
+            if not batches:
+                print("Chưa có lô thao tác nào")
+                return 0
+            print("Các lô thao tác gần đây:")
+            for batch in batches:
+                print(f"  #{batch['id']} {batch['command']} [{batch['status']}] {batch['started_ts']}: "
+                      f"{batch['completed'] or 0}/{batch['total']} hoàn tất, "
+                      f"{batch['failed'] or 0} lỗi, {batch['undone'] or 0} đã hoàn tác")
+            return 0
+        
+        try:
+            result = self.journal.undo(args.batch)
+        except ValueError as e:
+            print(f"Lỗi: {e}")
+            return 1
+        
+        for error in result['errors']:
+            print(f"Lỗi: {error}")
+        print(f"Đã hoàn tác {result['undone']} thao tác, {result['failed']} lỗi (lô hoàn tác: {result['batch_id']})")
+        return 0 if not result['failed'] else 1
+    
     def search_command(self, args):
         """Xử lý lệnh search"""
         if not self.db or not self.file_searcher:
             self.setup(args.db_path)
         
         results = []
+        next_cursor = None
         
-        # Tìm kiếm theo các tiêu chí khác nhau
-        if args.filename:
-            results = self.file_searcher.search_by_filename(args.filename, args.case_sensitive)
-        elif args.extension:
-            results = self.file_searcher.search_by_extension(args.extension)
-        elif args.mimetype:
-            results = self.file_searcher.search_by_mimetype(args.mimetype)
-        elif args.tag:
-            results = self.file_searcher.search_by_tag(args.tag)
-        elif args.duplicates:
-            duplicate_groups = self.file_searcher.search_duplicates(by_content=True)
-            print(f"Tìm thấy {len(duplicate_groups)} nhóm file trùng lặp:")
+        # Tìm kiếm nội dung theo ngữ nghĩa, lọc trước theo các tiêu chí khác
+        if args.content and args.hybrid:
+            # Tìm kiếm kết hợp BM25 + vector (hợp nhất bằng reciprocal rank fusion)
+            from search.hybrid import HybridSearcher
             
-            for i, group in enumerate(duplicate_groups):
-                print(f"\nNhóm {i+1} ({len(group)} file):")
-                for file in group:
-                    print(f"  {file['abs_path']} ({file['size']} bytes)")
+            if self.content_indexer.index is None:
+                self.content_indexer.build_faiss_index()
+            
+            searcher = HybridSearcher(self.content_indexer)
+            try:
+                response = searcher.search(args.content, top_k=args.limit,
+                                           criteria=self._search_criteria(args))
+            finally:
+                searcher.close()
+            
+            results = response['results']
+            print(f"Tìm thấy {len(results)} kết quả:")
+            for i, result in enumerate(results):
+                print(f"\n{i+1}. {result['filename']} (RRF: {result['score']:.4f}, "
+                      f"BM25 #{result['lexical_rank'] or '-'}, vector #{result['vector_rank'] or '-'})")
+                print(f"   Đường dẫn: {result['file_path']}")
+                if result['snippet']:
+                    print(f"   Trích đoạn: {result['snippet']}")
+                elif args.show_content and result['content']:
+                    print(f"   Nội dung: {result['content'][:200]}...")
+            
+            timings = ", ".join(f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in response['timings'].items())
+            print(f"\nThời gian: {timings}")
             
             return 0
         elif args.content and args.vector_search:
-            # Tìm kiếm vector
-            if not self.content_indexer:
-                self.content_indexer = ContentIndexer(self.db)
+            if args.precision:
+                self.content_indexer.index_precision = args.precision
             
             # Xây dựng chỉ mục nếu cần
             if args.rebuild_index:
                 print("Đang tạo embedding...")
                 self.content_indexer.create_embeddings(rebuild=True)
+            if args.rebuild_index or self.content_indexer.index is None:
                 print("Đang xây dựng chỉ mục FAISS...")
                 self.content_indexer.build_faiss_index()
             
             print(f"Đang tìm kiếm: {args.content}")
-            results = self.content_indexer.search(args.content, top_k=args.limit)
+            # Các tiêu chí khác (--mimetype, --extension, --root, ...) lọc trước khi tìm vector
+            results = self.content_indexer.search(args.content, top_k=args.limit,
+                                                  criteria=self._search_criteria(args))
             
             # Hiển thị kết quả
             print(f"Tìm thấy {len(results)} kết quả:")
@@ -189,52 +285,96 @@ class CommandHandler:
                     print(f"   Nội dung: {result['content'][:200]}...")
             
             return 0
-        elif args.content:
-            # Tìm kiếm từ khóa trong nội dung
-            cursor = self.db.conn.cursor()
-            cursor.execute(
-                """SELECT f.* 
-                   FROM files f 
-                   JOIN content_index ci ON f.id = ci.file_id 
-                   WHERE ci.content LIKE ? 
-                   LIMIT ?""",
-                (f"%{args.content}%", args.limit))
+        # Tìm kiếm theo tên phân biệt hoa/thường (quét LIKE, không phân trang)
+        elif args.filename and args.case_sensitive:
+            results = self.file_searcher.search_by_filename(args.filename, args.case_sensitive, limit=args.limit)
+        elif args.duplicates and not (args.filename or args.extension or args.mimetype or args.tag):
+            duplicate_groups = self.file_searcher.search_duplicates(by_content=True)
+            print(f"Tìm thấy {len(duplicate_groups)} nhóm file trùng lặp:")
             
-            results = [dict(row) for row in cursor.fetchall()]
+            for i, group in enumerate(duplicate_groups):
+                print(f"\nNhóm {i+1} ({len(group)} file):")
+                for file in group:
+                    print(f"  {file['abs_path']} ({file['size']} bytes)")
+            
+            return 0
+        elif args.content and not (args.filename or args.extension or args.mimetype or args.tag):
+            # Tìm kiếm toàn văn (FTS5, xếp hạng BM25) trong nội dung
+            from search.fulltext import search_files
+            results = search_files(self.db.conn, args.content, args.limit)
+            
+            if results is None:
+                # SQLite không có FTS5: quét bằng LIKE
+                cursor = self.db.conn.cursor()
+                cursor.execute(
+                    """SELECT DISTINCT f.* 
+                       FROM files f 
+                       JOIN content_index ci ON f.id = ci.file_id 
+                       WHERE ci.content LIKE ? 
+                       LIMIT ?""",
+                    (f"%{args.content}%", args.limit))
+                
+                results = [dict(row) for row in cursor.fetchall()]
         else:
-            # Tìm kiếm kết hợp
-            criteria = {}
-            if args.min_size:
-                criteria['min_size'] = args.min_size
-            if args.max_size:
-                criteria['max_size'] = args.max_size
-            if args.start_date:
-                criteria['start_date'] = args.start_date
-            if args.end_date:
-                criteria['end_date'] = args.end_date
-            
-            if criteria:
-                results = self.file_searcher.search_by_multiple_criteria(criteria)
-            else:
+            # Tìm kiếm theo các tiêu chí metadata, mỗi lần một trang (LIMIT trong SQL)
+            criteria = self._search_criteria(args)
+            if args.filename:
+                criteria['filename'] = args.filename
+            
+            if not criteria:
                 print("Lỗi: Vui lòng cung cấp ít nhất một tiêu chí tìm kiếm")
                 return 1
+            
+            try:
+                page = self.file_searcher.search_page(criteria, limit=args.limit,
+                                                      cursor=args.cursor, page=args.page)
+            except ValueError as e:
+                print(f"Lỗi: {e}")
+                return 1
+            
+            results = page['results']
+            next_cursor = page['next_cursor']
         
         # Hiển thị kết quả
+        shown = results[:args.limit]
+        
+        # Lấy thẻ của mọi kết quả hiển thị trong một lần truy vấn
+        tags_by_file = {}
+        if args.show_tags and self.file_tagger:
+            tags_by_file = self.file_tagger.get_tags_for_files(
+                [file['id'] for file in shown if 'id' in file])
+        
         print(f"Tìm thấy {len(results)} kết quả:")
-        for i, file in enumerate(results[:args.limit]):
+        for i, file in enumerate(shown):
             print(f"{i+1}. {file['filename']} ({file['size']} bytes)")
             print(f"   Đường dẫn: {file['abs_path']}")
             print(f"   Ngày tạo: {file['created_ts']}")
+            if file.get('snippet'):
+                print(f"   Trích đoạn: {file['snippet']}")
             
             if args.show_tags and self.file_tagger:
-                tags = self.file_tagger.get_file_tags(file['abs_path'])
+                tags = tags_by_file.get(file.get('id'))
                 if tags:
                     print(f"   Tags: {', '.join(tags)}")
             
             print()
         
+        if next_cursor:
+            print(f"Còn kết quả, xem trang tiếp theo bằng: --cursor {next_cursor}")
+        
         return 0
     
+    def _search_criteria(self, args):
+        """Các tiêu chí lọc metadata từ tham số dòng lệnh"""
+        criteria = {}
+        for key, value in (('mimetype', args.mimetype), ('extension', args.extension),
+                           ('tag', args.tag), ('root', args.root),
+                           ('min_size', args.min_size), ('max_size', args.max_size),
+                           ('start_date', args.start_date), ('end_date', args.end_date)):
+            if value:
+                criteria[key] = value
+        return criteria
+    
     def tag_command(self, args):
         """Xử lý lệnh tag"""
         if not self.db or not self.file_tagger:
@@ -314,6 +454,7 @@ class CommandHandler:
                         with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
                             content = f.read()
                     elif mime_type == 'application/pdf':
+                        from extractors.pdfs import PDFExtractor
                         pdf_extractor = PDFExtractor()
                         content = pdf_extractor.extract_text(file_path)
                     
@@ -325,7 +466,7 @@ class CommandHandler:
             
             # Tạo embedding
             print("Đang tạo embedding...")
-            self.content_indexer.create_embeddings(rebuild=True)
+            self.content_indexer.create_embeddings(rebuild=True, workers=args.workers)
             
             # Xây dựng chỉ mục FAISS
             print("Đang xây dựng chỉ mục FAISS...")
@@ -333,6 +474,55 @@ class CommandHandler:
             
             print("Hoàn thành đánh chỉ mục")
         
+        elif args.embed:
+            # Tạo embedding còn thiếu, tiếp tục từ checkpoint nếu lần trước bị gián đoạn
+            if not self.content_indexer.create_embeddings(rebuild=False, workers=args.workers):
+                return 1
+            
+            stats = self.content_indexer.job_stats
+            print(f"Đã tạo {stats['processed']} embedding "
+                  f"trong {stats['elapsed']:.1f}s ({stats['chunks_per_second']:.1f} đoạn/s)")
+            print(f"  - Encode mới: {stats['encoded']}, lấy từ cache: {stats['cache_hits']}")
+        
+        elif args.benchmark:
+            # Đo thông lượng encode theo số tiến trình trên mẫu các đoạn văn bản
+            from search.encoders import benchmark_encoder
+            
+            cursor = self.db.conn.cursor()
+            cursor.execute("SELECT content FROM content_index LIMIT ?", (args.benchmark_size,))
+            texts = [row['content'] or '' for row in cursor.fetchall()]
+            if not texts:
+                print("Không có đoạn văn bản nào để đo hiệu năng")
+                return 1
+            
+            worker_counts = sorted({1, 2, 4, os.cpu_count() or 1})
+            print(f"Đang đo thông lượng encode trên {len(texts)} đoạn văn bản...")
+            for result in benchmark_encoder(texts, worker_counts, model_name=self.content_indexer.model_name):
+                print(f"  - {result['workers']} tiến trình: "
+                      f"{result['chunks_per_second']:.1f} đoạn/s ({result['elapsed']:.1f}s)")
+        
+        elif args.quantization_report:
+            # So sánh bộ nhớ và recall của các độ chính xác trên mẫu embedding đã lưu
+            import numpy as np
+            from search.quantization import measure_tradeoffs
+            from search.vector_store import vector_from_bytes
+            
+            cursor = self.db.conn.cursor()
+            cursor.execute("SELECT vector, dtype FROM embeddings LIMIT ?", (args.benchmark_size,))
+            rows = cursor.fetchall()
+            if len(rows) < 2:
+                print("Không đủ embedding để đo độ chính xác lượng tử hóa")
+                return 1
+            
+            vectors = np.stack([vector_from_bytes(row['vector'], row['dtype'] or 'float32') for row in rows])
+            queries = vectors[np.random.default_rng(0).choice(len(vectors), min(50, len(vectors)), replace=False)]
+            
+            print(f"Độ chính xác lượng tử hóa trên {len(vectors)} embedding (recall@10):")
+            for result in measure_tradeoffs(vectors, queries, top_k=10):
+                rerank = " + xếp hạng lại" if result['rerank'] else ""
+                print(f"  - {result['precision']}{rerank}: {result['bytes_per_vector']} bytes/vector, "
+                      f"{result['memory_bytes'] / 1024:.1f} KB, recall {result['recall']:.3f}")
+        
         elif args.status:
             # Hiển thị trạng thái chỉ mục
             cursor = self.db.conn.cursor()
@@ -345,7 +535,16 @@ class CommandHandler:
             
             print("Trạng thái chỉ mục:")
             print(f"  - Số đoạn văn bản đã đánh chỉ mục: {content_count}")
+            cursor.execute("SELECT COUNT(*) as count FROM embedding_cache")
+            cache_count = cursor.fetchone()['count']
+            
             print(f"  - Số embedding đã tạo: {embedding_count}")
+            print(f"  - Số embedding trong cache: {cache_count}")
+            
+            stats = query_cache.stats()
+            print(f"  - Thế hệ dữ liệu: {self.db.generation}")
+            print(f"  - Cache truy vấn: {stats['entries']}/{stats['max_entries']} mục, "
+                  f"tỉ lệ trúng {stats['hit_ratio']:.1%} ({stats['hits']} trúng, {stats['misses']} trượt)")
         
         return 0
     
@@ -403,6 +602,7 @@ class CommandHandler:
         # Tạo file quy tắc mẫu
         default_rules_path = rules_dir / "default.yaml"
         if not default_rules_path.exists() or args.force:
+            from rules.schemas import get_rule_template
             template = get_rule_template()
             
             with open(default_rules_path, 'w', encoding='utf-8') as f:
@@ -500,6 +700,70 @@ def main():
         action="store_true",
         help="Chỉ hiển thị các lỗi"
     )
+    organize_parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Số luồng thực hiện thao tác file song song"
+    )
+    organize_parser.add_argument(
+        "--per-device",
+        type=int,
+        default=PER_DEVICE_LIMIT,
+        help="Số thao tác đồng thời tối đa trên mỗi thiết bị lưu trữ"
+    )
+    
+    # Lệnh dedupe
+    dedupe_parser = subparsers.add_parser("dedupe", help="Thay file trùng lặp bằng liên kết")
+    dedupe_parser.add_argument(
+        "--link-type",
+        choices=LINK_TYPES,
+        default="hard",
+        help="Loại liên kết (reflink cần hệ thống file hỗ trợ như Btrfs, XFS)"
+    )
+    dedupe_parser.add_argument(
+        "--verify",
+        choices=VERIFY_MODES,
+        default="bytes",
+        help="Xác minh nội dung trước khi thay: so từng byte hoặc tin hash đã lưu"
+    )
+    dedupe_parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Số luồng xác minh và thay thế song song"
+    )
+    dedupe_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Chỉ hiển thị kế hoạch, không thực hiện thay đổi"
+    )
+    dedupe_parser.add_argument(
+        "--verbose",
+        "-v",
+        action="store_true",
+        help="Hiển thị thông tin chi tiết"
+    )
+    
+    # Lệnh undo
+    undo_parser = subparsers.add_parser("undo", help="Hoàn tác một lô thao tác file")
+    undo_parser.add_argument(
+        "batch",
+        type=int,
+        nargs="?",
+        help="Mã lô cần hoàn tác (in ra sau lệnh organize)"
+    )
+    undo_parser.add_argument(
+        "--list",
+        action="store_true",
+        help="Liệt kê các lô thao tác gần đây"
+    )
+    undo_parser.add_argument(
+        "--limit",
+        type=int,
+        default=20,
+        help="Số lô hiển thị khi liệt kê"
+    )
     
     # Lệnh search
     search_parser = subparsers.add_parser("search", help="Tìm kiếm file")
@@ -528,6 +792,20 @@ def main():
         action="store_true",
         help="Sử dụng tìm kiếm vector cho nội dung"
     )
+    search_parser.add_argument(
+        "--hybrid",
+        action="store_true",
+        help="Tìm kiếm nội dung kết hợp BM25 và vector (reciprocal rank fusion)"
+    )
+    search_parser.add_argument(
+        "--precision",
+        choices=["float32", "float16", "int8", "binary"],
+        help="Độ chính xác của chỉ mục vector trong bộ nhớ (int8/binary được xếp hạng lại bằng vector đầy đủ)"
+    )
+    search_parser.add_argument(
+        "--root",
+        help="Chỉ tìm các file nằm trong thư mục này"
+    )
     search_parser.add_argument(
         "--min-size",
         type=int,
@@ -560,7 +838,16 @@ def main():
         "--limit",
         type=int,
         default=10,
-        help="Số lượng kết quả tối đa"
+        help="Số lượng kết quả tối đa (số kết quả mỗi trang)"
+    )
+    search_parser.add_argument(
+        "--page",
+        type=int,
+        help="Số trang cần hiển thị (từ 1) khi tìm theo metadata"
+    )
+    search_parser.add_argument(
+        "--cursor",
+        help="Cursor của trang tiếp theo (in ra ở cuối trang trước)"
     )
     search_parser.add_argument(
         "--show-tags",
@@ -610,6 +897,33 @@ def main():
         action="store_true",
         help="Xây dựng lại chỉ mục nội dung"
     )
+    index_parser.add_argument(
+        "--embed",
+        action="store_true",
+        help="Tạo embedding cho các đoạn chưa có (tiếp tục nếu bị gián đoạn)"
+    )
+    index_parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Số tiến trình CPU dùng để tạo embedding"
+    )
+    index_parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Đo thông lượng tạo embedding (đoạn/giây) theo số tiến trình"
+    )
+    index_parser.add_argument(
+        "--benchmark-size",
+        type=int,
+        default=1000,
+        help="Số đoạn văn bản dùng để đo hiệu năng"
+    )
+    index_parser.add_argument(
+        "--quantization-report",
+        action="store_true",
+        help="Đo bộ nhớ và recall của chỉ mục float32/float16/int8/binary"
+    )
     index_parser.add_argument(
         "--status",
         action="store_true",
@@ -628,6 +942,10 @@ def main():
         return handler.ingest_command(args)
     elif args.command == "organize":
         return handler.organize_command(args)
+    elif args.command == "dedupe":
+        return handler.dedupe_command(args)
+    elif args.command == "undo":
+        return handler.undo_command(args)
     elif args.command == "search":
         return handler.search_command(args)
     elif args.command == "tag":
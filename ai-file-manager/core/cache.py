@@ -0,0 +1,145 @@
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+def normalize_query(value: Any) -> Any:
+    """Chuẩn hóa tham số truy vấn để các truy vấn tương đương dùng chung khóa cache
+
+    Chuỗi chỉ được chuẩn hóa khoảng trắng (không đổi hoa/thường vì một số tìm
+    kiếm phân biệt hoa/thường).
+    """
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    if isinstance(value, dict):
+        return {str(k): normalize_query(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (set, frozenset)):
+        return sorted(normalize_query(v) for v in value)
+    if isinstance(value, (list, tuple)):
+        return [normalize_query(v) for v in value]
+    return value
+
+
+def make_key(namespace: str, *args, **kwargs) -> str:
+    """Tạo khóa cache từ tên thao tác và các tham số đã chuẩn hóa"""
+    payload = [namespace, normalize_query(list(args)), normalize_query(kwargs)]
+    return json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False)
+
+
+def _copy_result(value: Any) -> Any:
+    # Sao chép đệ quy list/dict (ví dụ {'results': [dòng, ...]} của search_page)
+    # để nơi gọi sửa kết quả không làm hỏng cache
+    if isinstance(value, list):
+        return [_copy_result(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _copy_result(item) for key, item in value.items()}
+    if isinstance(value, set):
+        return set(value)
+    return value
+
+
+class QueryCache:
+    """Cache kết quả truy vấn dạng LRU có thời hạn (TTL)
+
+    Mỗi mục được gắn với "thế hệ" (generation) của database lúc tính toán. Mọi
+    thao tác ghi làm tăng thế hệ, nên mục cũ không bao giờ được trả về sau khi
+    dữ liệu đã thay đổi.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 300.0):
+        """Khởi tạo với số mục tối đa và thời gian sống của mỗi mục (giây)"""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, generation: Any):
+        """Trả về (True, giá trị) nếu có mục hợp lệ, ngược lại (False, None)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_generation, expires, value = entry
+                if entry_generation == generation and expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, _copy_result(value)
+                del self._entries[key]
+
+            self.misses += 1
+            return False, None
+
+    def put(self, key: Hashable, generation: Any, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (generation, time.monotonic() + self.ttl, _copy_result(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def cached(self, key: Hashable, generation: Any, compute: Callable[[], Any]) -> Any:
+        """Lấy kết quả từ cache hoặc tính bằng compute() rồi lưu lại"""
+        hit, value = self.get(key, generation)
+        if hit:
+            return value
+
+        value = compute()
+        self.put(key, generation, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê số lần trúng/trượt và tỉ lệ trúng cache"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'entries': len(self._entries),
+            'max_entries': self.max_entries
+        }
+
+
+# Cache dùng chung trong tiến trình (CLI, web và các bộ tìm kiếm)
+query_cache = QueryCache()
+
+
+def resolve_cache(cache: Any = None) -> Optional[QueryCache]:
+    """None: dùng cache chung, False: tắt cache, còn lại: dùng cache được truyền vào"""
+    if cache is None:
+        return query_cache
+    if cache is False:
+        return None
+    return cache
+
+
+def cached_query(namespace: str, context: Tuple[str, ...] = ()):
+    """Decorator cache kết quả của phương thức truy vấn
+
+    Đối tượng cần có thuộc tính db (có generation) và cache (QueryCache hoặc
+    None để tắt cache). context là tên các thuộc tính bổ sung vào khóa, ví dụ
+    phiên bản của chỉ mục vector trong bộ nhớ.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            cache = getattr(self, 'cache', None)
+            if cache is None:
+                return func(self, *args, **kwargs)
+
+            scope = [getattr(self.db, 'db_path', None)]
+            scope.extend(getattr(self, name, None) for name in context)
+
+            key = make_key(namespace, scope, *args, **kwargs)
+            return cache.cached(key, self.db.generation, lambda: func(self, *args, **kwargs))
+        return wrapper
+    return decorator
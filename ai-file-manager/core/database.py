@@ -11,6 +11,16 @@ class Database:
         try:
             self.conn = sqlite3.connect(self.db_path)
             self.cursor = self.conn.cursor()
+            
+            # Bảng meta lưu thế hệ dữ liệu (dùng để vô hiệu hóa cache truy vấn)
+            self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER
+            )
+            ''')
+            self.cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)")
+            self.conn.commit()
             return True
         except sqlite3.Error as e:
             print(f"Lỗi kết nối đến cơ sở dữ liệu: {e}")
@@ -76,6 +86,8 @@ class Database:
                 self.connect()
             
             self.cursor.execute(query, params)
+            # Mọi thao tác ghi đều làm tăng thế hệ dữ liệu
+            self.cursor.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
             self.conn.commit()
             return True
         except sqlite3.Error as e:
@@ -91,4 +103,10 @@ class Database:
             return self.cursor.fetchall()
         except sqlite3.Error as e:
             print(f"Lỗi truy vấn dữ liệu: {e}")
-            return []
\ No newline at end of file
+            return []
+    
+    @property
+    def generation(self):
+        """Thế hệ hiện tại của dữ liệu (tăng sau mỗi lần execute_query)"""
+        rows = self.fetch_query("SELECT value FROM meta WHERE key = 'generation'")
+        return rows[0][0] if rows else 0
@@ -1,8 +1,57 @@
 import sqlite3
+import numbers
 import os
-from datetime import datetime
+import unicodedata
+from datetime import date, datetime
 from pathlib import Path
 
+# SQLite cũ giới hạn 999 tham số cho mỗi câu lệnh
+MAX_IN_PARAMS = 900
+
+# Biểu thức SQL đổi đ/Đ thành d/D cho content_fts (khớp với fold_fulltext)
+_FTS_FOLD = "replace(replace({}, 'đ', 'd'), 'Đ', 'D')"
+
+
+def chunked(ids, size=MAX_IN_PARAMS):
+    """Chia tập id (đã bỏ trùng, giữ thứ tự) thành các lô cho mệnh đề IN (...)"""
+    unique = list(dict.fromkeys(ids))
+    for start in range(0, len(unique), size):
+        yield unique[start:start + size]
+
+
+def fold_name(text):
+    """Chuẩn hóa tên để tìm kiếm: chữ thường, bỏ dấu (kể cả đ -> d)"""
+    if text is None:
+        return None
+    decomposed = unicodedata.normalize('NFKD', text.replace('đ', 'd').replace('Đ', 'D'))
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+
+def fold_fulltext(text):
+    """Đổi đ/Đ thành d/D giống văn bản trong content_fts (các dấu khác do tokenizer bỏ)"""
+    return text.replace('đ', 'd').replace('Đ', 'D')
+
+
+def exif_value(value):
+    """Chuẩn hóa giá trị EXIF để lưu vào exif_tags (None nếu không lưu được)
+
+    Giữ nguyên số nguyên/số thực (kể cả phân số EXIF) và chuỗi; thời gian được
+    lưu dạng ISO. Các giá trị phức tạp (bytes, tuple, dict GPS thô) bị bỏ qua.
+    """
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    if isinstance(value, numbers.Real):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat(sep=' ') if isinstance(value, datetime) else value.isoformat()
+    if isinstance(value, str):
+        value = value.strip().rstrip('\x00')
+        return value or None
+    return None
+
+
 class Database:
     """Lớp quản lý kết nối và thao tác với cơ sở dữ liệu SQLite"""
     
@@ -45,6 +94,14 @@ class Database:
         )
         ''')
         
+        # Cột name_key (tên đã bỏ dấu, chữ thường) và chỉ mục trigram để tìm chuỗi con trong tên file
+        self._ensure_columns('files', {'name_key': 'TEXT'})
+        self.name_index_enabled = self._create_name_index()
+        
+        # Chỉ mục cho các điều kiện quy tắc được đẩy xuống SQL (rules.planner)
+        for column in ('mimetype', 'ext', 'size', 'created_ts'):
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_files_{column} ON files ({column})")
+        
         # Bảng metadata_media
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS metadata_media (
@@ -66,6 +123,35 @@ class Database:
         )
         ''')
         
+        # Chỉ mục không gian R*Tree trên tọa độ GPS (đồng bộ bằng trigger)
+        self.geo_index_enabled = self._create_geo_index()
+        
+        # Bảng exif_tags (các trường EXIF/metadata media dạng khóa - giá trị)
+        # Cột value không khai báo kiểu nên số vẫn là số, chuỗi vẫn là chuỗi
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'exif_tags'")
+        exif_exists = cursor.fetchone() is not None
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS exif_tags (
+            file_id INTEGER,
+            key TEXT,
+            value,
+            PRIMARY KEY (file_id, key),
+            FOREIGN KEY (file_id) REFERENCES files (id)
+        ) WITHOUT ROWID
+        ''')
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_exif_tags_key_value ON exif_tags (key, value)")
+        
+        cursor.execute("PRAGMA table_info(metadata_media)")
+        if not exif_exists and 'exif_data' in {row[1] for row in cursor.fetchall()}:
+            # Chuyển dữ liệu EXIF dạng JSON của phiên bản cũ sang bảng mới
+            cursor.execute('''
+            INSERT OR IGNORE INTO exif_tags (file_id, key, value)
+            SELECT mm.file_id, j.key, j.value
+            FROM metadata_media mm, json_each(mm.exif_data) j
+            WHERE json_valid(mm.exif_data) AND j.type NOT IN ('object', 'array', 'null')
+            ''')
+        
         # Bảng metadata_doc
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS metadata_doc (
@@ -81,25 +167,84 @@ class Database:
         )
         ''')
         
-        # Bảng content_index
+        # Bảng content_index (mỗi file có thể được chia thành nhiều đoạn)
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS content_index (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             file_id INTEGER,
             plain_text TEXT,
             tokens TEXT,
+            chunk_index INTEGER,
+            content TEXT,
             FOREIGN KEY (file_id) REFERENCES files (id)
         )
         ''')
         
-        # Bảng embeddings
+        # Bảng embeddings (vector đã chuẩn hóa L2 của từng đoạn văn bản)
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS embeddings (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             file_id INTEGER,
             model TEXT,
             vector_ref TEXT,
-            FOREIGN KEY (file_id) REFERENCES files (id)
+            content_id INTEGER,
+            vector BLOB,
+            dtype TEXT DEFAULT 'float32',
+            FOREIGN KEY (file_id) REFERENCES files (id),
+            FOREIGN KEY (content_id) REFERENCES content_index (id)
+        )
+        ''')
+        
+        # Bổ sung các cột mới cho database được tạo bởi phiên bản cũ
+        self._ensure_columns('content_index', {
+            'chunk_index': 'INTEGER',
+            'content': 'TEXT'
+        })
+        self._ensure_columns('embeddings', {
+            'content_id': 'INTEGER',
+            'vector': 'BLOB',
+            'dtype': "TEXT DEFAULT 'float32'"
+        })
+        
+        # Mỗi đoạn văn bản chỉ có một embedding (cho phép upsert hàng loạt)
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_embeddings_content_id'")
+        if not cursor.fetchone():
+            # Loại bỏ các embedding trùng lặp do phiên bản cũ để lại
+            cursor.execute('''
+            DELETE FROM embeddings 
+            WHERE content_id IS NOT NULL AND id NOT IN (
+                SELECT MAX(id) FROM embeddings WHERE content_id IS NOT NULL GROUP BY content_id
+            )
+            ''')
+            cursor.execute(
+                "CREATE UNIQUE INDEX idx_embeddings_content_id ON embeddings (content_id)")
+        
+        # Chỉ mục toàn văn FTS5 cho content_index (đồng bộ bằng trigger)
+        self.fts_enabled = self._create_fulltext_index()
+        
+        # Bảng embedding_cache (embedding theo hash nội dung đoạn văn bản, dùng lại khi đánh chỉ mục lại)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            text_hash TEXT,
+            model TEXT,
+            vector BLOB,
+            dtype TEXT DEFAULT 'float32',
+            PRIMARY KEY (text_hash, model)
+        ) WITHOUT ROWID
+        ''')
+        
+        # Bảng embedding_jobs (checkpoint để tiếp tục tạo embedding sau khi bị gián đoạn)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS embedding_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            model TEXT,
+            rebuild BOOLEAN,
+            last_content_id INTEGER DEFAULT 0,
+            processed INTEGER DEFAULT 0,
+            status TEXT,
+            started_ts TIMESTAMP,
+            updated_ts TIMESTAMP
         )
         ''')
         
@@ -124,6 +269,15 @@ class Database:
         )
         ''')
         
+        # Bảng meta (bộ đếm thế hệ dữ liệu, tăng sau mỗi thay đổi để vô hiệu hóa cache truy vấn)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER
+        )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)")
+        
         # Bảng actions_log
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS actions_log (
@@ -138,8 +292,196 @@ class Database:
         )
         ''')
         
+        # Bảng action_batches (mỗi lần organize/undo là một lô trong nhật ký ghi trước)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS action_batches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            command TEXT,
+            status TEXT,
+            pid INTEGER,
+            started_ts TIMESTAMP,
+            finished_ts TIMESTAMP
+        )
+        ''')
+        self._ensure_columns('actions_log', {'batch_id': 'INTEGER'})
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_actions_log_batch ON actions_log (batch_id, status)")
+        
         self.conn.commit()
     
+    def _create_fulltext_index(self):
+        """Tạo bảng FTS5 external-content trên content_index cùng các trigger đồng bộ
+        
+        Tokenizer unicode61 với remove_diacritics 2 cho phép tìm "tieng viet" khớp
+        "tiếng Việt". Riêng đ/Đ không phải chữ có dấu trong Unicode nên được đổi
+        thành d/D trước khi đưa vào chỉ mục (số từ không đổi nên trích đoạn vẫn
+        đúng vị trí). Trả về False nếu SQLite không được biên dịch kèm FTS5.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'content_fts'")
+        exists = cursor.fetchone() is not None
+        
+        try:
+            cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS content_fts USING fts5(
+                content,
+                content='content_index',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+            ''')
+        except sqlite3.OperationalError:
+            return False
+        
+        # Trigger của phiên bản cũ chưa đổi đ -> d: tạo lại và đánh chỉ mục lại
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'content_index_fts_insert'")
+        row = cursor.fetchone()
+        outdated = row is not None and "'đ'" not in row[0]
+        if outdated:
+            for name in ('insert', 'delete', 'update'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS content_index_fts_{name}")
+        
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS content_index_fts_insert AFTER INSERT ON content_index BEGIN
+            INSERT INTO content_fts (rowid, content) VALUES (new.id, {_FTS_FOLD.format('new.content')});
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS content_index_fts_delete AFTER DELETE ON content_index BEGIN
+            INSERT INTO content_fts (content_fts, rowid, content)
+            VALUES ('delete', old.id, {_FTS_FOLD.format('old.content')});
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS content_index_fts_update AFTER UPDATE OF content ON content_index BEGIN
+            INSERT INTO content_fts (content_fts, rowid, content)
+            VALUES ('delete', old.id, {_FTS_FOLD.format('old.content')});
+            INSERT INTO content_fts (rowid, content) VALUES (new.id, {_FTS_FOLD.format('new.content')});
+        END
+        ''')
+        
+        # Database cũ đã có dữ liệu: đánh chỉ mục toàn bộ một lần
+        # ('rebuild' đọc thẳng content_index nên không dùng được vì cần đổi đ -> d)
+        if not exists or outdated:
+            cursor.execute("INSERT INTO content_fts (content_fts) VALUES ('delete-all')")
+            cursor.execute(
+                f"INSERT INTO content_fts (rowid, content) SELECT id, {_FTS_FOLD.format('content')} FROM content_index")
+        
+        return True
+    
+    def _create_name_index(self):
+        """Tạo bảng FTS5 trigram trên files.name_key, đồng bộ bằng trigger
+        
+        name_key được tính trong Python (fold_name) khi thêm, đổi tên hoặc di chuyển
+        file; các dòng do mã khác thêm vào mà thiếu name_key được đánh chỉ mục bằng
+        lower(filename). Trả về False nếu SQLite không hỗ trợ tokenizer trigram.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'files_name_fts'")
+        exists = cursor.fetchone() is not None
+        
+        try:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS files_name_fts USING fts5(name_key, tokenize='trigram')")
+        except sqlite3.OperationalError:
+            return False
+        
+        if not exists:
+            # Điền name_key cho các file đã có trước khi tạo trigger
+            cursor.execute("SELECT id, filename FROM files WHERE name_key IS NULL")
+            cursor.executemany("UPDATE files SET name_key = ? WHERE id = ?",
+                               [(fold_name(row['filename']), row['id']) for row in cursor.fetchall()])
+            cursor.execute(
+                "INSERT INTO files_name_fts (rowid, name_key) SELECT id, name_key FROM files")
+        
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS files_name_fts_insert AFTER INSERT ON files BEGIN
+            INSERT INTO files_name_fts (rowid, name_key)
+            VALUES (new.id, coalesce(new.name_key, lower(new.filename)));
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS files_name_fts_delete AFTER DELETE ON files BEGIN
+            DELETE FROM files_name_fts WHERE rowid = old.id;
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS files_name_fts_update AFTER UPDATE OF filename, name_key ON files BEGIN
+            DELETE FROM files_name_fts WHERE rowid = old.id;
+            INSERT INTO files_name_fts (rowid, name_key)
+            VALUES (new.id, coalesce(new.name_key, lower(new.filename)));
+        END
+        ''')
+        
+        return True
+    
+    def _create_geo_index(self):
+        """Tạo bảng R*Tree media_geo trên (gps_lat, gps_lon) của metadata_media
+        
+        Mỗi điểm là một hộp suy biến (min = max), id là metadata_media.id. Chỉ
+        các dòng có đủ tọa độ mới được đánh chỉ mục. Trả về False nếu SQLite
+        không có module rtree.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'media_geo'")
+        exists = cursor.fetchone() is not None
+        
+        try:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS media_geo USING rtree(id, min_lat, max_lat, min_lon, max_lon)")
+        except sqlite3.OperationalError:
+            return False
+        
+        if not exists:
+            cursor.execute('''
+            INSERT INTO media_geo (id, min_lat, max_lat, min_lon, max_lon)
+            SELECT id, gps_lat, gps_lat, gps_lon, gps_lon FROM metadata_media
+            WHERE gps_lat IS NOT NULL AND gps_lon IS NOT NULL
+            ''')
+        
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS metadata_media_geo_insert AFTER INSERT ON metadata_media
+        WHEN new.gps_lat IS NOT NULL AND new.gps_lon IS NOT NULL BEGIN
+            INSERT INTO media_geo (id, min_lat, max_lat, min_lon, max_lon)
+            VALUES (new.id, new.gps_lat, new.gps_lat, new.gps_lon, new.gps_lon);
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS metadata_media_geo_delete AFTER DELETE ON metadata_media BEGIN
+            DELETE FROM media_geo WHERE id = old.id;
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS metadata_media_geo_update AFTER UPDATE OF gps_lat, gps_lon ON metadata_media BEGIN
+            DELETE FROM media_geo WHERE id = old.id;
+            INSERT INTO media_geo (id, min_lat, max_lat, min_lon, max_lon)
+            SELECT new.id, new.gps_lat, new.gps_lat, new.gps_lon, new.gps_lon
+            WHERE new.gps_lat IS NOT NULL AND new.gps_lon IS NOT NULL;
+        END
+        ''')
+        
+        return True
+    
+    @property
+    def generation(self):
+        """Thế hệ hiện tại của dữ liệu (đọc từ database nên thấy cả thay đổi của tiến trình khác)"""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return row[0] if row else 0
+    
+    def bump_generation(self):
+        """Tăng thế hệ dữ liệu trong transaction hiện tại (nơi gọi chịu trách nhiệm commit)"""
+        self.conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+    
+    def _ensure_columns(self, table, columns):
+        """Thêm các cột còn thiếu vào bảng đã tồn tại"""
+        cursor = self.conn.cursor()
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row['name'] for row in cursor.fetchall()}
+        
+        for name, definition in columns.items():
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+    
     def add_file(self, file_data):
         """Thêm hoặc cập nhật thông tin file"""
         cursor = self.conn.cursor()
@@ -162,15 +504,17 @@ class Database:
             # Thêm file mới vào DB
             cursor.execute('''
             INSERT INTO files (
-                abs_path, root_id, filename, ext, mimetype, 
+                abs_path, root_id, filename, name_key, ext, mimetype, 
                 size, hash_sha256, created_ts, modified_ts, ingested_ts
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (file_data['abs_path'], file_data['root_id'], file_data['filename'], 
+                  fold_name(file_data['filename']),
                   file_data['ext'], file_data['mimetype'], file_data['size'], 
                   file_data['hash_sha256'], file_data['created_ts'], 
                   file_data['modified_ts'], file_data['ingested_ts']))
             file_id = cursor.lastrowid
         
+        self.bump_generation()
         self.conn.commit()
         return file_id
     
@@ -212,8 +556,43 @@ class Database:
                   metadata.get('fps'), metadata.get('resolution'),
                   metadata.get('bitrate'), metadata.get('samplerate')))
         
+        self._store_exif(file_id, metadata, replace=False)
+        self.bump_generation()
+        self.conn.commit()
+    
+    def add_exif_data(self, file_id, exif):
+        """Lưu (thay thế) toàn bộ trường EXIF của file"""
+        self._store_exif(file_id, exif)
+        self.bump_generation()
         self.conn.commit()
     
+    def _store_exif(self, file_id, exif, replace=True):
+        """Ghi các trường EXIF vào exif_tags trong transaction hiện tại
+        
+        replace=False chỉ ghi đè các khóa có trong exif, giữ các khóa khác.
+        """
+        rows = []
+        for key, value in (exif or {}).items():
+            value = exif_value(value)
+            if value is not None:
+                rows.append((file_id, str(key), value))
+        
+        if replace:
+            self.conn.execute("DELETE FROM exif_tags WHERE file_id = ?", (file_id,))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO exif_tags (file_id, key, value) VALUES (?, ?, ?)", rows)
+    
+    def get_exif_data(self, file_ids):
+        """Lấy EXIF của nhiều file: {file_id: {khóa: giá trị}} (truy vấn theo lô MAX_IN_PARAMS id)"""
+        exif = {}
+        for batch in chunked(file_ids):
+            placeholders = ','.join('?' * len(batch))
+            cursor = self.conn.execute(
+                f"SELECT file_id, key, value FROM exif_tags WHERE file_id IN ({placeholders})", batch)
+            for row in cursor.fetchall():
+                exif.setdefault(row['file_id'], {})[row['key']] = row['value']
+        return exif
+    
     def add_doc_metadata(self, file_id, metadata):
         """Thêm metadata cho file tài liệu (PDF, DOCX, ...)"""
         cursor = self.conn.cursor()
@@ -243,6 +622,7 @@ class Database:
                   metadata.get('title'), metadata.get('author'),
                   metadata.get('keywords'), metadata.get('has_ocr')))
         
+        self.bump_generation()
         self.conn.commit()
     
     def add_content_index(self, file_id, plain_text, tokens=None):
@@ -268,6 +648,7 @@ class Database:
             ) VALUES (?, ?, ?)
             ''', (file_id, plain_text, tokens))
         
+        self.bump_generation()
         self.conn.commit()
     
     def log_action(self, file_id, action_type, source_path, target_path=None, status='completed'):
@@ -290,6 +671,42 @@ class Database:
         cursor.execute("UPDATE actions_log SET status = ? WHERE id = ?", (status, action_id))
         self.conn.commit()
     
+    def update_file_path(self, file_id, abs_path):
+        """Cập nhật đường dẫn, tên file và khóa tìm kiếm tên sau khi di chuyển/đổi tên"""
+        filename = os.path.basename(abs_path)
+        self.conn.execute(
+            "UPDATE files SET abs_path = ?, filename = ?, name_key = ? WHERE id = ?",
+            (abs_path, filename, fold_name(filename), file_id))
+        self.bump_generation()
+        self.conn.commit()
+    
+    def update_file_paths(self, updates):
+        """Cập nhật đường dẫn của nhiều file (các cặp (file_id, abs_path)) trong một transaction"""
+        rows = []
+        for file_id, abs_path in updates:
+            filename = os.path.basename(abs_path)
+            rows.append((abs_path, filename, fold_name(filename), file_id))
+        if not rows:
+            return
+        self.conn.executemany(
+            "UPDATE files SET abs_path = ?, filename = ?, name_key = ? WHERE id = ?", rows)
+        self.bump_generation()
+        self.conn.commit()
+    
+    def add_file_tags(self, pairs):
+        """Gắn thẻ cho nhiều file (các cặp (file_id, tên thẻ)); bỏ qua liên kết đã có"""
+        pairs = list(pairs)
+        if not pairs:
+            return
+        self.conn.executemany("INSERT OR IGNORE INTO tags (name) VALUES (?)",
+                              [(name,) for name in dict.fromkeys(name for _, name in pairs)])
+        self.conn.executemany('''
+        INSERT OR IGNORE INTO file_tags (file_id, tag_id)
+        SELECT ?, id FROM tags WHERE name = ?
+        ''', pairs)
+        self.bump_generation()
+        self.conn.commit()
+    
     def get_file_by_path(self, abs_path):
         """Lấy thông tin file theo đường dẫn tuyệt đối"""
         cursor = self.conn.cursor()
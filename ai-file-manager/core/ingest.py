@@ -9,6 +9,8 @@ except ImportError:
 import sqlite3
 from datetime import datetime
 
+from core.db import fold_name
+
 class FileIngestor:
     """Quét thư mục, lấy hash, phát hiện trùng lặp, thu thập metadata cơ bản"""
     
@@ -38,6 +40,7 @@ class FileIngestor:
             abs_path TEXT UNIQUE,
             root_id TEXT,
             filename TEXT,
+            name_key TEXT,
             ext TEXT,
             mimetype TEXT,
             size INTEGER,
@@ -63,6 +66,11 @@ class FileIngestor:
         )
         ''')
         
+        # Database cũ chưa có cột name_key
+        cursor.execute("PRAGMA table_info(files)")
+        if 'name_key' not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE files ADD COLUMN name_key TEXT")
+        
         self.conn.commit()
     
     def iter_files(self, path=None, recursive=True):
@@ -140,17 +148,19 @@ class FileIngestor:
                 # Thêm mới nếu file chưa tồn tại
                 cursor.execute("""
                 INSERT INTO files (
-                    abs_path, root_id, filename, ext, mimetype, size, 
+                    abs_path, root_id, filename, name_key, ext, mimetype, size, 
                     hash_sha256, created_ts, modified_ts, ingested_ts
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """, (
-                    abs_path, root_id, filename, ext, mimetype, size,
+                    abs_path, root_id, filename, fold_name(filename), ext, mimetype, size,
                     self.hash_sha256(p), 
                     datetime.fromtimestamp(p.stat().st_ctime),
                     datetime.fromtimestamp(p.stat().st_mtime),
                     datetime.now()
                 ))
             
+            if self.db is not None:
+                self.db.bump_generation()
             self.conn.commit()
             return True
             
@@ -1,18 +1,27 @@
 import os
 import json
 import numpy as np
-from sentence_transformers import SentenceTransformer, util
+
+from core.cache import cached_query, resolve_cache
+from search.models import DEFAULT_MODEL, get_model
+from search.vector_store import EmbeddingMatrix
 
 class Searcher:
-    def __init__(self, db):
+    def __init__(self, db, model_name=DEFAULT_MODEL, cache=None):
         self.db = db
-        self.model = None
-        try:
-            self.model = SentenceTransformer('paraphrase-MiniLM-L6-v2')
-        except Exception as e:
-            print(f"Lỗi khi tải mô hình tìm kiếm: {e}")
+        self.embeddings = None
+        # Cache kết quả dùng chung (cache=False để tắt); embeddings_version tăng
+        # mỗi lần nạp lại ma trận embedding
+        self.cache = resolve_cache(cache)
+        self.embeddings_version = 0
+        self.embedding_matrix_path = os.path.join(
+            os.path.dirname(os.path.abspath(db.db_path)), 'embeddings.npy')
+        
+        # Dùng chung mô hình với ContentIndexer, chỉ tải khi truy vấn ngữ nghĩa đầu tiên
+        self.model = get_model(model_name)
     
-    def search(self, query, limit=10):
+    @cached_query('web.search', context=('embeddings_version',))
+    def search(self, query, limit=10, candidate_ids=None):
         """
         Phương thức tìm kiếm chung, sử dụng tìm kiếm ngữ nghĩa nếu có thể,
         nếu không sẽ sử dụng tìm kiếm văn bản cơ bản
@@ -20,7 +29,7 @@ class Searcher:
         try:
             # Ưu tiên sử dụng tìm kiếm ngữ nghĩa nếu mô hình đã được tải
             if self.model:
-                return self.search_by_semantic(query, limit)
+                return self.search_by_semantic(query, limit, candidate_ids=candidate_ids)
             else:
                 return self.search_by_text(query, limit)
         except Exception as e:
@@ -55,9 +64,53 @@ class Searcher:
             print(f"Lỗi khi tìm kiếm văn bản: {e}")
             return []
     
-    def search_by_semantic(self, query, limit=10):
+    def _load_embedding_matrix(self, rebuild=False):
+        """
+        Nạp ma trận embedding liền khối (memmap) một lần duy nhất,
+        xây dựng lại từ các file .npy riêng lẻ nếu chưa có hoặc đã cũ
+        """
+        if self.embeddings is not None and not rebuild:
+            return self.embeddings
+        
+        matrix = EmbeddingMatrix(self.embedding_matrix_path)
+        
+        rows = self.db.fetch_query(
+            "SELECT id, embedding_path FROM files "
+            "WHERE embedding_path IS NOT NULL ORDER BY id"
+        )
+        
+        # Ma trận chỉ chứa các file còn .npy nên bỏ các file thiếu trước khi so sánh
+        entries = []
+        for file_id, path in rows:
+            try:
+                entries.append((file_id, path, os.stat(path).st_mtime))
+            except OSError:
+                continue
+        ids = np.array([file_id for file_id, _, _ in entries], dtype=np.int64)
+        
+        # Chỉ đọc lại các file .npy khi danh sách file có embedding đã thay đổi
+        # hoặc có file .npy được ghi lại sau lần xây dựng ma trận gần nhất
+        if not rebuild and matrix.load():
+            built = os.path.getmtime(matrix.path)
+            rebuild = not np.array_equal(matrix.ids, ids) or any(mtime > built for _, _, mtime in entries)
+        else:
+            rebuild = True
+        
+        if rebuild:
+            matrix.build(ids, (np.load(path) for _, path, _ in entries))
+        
+        self.embeddings = matrix
+        self.embeddings_version += 1
+        return matrix
+    
+    def refresh_embeddings(self):
+        """Xây dựng lại ma trận embedding sau khi các file .npy thay đổi"""
+        return self._load_embedding_matrix(rebuild=True)
+    
+    def search_by_semantic(self, query, limit=10, candidate_ids=None):
         """
         Tìm kiếm tập tin dựa trên ngữ nghĩa sử dụng embedding
+        candidate_ids: tập id file (tùy chọn) để giới hạn phạm vi tìm kiếm
         """
         try:
             if not self.model:
@@ -66,43 +119,43 @@ class Searcher:
             if not self.db.conn:
                 self.db.connect()
             
-            # Lấy tất cả các file có embedding
-            files = self.db.fetch_query(
-                "SELECT id, path, filename, extension, size, mime_type, embedding_path FROM files "
-                "WHERE embedding_path IS NOT NULL"
-            )
-            
-            if not files:
+            matrix = self._load_embedding_matrix()
+            if not len(matrix):
                 return self.search_by_text(query, limit)
             
-            # Tạo embedding cho query
-            query_embedding = self.model.encode(query, convert_to_tensor=True)
+            # Tạo embedding cho query, một phép nhân ma trận-vector cho tất cả file
+            query_embedding = self.model.encode([query])[0]
+            hits = matrix.search(query_embedding, limit, candidate_ids=candidate_ids)
             
-            # Tính toán độ tương đồng với các file
-            similarities = []
-            for file in files:
-                file_id, path, filename, extension, size, mime_type, embedding_path = file
-                
-                if os.path.exists(embedding_path):
-                    try:
-                        file_embedding = np.load(embedding_path)
-                        similarity = util.pytorch_cos_sim(query_embedding, file_embedding).item()
-                        similarities.append((similarity, {
-                            'id': file_id,
-                            'path': path,
-                            'filename': filename,
-                            'extension': extension,
-                            'size': size,
-                            'mime_type': mime_type
-                        }))
-                    except Exception as e:
-                        print(f"Lỗi khi tính toán độ tương đồng cho file {path}: {e}")
+            if not hits:
+                return []
             
-            # Sắp xếp kết quả theo độ tương đồng giảm dần
-            similarities.sort(key=lambda x: x[0], reverse=True)
+            # Lấy thông tin các file trúng trong một truy vấn
+            placeholders = ", ".join("?" for _ in hits)
+            rows = self.db.fetch_query(
+                "SELECT id, path, filename, extension, size, mime_type FROM files "
+                f"WHERE id IN ({placeholders})",
+                tuple(file_id for file_id, _ in hits)
+            )
+            files = {row[0]: row for row in rows}
+            
+            results = []
+            for file_id, score in hits:
+                if file_id not in files:
+                    continue
+                
+                _, path, filename, extension, size, mime_type = files[file_id]
+                results.append({
+                    'id': file_id,
+                    'path': path,
+                    'filename': filename,
+                    'extension': extension,
+                    'size': size,
+                    'mime_type': mime_type,
+                    'score': score
+                })
             
-            # Trả về limit kết quả đầu tiên
-            return [item[1] for item in similarities[:limit]]
+            return results
         except Exception as e:
             print(f"Lỗi khi tìm kiếm ngữ nghĩa: {e}")
             return self.search_by_text(query, limit)
@@ -0,0 +1,363 @@
+from datetime import datetime
+from typing import Any, Callable, Dict, FrozenSet, Iterator, List, Optional
+
+from rules.matcher import KeywordMatcher
+
+# Các điều kiện tìm từ khóa trong nội dung văn bản
+TEXT_CONDITIONS = ('text.contains_any', 'text.contains_all')
+
+
+class FileContext:
+    """Thông tin của một file khi đánh giá quy tắc
+
+    Các giá trị dẫn xuất (chữ thường, thời gian đã phân tích, tập từ khóa có
+    trong văn bản) được tính một lần cho mỗi file, khi quy tắc đầu tiên cần
+    đến, rồi dùng chung cho mọi quy tắc.
+    """
+
+    __slots__ = ('info', 'matcher', '_text', '_hits', '_filename', '_ext', '_created')
+
+    _MISSING = object()
+
+    def __init__(self, file_info: Dict[str, Any], matcher: Optional[KeywordMatcher] = None):
+        self.info = file_info
+        self.matcher = matcher
+        self._text = self._MISSING
+        self._hits = self._MISSING
+        self._filename = None
+        self._ext = None
+        self._created = self._MISSING
+
+    @property
+    def text(self) -> Optional[str]:
+        """Nội dung văn bản dạng chữ thường (None nếu file không có văn bản)"""
+        if self._text is self._MISSING:
+            text = self.info.get('text')
+            self._text = text.lower() if text else None
+        return self._text
+
+    @property
+    def text_hits(self) -> Optional[FrozenSet[str]]:
+        """Các từ khóa của tập quy tắc có trong văn bản (quét văn bản một lần)
+
+        None nếu file không có văn bản hoặc không có bộ tìm từ khóa.
+        """
+        if self._hits is self._MISSING:
+            text = self.text
+            self._hits = self.matcher.find(text) if text is not None and self.matcher else None
+        return self._hits
+
+    @property
+    def filename(self) -> str:
+        if self._filename is None:
+            self._filename = (self.info.get('filename') or '').lower()
+        return self._filename
+
+    @property
+    def ext(self) -> str:
+        if self._ext is None:
+            self._ext = (self.info.get('ext') or '').lower()
+        return self._ext
+
+    @property
+    def created(self) -> Optional[datetime]:
+        """Thời gian tạo dạng datetime (database trả về chuỗi ISO)"""
+        if self._created is self._MISSING:
+            value = self.info.get('created_ts')
+            if isinstance(value, str):
+                try:
+                    value = datetime.fromisoformat(value)
+                except ValueError:
+                    value = None
+            self._created = value or None
+        return self._created
+
+
+Predicate = Callable[[FileContext], bool]
+
+
+class CompiledRule:
+    """Quy tắc đã biên dịch: danh sách điều kiện (closure) sắp xếp rẻ trước"""
+
+    __slots__ = ('rule', 'name', 'action', 'predicates')
+
+    def __init__(self, rule: Dict[str, Any], predicates: List[Predicate]):
+        self.rule = rule
+        self.name = rule.get('name', 'Unnamed Rule')
+        self.action = rule['then']
+        self.predicates = predicates
+
+    def matches(self, ctx: FileContext) -> bool:
+        for predicate in self.predicates:
+            if not predicate(ctx):
+                return False
+        return True
+
+
+# Chi phí ước lượng của từng loại điều kiện; điều kiện rẻ được kiểm tra trước
+_COSTS = {
+    'mimetype': 0,
+    'ext': 0,
+    'size.gt': 0,
+    'size.lt': 0,
+    'language': 0,
+    'exif.': 1,
+    'created_after': 1,
+    'created_before': 1,
+    'filename.contains': 2,
+    'text.contains_any': 3,
+    'text.contains_all': 3,
+}
+
+
+def _cost(key: str) -> int:
+    return _COSTS['exif.'] if key.startswith('exif.') else _COSTS.get(key, 0)
+
+
+def _lowered(value) -> tuple:
+    """Từ khóa dạng chữ thường, bỏ trùng, giữ thứ tự"""
+    values = value if isinstance(value, list) else [value]
+    return tuple(dict.fromkeys(str(item).lower() for item in values))
+
+
+def _membership(values: list) -> Callable[[Any], bool]:
+    """Hàm kiểm tra thuộc danh sách (dùng set khi các giá trị băm được)"""
+    try:
+        allowed = frozenset(values)
+    except TypeError:
+        return lambda item: item in values
+
+    def contains(item):
+        try:
+            return item in allowed
+        except TypeError:
+            return item in values
+    return contains
+
+
+def _parse_date(value) -> Optional[datetime]:
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+
+def compile_condition(key: str, value: Any) -> Optional[Predicate]:
+    """Biên dịch một điều kiện thành hàm ctx -> bool (cùng ngữ nghĩa với
+    RulesEngine.evaluate_condition). Trả về None với điều kiện không được hỗ
+    trợ, vốn luôn được coi là thỏa mãn.
+    """
+    if key == 'mimetype':
+        if isinstance(value, str) and value.endswith('/*'):
+            prefix = value[:-2]
+            return lambda ctx: (ctx.info.get('mimetype') or '').startswith(prefix)
+        return lambda ctx: ctx.info.get('mimetype') == value
+
+    if key.startswith('exif.'):
+        exif_key = key.split('.', 1)[1]
+        missing = object()
+        if isinstance(value, list):
+            contains = _membership(value)
+
+            def exif_in(ctx):
+                found = (ctx.info.get('metadata') or {}).get(exif_key, missing)
+                return found is not missing and contains(found)
+            return exif_in
+
+        def exif_equals(ctx):
+            found = (ctx.info.get('metadata') or {}).get(exif_key, missing)
+            return found is not missing and found == value
+        return exif_equals
+
+    if key == 'language':
+        return lambda ctx: ctx.info.get('language') == value
+
+    if key == 'text.contains_any':
+        keywords = frozenset(_lowered(value))
+
+        def text_any(ctx):
+            if ctx.text is None:
+                return False
+            hits = ctx.text_hits
+            if hits is None:
+                return any(keyword in ctx.text for keyword in keywords)
+            return not keywords.isdisjoint(hits)
+        return text_any
+
+    if key == 'text.contains_all':
+        keywords = frozenset(_lowered(value))
+
+        def text_all(ctx):
+            if ctx.text is None:
+                return False
+            hits = ctx.text_hits
+            if hits is None:
+                return all(keyword in ctx.text for keyword in keywords)
+            return keywords <= hits
+        return text_all
+
+    if key == 'filename.contains':
+        keywords = _lowered(value)
+        return lambda ctx: any(keyword in ctx.filename for keyword in keywords)
+
+    if key == 'ext':
+        if isinstance(value, list):
+            extensions = frozenset(str(ext).lower() for ext in value)
+            return lambda ctx: ctx.ext in extensions
+        extension = str(value).lower()
+        return lambda ctx: ctx.ext == extension
+
+    if key == 'size.gt':
+        return lambda ctx: (ctx.info.get('size') or 0) > value
+    if key == 'size.lt':
+        return lambda ctx: (ctx.info.get('size') or 0) < value
+
+    if key in ('created_after', 'created_before'):
+        if not isinstance(value, str):
+            # Giá trị không phải chuỗi: chỉ yêu cầu file có thời gian tạo
+            return lambda ctx: ctx.created is not None
+
+        limit = _parse_date(value)
+        if limit is None:
+            return lambda ctx: False
+        if key == 'created_after':
+            return lambda ctx: ctx.created is not None and ctx.created >= limit
+        return lambda ctx: ctx.created is not None and ctx.created <= limit
+
+    return None
+
+
+def compile_rule(rule: Dict[str, Any]) -> Optional[CompiledRule]:
+    """Biên dịch một quy tắc; None nếu quy tắc thiếu 'if' hoặc 'then'"""
+    if not isinstance(rule, dict) or 'if' not in rule or 'then' not in rule:
+        return None
+
+    conditions = sorted((rule['if'] or {}).items(), key=lambda item: _cost(item[0]))
+    predicates = [predicate for predicate in (compile_condition(key, value) for key, value in conditions)
+                  if predicate is not None]
+    return CompiledRule(rule, predicates)
+
+
+def text_keywords(rules: List[Dict[str, Any]]) -> List[str]:
+    """Tất cả từ khóa (chữ thường) trong các điều kiện text.* của tập quy tắc"""
+    keywords = []
+    for rule in rules:
+        condition = rule.get('if') if isinstance(rule, dict) else None
+        for key in TEXT_CONDITIONS:
+            if condition and key in condition:
+                keywords.extend(_lowered(condition[key]))
+    return list(dict.fromkeys(keywords))
+
+
+def dispatch_key(rule: Dict[str, Any]):
+    """Khóa chỉ mục của quy tắc: ('mime', giá trị), ('ext', [đuôi]), ('prefix', tiền tố)
+
+    Chọn điều kiện chọn lọc nhất trong số các điều kiện bắt buộc phải thỏa;
+    None nếu quy tắc không có điều kiện nào đánh chỉ mục được.
+    """
+    condition = rule.get('if') or {}
+    mimetype = condition.get('mimetype')
+    ext = condition.get('ext')
+
+    if mimetype is not None and not (isinstance(mimetype, str) and mimetype.endswith('/*')):
+        try:
+            hash(mimetype)
+        except TypeError:
+            pass
+        else:
+            return ('mime', mimetype)
+    if ext is not None:
+        return ('ext', [str(item).lower() for item in (ext if isinstance(ext, list) else [ext])])
+    if isinstance(mimetype, str) and mimetype.endswith('/*'):
+        return ('prefix', mimetype[:-2])
+    return None
+
+
+class RuleSet:
+    """Tập quy tắc đã biên dịch, giữ nguyên thứ tự ưu tiên
+
+    Từ khóa của mọi điều kiện text.* được gộp vào một KeywordMatcher nên nội
+    dung mỗi file chỉ bị quét một lần, dù có bao nhiêu quy tắc.
+
+    Quy tắc được đánh chỉ mục theo mimetype chính xác, tiền tố mimetype
+    (image/*) và đuôi file; mỗi file chỉ được thử với các quy tắc ứng viên
+    cùng các quy tắc không đánh chỉ mục được.
+    """
+
+    def __init__(self, rules: List[Dict[str, Any]], matcher_backend: str = None):
+        self.rules = [compiled for compiled in map(compile_rule, rules) if compiled is not None]
+        self.matcher = KeywordMatcher(text_keywords(rules), backend=matcher_backend)
+
+        self._by_mime: Dict[Any, List[int]] = {}
+        self._by_prefix: Dict[str, List[int]] = {}
+        self._by_ext: Dict[str, List[int]] = {}
+        self._unindexed: List[int] = []
+        for position, compiled in enumerate(self.rules):
+            key = dispatch_key(compiled.rule)
+            if key is None:
+                self._unindexed.append(position)
+            elif key[0] == 'mime':
+                self._by_mime.setdefault(key[1], []).append(position)
+            elif key[0] == 'prefix':
+                self._by_prefix.setdefault(key[1], []).append(position)
+            else:
+                for ext in dict.fromkeys(key[1]):
+                    self._by_ext.setdefault(ext, []).append(position)
+
+        self.files_matched = 0
+        self.rules_evaluated = 0
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def __iter__(self) -> Iterator[CompiledRule]:
+        return iter(self.rules)
+
+    def __getitem__(self, index) -> CompiledRule:
+        return self.rules[index]
+
+    def context(self, file_info: Dict[str, Any]) -> FileContext:
+        return FileContext(file_info, self.matcher)
+
+    def candidates(self, ctx: FileContext) -> List[CompiledRule]:
+        """Các quy tắc có thể khớp với file (theo thứ tự trong tập quy tắc)"""
+        positions = set(self._unindexed)
+
+        mimetype = ctx.info.get('mimetype')
+        try:
+            positions.update(self._by_mime.get(mimetype, ()))
+        except TypeError:
+            pass
+        if self._by_prefix:
+            # Giữ đúng ngữ nghĩa startswith của điều kiện; số tiền tố khác nhau thường rất ít
+            mimetype = mimetype or ''
+            for prefix, found in self._by_prefix.items():
+                if mimetype.startswith(prefix):
+                    positions.update(found)
+        positions.update(self._by_ext.get(ctx.ext, ()))
+
+        return [self.rules[position] for position in sorted(positions)]
+
+    def match(self, file_info: Dict[str, Any]) -> List[CompiledRule]:
+        """Các quy tắc khớp với file, theo thứ tự trong tập quy tắc"""
+        ctx = self.context(file_info)
+        candidates = self.candidates(ctx)
+
+        self.files_matched += 1
+        self.rules_evaluated += len(candidates)
+        return [rule for rule in candidates if rule.matches(ctx)]
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê số quy tắc được đánh giá cho mỗi file"""
+        return {
+            'rules': len(self.rules),
+            'unindexed_rules': len(self._unindexed),
+            'files': self.files_matched,
+            'rules_evaluated': self.rules_evaluated,
+            'rules_per_file': self.rules_evaluated / self.files_matched if self.files_matched else 0.0
+        }
+
+
+def compile_rules(rules: List[Dict[str, Any]], matcher_backend: str = None) -> RuleSet:
+    """Biên dịch danh sách quy tắc thành RuleSet"""
+    return RuleSet(rules, matcher_backend)
@@ -5,11 +5,15 @@ from pathlib import Path
 from datetime import datetime
 import fnmatch
 
+from rules.compiler import compile_rules
+
 class RulesEngine:
     """Máy luật xử lý các quy tắc sắp xếp file từ file YAML"""
     
     def __init__(self, rules_file=None):
         self.rules = []
+        self._compiled = compile_rules([])
+        self._compiled_source = None
         if rules_file:
             self.load_rules(rules_file)
     
@@ -23,13 +27,30 @@ class RulesEngine:
                     raise ValueError("File quy tắc không hợp lệ hoặc không có quy tắc nào")
                 
                 self.rules = data['rules']
+                self._compile()
                 print(f"Đã tải {len(self.rules)} quy tắc từ {rules_file}")
         except Exception as e:
             print(f"Lỗi khi tải quy tắc: {e}")
             self.rules = []
     
+    def _compile(self):
+        """Biên dịch các quy tắc hiện tại một lần (gọi khi tải quy tắc)"""
+        self._compiled = compile_rules(self.rules)
+        self._compiled_source = self.rules
+    
+    @property
+    def compiled_rules(self):
+        """Các quy tắc đã biên dịch (biên dịch lại nếu self.rules bị gán danh sách khác)"""
+        if self._compiled_source is not self.rules:
+            self._compile()
+        return self._compiled
+    
     def evaluate_condition(self, condition, file_info):
-        """Đánh giá một điều kiện đơn lẻ"""
+        """Đánh giá một điều kiện đơn lẻ
+        
+        Bản thông dịch, giữ lại để tương thích; apply_rules dùng các quy tắc
+        đã biên dịch trong rules.compiler.
+        """
         # Xử lý các loại điều kiện khác nhau
         for key, value in condition.items():
             # Điều kiện mimetype
@@ -160,23 +181,33 @@ class RulesEngine:
         """Áp dụng tất cả quy tắc cho một file"""
         actions = []
         
-        for rule in self.rules:
-            matched, action = self.evaluate_rule(rule, file_info)
-            if matched:
-                actions.append({
-                    'rule_name': rule.get('name', 'Unnamed Rule'),
-                    'action': action
-                })
+        for rule in self.compiled_rules.match(file_info):
+            actions.append({
+                'rule_name': rule.name,
+                'action': rule.action
+            })
         
         return actions
     
+    def get_stats(self):
+        """Thống kê số quy tắc thực sự được đánh giá cho mỗi file (nhờ chỉ mục quy tắc)"""
+        return self.compiled_rules.stats()
+    
     def format_path(self, path_template, file_info):
         """Định dạng đường dẫn theo template và thông tin file"""
-        # Lấy các giá trị cần thiết từ file_info
-        year = file_info.get('created_ts', datetime.now()).strftime('%Y')
-        month = file_info.get('created_ts', datetime.now()).strftime('%m')
-        day = file_info.get('created_ts', datetime.now()).strftime('%d')
-        datetime_str = file_info.get('created_ts', datetime.now()).strftime('%Y%m%d_%H%M%S')
+        # Lấy các giá trị cần thiết từ file_info (database trả về thời gian dạng chuỗi ISO)
+        created = file_info.get('created_ts')
+        if isinstance(created, str):
+            try:
+                created = datetime.fromisoformat(created)
+            except ValueError:
+                created = None
+        created = created or datetime.now()
+        year = created.strftime('%Y')
+        month = created.strftime('%m')
+        day = created.strftime('%d')
+        datetime_str = created.strftime('%Y%m%d_%H%M%S')
+        metadata = file_info.get('metadata') or {}
         
         # Tạo dictionary các placeholder
         placeholders = {
@@ -185,10 +216,10 @@ class RulesEngine:
             'day': day,
             'datetime': datetime_str,
             'ext': file_info.get('ext', ''),
-            'hash8': file_info.get('hash_sha256', '')[:8],
-            'camera_model': file_info.get('metadata', {}).get('camera_model', 'unknown'),
+            'hash8': (file_info.get('hash_sha256') or '')[:8],
+            'camera_model': metadata.get('camera_model', 'unknown'),
             'created_ts': datetime_str,
-            'title': self._slugify(file_info.get('metadata', {}).get('title', file_info.get('filename', 'untitled'))),
+            'title': self._slugify(metadata.get('title', file_info.get('filename', 'untitled'))),
         }
         
         # Thay thế các placeholder trong template
@@ -213,9 +244,12 @@ class RulesEngine:
             return None
         
         # Lấy hành động đầu tiên phù hợp
-        action = actions[0]['action']
+        return self.build_action_plan(actions[0]['rule_name'], actions[0]['action'], file_info)
+    
+    def build_action_plan(self, rule_name, action, file_info):
+        """Tạo kế hoạch hành động (nguồn, đích, loại hành động) cho một quy tắc đã khớp"""
         plan = {
-            'rule_name': actions[0]['rule_name'],
+            'rule_name': rule_name,
             'source': file_info['abs_path'],
             'action_type': None,
             'target': None
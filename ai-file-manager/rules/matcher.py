@@ -0,0 +1,131 @@
+from collections import deque
+from typing import FrozenSet, Iterable, List
+
+try:
+    import ahocorasick  # pip install pyahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+# Với ít từ khóa, quét từng từ bằng toán tử `in` (viết bằng C) nhanh hơn
+# automaton thuần Python; điểm hòa vốn đo được vào khoảng vài trăm từ khóa
+AUTOMATON_MIN_KEYWORDS = 256
+
+BACKENDS = ('ahocorasick', 'automaton', 'scan')
+
+
+class KeywordMatcher:
+    """Tìm tất cả từ khóa xuất hiện trong văn bản bằng một lần quét (Aho-Corasick)
+
+    Dùng thư viện pyahocorasick nếu có; nếu không, dùng automaton thuần Python
+    khi số từ khóa đủ lớn, ngược lại quét từng từ khóa. Từ khóa và văn bản cần
+    được đưa về chữ thường trước.
+    """
+
+    def __init__(self, keywords: Iterable[str], backend: str = None):
+        """Khởi tạo với danh sách từ khóa; backend là một trong BACKENDS (mặc định tự chọn)"""
+        keywords = list(dict.fromkeys(keywords))
+        # Chuỗi rỗng luôn "xuất hiện" trong mọi văn bản (giống `'' in text`)
+        self._always = frozenset(keyword for keyword in keywords if keyword == '')
+        self.keywords = [keyword for keyword in keywords if keyword]
+
+        if backend is None:
+            if AHOCORASICK_AVAILABLE and self.keywords:
+                backend = 'ahocorasick'
+            elif len(self.keywords) >= AUTOMATON_MIN_KEYWORDS:
+                backend = 'automaton'
+            else:
+                backend = 'scan'
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend không hợp lệ: {backend}")
+        if backend == 'ahocorasick' and not AHOCORASICK_AVAILABLE:
+            raise ValueError("Thư viện pyahocorasick chưa được cài đặt")
+        self.backend = backend
+
+        if backend == 'ahocorasick':
+            self._automaton = ahocorasick.Automaton()
+            for keyword in self.keywords:
+                self._automaton.add_word(keyword, keyword)
+            self._automaton.make_automaton()
+        elif backend == 'automaton':
+            self._build_automaton()
+
+    def __len__(self) -> int:
+        return len(self.keywords) + len(self._always)
+
+    def _build_automaton(self) -> None:
+        """Dựng trie, liên kết thất bại rồi gộp thành bảng chuyển trạng thái đầy đủ (DFA)
+
+        Mỗi trạng thái có một dict ký tự -> trạng thái tiếp theo; ký tự không có
+        trong dict đưa về gốc. Tập từ khóa kết thúc tại mỗi trạng thái được mã
+        hóa thành bitmask để gộp nhanh khi quét.
+        """
+        goto: List[dict] = [{}]
+        output: List[int] = [0]
+
+        for index, keyword in enumerate(self.keywords):
+            state = 0
+            for ch in keyword:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto.append({})
+                    output.append(0)
+                    goto[state][ch] = nxt
+                state = nxt
+            output[state] |= 1 << index
+
+        fail = [0] * len(goto)
+        order = []
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            order.append(state)
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                link = fail[state]
+                while link and ch not in goto[link]:
+                    link = fail[link]
+                fail[nxt] = goto[link].get(ch, 0) if state else 0
+                output[nxt] |= output[fail[nxt]]
+
+        # Theo thứ tự BFS: bảng của trạng thái thất bại (nông hơn) luôn có trước
+        delta: List[dict] = [None] * len(goto)
+        delta[0] = goto[0]
+        for state in order:
+            transitions = dict(delta[fail[state]])
+            transitions.update(goto[state])
+            delta[state] = transitions
+
+        self._delta = delta
+        self._output = output
+
+    def find(self, text: str) -> FrozenSet[str]:
+        """Tập các từ khóa xuất hiện trong văn bản"""
+        if text is None or not self.keywords:
+            return self._always if text is not None else frozenset()
+
+        if self.backend == 'ahocorasick':
+            found = {keyword for _, keyword in self._automaton.iter(text)}
+        elif self.backend == 'automaton':
+            found = self._scan_automaton(text)
+        else:
+            found = {keyword for keyword in self.keywords if keyword in text}
+
+        return frozenset(found) | self._always if self._always else frozenset(found)
+
+    def _scan_automaton(self, text: str) -> set:
+        delta = self._delta
+        output = self._output
+        state = 0
+        mask = 0
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            mask |= output[state]
+
+        found = set()
+        while mask:
+            lowest = mask & -mask
+            found.add(self.keywords[lowest.bit_length() - 1])
+            mask ^= lowest
+        return found
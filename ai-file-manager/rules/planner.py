@@ -0,0 +1,193 @@
+import numbers
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from rules.compiler import CompiledRule, RuleSet, _lowered, _parse_date
+
+# Điều kiện SQL kèm tham số
+Clause = Tuple[str, List[Any]]
+
+# Điều kiện không bao giờ thỏa (quy tắc bị bỏ qua, không cần truy vấn)
+NEVER = ('0', [])
+
+# Tên file có ký tự ngoài ASCII: lower() của SQLite chỉ đổi chữ ASCII
+_NON_ASCII = "filename GLOB '*[^ -~]*'"
+
+
+def _scalars(value) -> list:
+    """Các giá trị truyền được vào SQLite (bỏ None và kiểu phức tạp)"""
+    values = value if isinstance(value, list) else [value]
+    return [item for item in values if isinstance(item, (str, numbers.Real))]
+
+
+def condition_clause(key: str, value: Any) -> Optional[Clause]:
+    """Điều kiện SQL tương ứng với một điều kiện quy tắc
+
+    Điều kiện SQL chỉ dùng để lọc ứng viên: mọi file thỏa điều kiện Python
+    đều thỏa điều kiện SQL (có thể lấy dư, không bao giờ bỏ sót), vì vị từ
+    Python vẫn được kiểm tra lại trên các ứng viên. Trả về None nếu điều
+    kiện không diễn đạt được bằng SQL (text.*, language, ...).
+    """
+    if key == 'mimetype':
+        if isinstance(value, str) and value.endswith('/*'):
+            prefix = value[:-2]
+            if not prefix:
+                return None
+            if prefix[-1] == '\U0010ffff':
+                return 'substr(mimetype, 1, ?) = ?', [len(prefix), prefix]
+            # Khoảng [prefix, prefix kế tiếp) để dùng được chỉ mục trên mimetype
+            upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            return 'mimetype >= ? AND mimetype < ?', [prefix, upper]
+        if not isinstance(value, str):
+            return None
+        return 'mimetype = ?', [value]
+
+    if key == 'ext':
+        # Đuôi file được lưu dạng chữ thường khi nạp (core.ingest)
+        extensions = list(dict.fromkeys(str(ext).lower() for ext in (value if isinstance(value, list) else [value])))
+        placeholders = ','.join('?' * len(extensions))
+        clause = f"ext IN ({placeholders})"
+        if '' in extensions:
+            clause = f"({clause} OR ext IS NULL)"
+        return clause, extensions
+
+    if key in ('size.gt', 'size.lt'):
+        if isinstance(value, bool) or not isinstance(value, numbers.Real):
+            return None
+        if key == 'size.gt':
+            return ('size > ?', [value]) if value >= 0 else None
+        return ('size < ?', [value]) if value <= 0 else ('(size < ? OR size IS NULL)', [value])
+
+    if key in ('created_after', 'created_before'):
+        if not isinstance(value, str):
+            return 'created_ts IS NOT NULL', []
+        limit = _parse_date(value)
+        if limit is None:
+            return NEVER
+        # Thời gian tạo được lưu dạng chuỗi ISO nên so sánh chuỗi giữ đúng thứ tự
+        if key == 'created_after':
+            return 'created_ts >= ?', [limit.strftime('%Y-%m-%d')]
+        return 'created_ts < ?', [(limit + timedelta(days=1)).strftime('%Y-%m-%d')]
+
+    if key == 'filename.contains':
+        keywords = _lowered(value)
+        if '' in keywords:
+            return None
+        terms = ' OR '.join('instr(lower(filename), ?) > 0' for _ in keywords)
+        return f"({terms} OR {_NON_ASCII})", list(keywords)
+
+    if key.startswith('exif.'):
+        values = list(dict.fromkeys(_scalars(value)))
+        if not values:
+            return NEVER
+        placeholders = ','.join('?' * len(values))
+        return (f"id IN (SELECT file_id FROM exif_tags WHERE key = ? AND value IN ({placeholders}))",
+                [key.split('.', 1)[1]] + values)
+
+    return None
+
+
+class RulePlan:
+    """Kế hoạch truy vấn của một quy tắc: điều kiện SQL và các điều kiện còn lại"""
+
+    __slots__ = ('position', 'rule', 'clauses', 'params', 'residual')
+
+    def __init__(self, position: int, rule: CompiledRule):
+        self.position = position
+        self.rule = rule
+        self.clauses: List[str] = []
+        self.params: List[Any] = []
+        self.residual: List[str] = []
+
+        for key, value in (rule.rule.get('if') or {}).items():
+            clause = condition_clause(key, value)
+            if clause is None:
+                self.residual.append(key)
+            else:
+                self.clauses.append(clause[0])
+                self.params.extend(clause[1])
+
+    @property
+    def pushed_down(self) -> bool:
+        return bool(self.clauses)
+
+    @property
+    def never(self) -> bool:
+        return NEVER[0] in self.clauses
+
+
+class RulePlanner:
+    """Tìm các file khớp quy tắc bằng cách đẩy điều kiện xuống SQL
+
+    Mỗi quy tắc chỉ đọc các dòng thỏa phần điều kiện diễn đạt được bằng SQL
+    (mimetype, ext, size, thời gian tạo, tên file, EXIF), rồi kiểm tra đầy đủ
+    bằng vị từ Python trên tập ứng viên đó. Nếu có quy tắc không lọc được
+    bằng SQL thì mọi file đều có thể khớp: khi đó quét toàn bộ một lần và
+    đánh giá bằng RuleSet như trước.
+    """
+
+    def __init__(self, db, rule_set: RuleSet):
+        self.db = db
+        self.rule_set = rule_set
+        self.plans = [RulePlan(position, rule) for position, rule in enumerate(rule_set)]
+        self.full_scan = any(not plan.pushed_down for plan in self.plans)
+        self.queries = 0
+        self.rows_fetched = 0
+
+    def _fetch(self, where: List[str], params: List[Any]) -> List[Dict[str, Any]]:
+        sql = "SELECT * FROM files"
+        if where:
+            sql += " WHERE " + " AND ".join(f"({clause})" for clause in where)
+        rows = [dict(row) for row in self.db.conn.execute(sql, params).fetchall()]
+        self.queries += 1
+        self.rows_fetched += len(rows)
+        return rows
+
+    def _load_exif(self, rows: List[Dict[str, Any]]) -> None:
+        pending = [row for row in rows if 'metadata' not in row]
+        exif_by_file = self.db.get_exif_data([row['id'] for row in pending])
+        for row in pending:
+            row['metadata'] = exif_by_file.get(row['id'], {})
+
+    def match(self, scope: Optional[Clause] = None) -> List[Tuple[Dict[str, Any], List[CompiledRule]]]:
+        """Các cặp (file, quy tắc khớp), theo thứ tự id file; quy tắc giữ thứ tự trong tập
+
+        scope giới hạn tập file (ví dụ theo thư mục nguồn).
+        """
+        where, params = ([scope[0]], list(scope[1])) if scope else ([], [])
+
+        if self.full_scan:
+            rows = self._fetch(where, params)
+            self._load_exif(rows)
+            matched = [(row, self.rule_set.match(row)) for row in rows]
+            return [(row, rules) for row, rules in matched if rules]
+
+        files: Dict[int, Dict[str, Any]] = {}
+        contexts = {}
+        matches: Dict[int, List[CompiledRule]] = {}
+        for plan in self.plans:
+            if plan.never:
+                continue
+
+            rows = self._fetch(where + plan.clauses, params + plan.params)
+            rows = [files.setdefault(row['id'], row) for row in rows]
+            self._load_exif(rows)
+
+            for row in rows:
+                ctx = contexts.get(row['id'])
+                if ctx is None:
+                    ctx = contexts[row['id']] = self.rule_set.context(row)
+                if plan.rule.matches(ctx):
+                    matches.setdefault(row['id'], []).append(plan.rule)
+
+        return [(files[file_id], matches[file_id]) for file_id in sorted(matches)]
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê số truy vấn và số dòng được đọc"""
+        return {
+            'rules': len(self.plans),
+            'pushed_down_rules': sum(1 for plan in self.plans if plan.pushed_down),
+            'full_scan': self.full_scan,
+            'queries': self.queries,
+            'rows_fetched': self.rows_fetched
+        }
@@ -0,0 +1,329 @@
+import hashlib
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from search.encoders import ParallelEncoder
+from search.vector_store import normalize_vectors, vector_from_bytes
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token của một đoạn văn bản (không cần tải tokenizer)"""
+    # Tokenizer WordPiece/SentencePiece thường tạo ~1.3 token cho mỗi từ
+    return max(1, int(len(text.split()) * 1.3) + 2)
+
+
+def text_hash(text: str) -> str:
+    """Hash nội dung đoạn văn bản, dùng làm khóa cho embedding_cache"""
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()
+
+
+class EmbeddingJob:
+    """Công việc tạo embedding dạng luồng, có thể tiếp tục sau khi bị gián đoạn
+
+    Các đoạn văn bản được đọc theo trang (keyset theo content_index.id) thay vì
+    fetchall, sắp xếp theo độ dài rồi gom thành batch theo ngân sách token, encode
+    ở luồng nền trong khi luồng chính ghi batch trước vào database bằng upsert hàng
+    loạt. Khi trang được ghi xong, vị trí đã xử lý được lưu vào bảng embedding_jobs
+    trong cùng transaction.
+    
+    Embedding được dùng lại qua bảng embedding_cache (khóa: hash nội dung + tên
+    mô hình), nên chỉ những đoạn văn bản thực sự mới mới phải chạy qua mô hình.
+    """
+
+    def __init__(self, db, model, model_name: str, vector_dtype: str = 'float32',
+                 token_budget: int = 8192, max_batch_size: int = 256,
+                 max_seq_length: int = 256, page_size: int = 2048, prefetch: int = 2,
+                 use_cache: bool = True):
+        """Khởi tạo với database, mô hình và các tham số batch"""
+        self.db = db
+        self.model = model
+        self.model_name = model_name
+        self.vector_dtype = vector_dtype
+        self.token_budget = token_budget
+        self.max_batch_size = max_batch_size
+        self.max_seq_length = max_seq_length
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self.use_cache = use_cache
+        self.stats = {'processed': 0, 'encoded': 0, 'cache_hits': 0, 'batches': 0,
+                      'elapsed': 0.0, 'chunks_per_second': 0.0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run(self, rebuild: bool = False) -> Dict[str, Any]:
+        """Chạy công việc đến khi hết đoạn văn bản cần xử lý hoặc bị dừng"""
+        self._stop.clear()
+        job_id, last_id = self._resume_or_create(rebuild)
+        total = self._count_pending(rebuild, last_id)
+
+        if total == 0:
+            print("Không có đoạn văn bản nào cần tạo embedding")
+            self._finish(job_id, 'completed')
+            return self.stats
+
+        if last_id:
+            print(f"Tiếp tục công việc embedding #{job_id} từ đoạn {last_id}")
+        print(f"Đang tạo embedding cho {total} đoạn văn bản...")
+
+        start = time.perf_counter()
+        pending = deque()
+
+        # Với bộ encode nhiều tiến trình, giữ đủ batch đang encode để mọi tiến trình đều bận
+        workers = self.model.workers if isinstance(self.model, ParallelEncoder) else 1
+        prefetch = max(self.prefetch, workers)
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='embedding-encoder') as executor:
+            try:
+                for batch, checkpoint in self._iter_batches(rebuild, last_id):
+                    # Tra cache ở luồng chính (kết nối SQLite gắn với luồng tạo ra nó),
+                    # encode phần còn thiếu ở luồng nền trong khi ghi các batch đã encode xong
+                    cached = self._lookup_cache(batch)
+                    pending.append((batch, checkpoint, executor.submit(self._encode, batch, cached)))
+
+                    while len(pending) > prefetch or (pending and pending[0][2].done()):
+                        self._write(job_id, *self._pop(pending))
+                        self._report(total, start)
+
+                    if self._stop.is_set():
+                        break
+
+                while pending:
+                    self._write(job_id, *self._pop(pending))
+                    self._report(total, start)
+            except BaseException:
+                for _, _, future in pending:
+                    future.cancel()
+                self._finish(job_id, 'interrupted')
+                raise
+
+        self._finish(job_id, 'interrupted' if self._stop.is_set() else 'completed')
+        return self.stats
+
+    def start(self, rebuild: bool = False) -> threading.Thread:
+        """Chạy công việc ở luồng nền với kết nối database riêng"""
+        from core.db import Database
+
+        def _target():
+            db = Database(self.db.db_path)
+            try:
+                job = EmbeddingJob(db, self.model, self.model_name, self.vector_dtype,
+                                   self.token_budget, self.max_batch_size,
+                                   self.max_seq_length, self.page_size, self.prefetch,
+                                   self.use_cache)
+                job._stop = self._stop
+                job.stats = self.stats
+                job.run(rebuild)
+            except Exception as e:
+                print(f"Lỗi khi tạo embedding: {e}")
+            finally:
+                db.close()
+
+        self._thread = threading.Thread(target=_target, name='embedding-job', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, wait: bool = True) -> None:
+        """Yêu cầu dừng sau batch hiện tại (có thể tiếp tục lại sau)"""
+        self._stop.set()
+        if wait and self._thread:
+            self._thread.join()
+
+    def make_batches(self, chunks: List[Any]) -> Iterator[List[Any]]:
+        """Gom các đoạn thành batch sao cho batch_size x độ dài dài nhất <= ngân sách token"""
+        batch = []
+        longest = 0
+
+        for chunk in chunks:
+            tokens = min(estimate_tokens(chunk['content'] or ''), self.max_seq_length)
+            new_longest = max(longest, tokens)
+
+            if batch and (new_longest * (len(batch) + 1) > self.token_budget
+                          or len(batch) >= self.max_batch_size):
+                yield batch
+                batch, new_longest = [], tokens
+
+            batch.append(chunk)
+            longest = new_longest
+
+        if batch:
+            yield batch
+
+    def _iter_batches(self, rebuild: bool, last_id: int) -> Iterator[Tuple[List[Any], Optional[int]]]:
+        """Đọc các đoạn văn bản theo trang (keyset) rồi gom batch theo độ dài
+        
+        Trả về (batch, checkpoint); checkpoint là id lớn nhất của trang và chỉ
+        có ở batch cuối cùng của trang đó.
+        """
+        for page in self._iter_pages(rebuild, last_id):
+            # Sắp xếp theo độ dài để các đoạn dài ngắn tương tự nằm cùng batch (ít padding)
+            ordered = sorted(page, key=lambda chunk: len(chunk['content'] or ''))
+            batches = list(self.make_batches(ordered))
+            
+            for i, batch in enumerate(batches):
+                yield batch, (page[-1]['id'] if i == len(batches) - 1 else None)
+            
+            if self._stop.is_set():
+                return
+
+    def _iter_pages(self, rebuild: bool, last_id: int) -> Iterator[List[Any]]:
+        cursor = self.db.conn.cursor()
+
+        while True:
+            if rebuild:
+                cursor.execute(
+                    """SELECT id, file_id, content FROM content_index
+                       WHERE id > ? ORDER BY id LIMIT ?""",
+                    (last_id, self.page_size))
+            else:
+                cursor.execute(
+                    """SELECT ci.id, ci.file_id, ci.content
+                       FROM content_index ci
+                       LEFT JOIN embeddings e ON ci.id = e.content_id
+                       WHERE e.id IS NULL AND ci.id > ?
+                       ORDER BY ci.id LIMIT ?""",
+                    (last_id, self.page_size))
+
+            page = cursor.fetchall()
+            if not page:
+                return
+
+            yield page
+            last_id = page[-1]['id']
+
+    def _lookup_cache(self, batch: List[Any]) -> Dict[str, Any]:
+        """Lấy các embedding đã có trong cache cho những đoạn của batch"""
+        if not self.use_cache:
+            return {}
+
+        hashes = list({text_hash(chunk['content']) for chunk in batch})
+        placeholders = ','.join('?' * len(hashes))
+        cursor = self.db.conn.cursor()
+        cursor.execute(
+            f"""SELECT text_hash, vector, dtype FROM embedding_cache
+                WHERE model = ? AND text_hash IN ({placeholders})""",
+            [self.model_name] + hashes)
+
+        return {row['text_hash']: vector_from_bytes(row['vector'], row['dtype'] or 'float32')
+                for row in cursor.fetchall()}
+
+    def _encode(self, batch: List[Any], cached: Dict[str, Any]):
+        """Encode các đoạn chưa có trong cache (mỗi nội dung chỉ encode một lần)
+        
+        Trả về (vectors, new_hashes): vector của toàn batch theo thứ tự và tập hash
+        vừa được encode (cần ghi vào cache).
+        """
+        hashes = [text_hash(chunk['content']) for chunk in batch]
+        texts = {}
+        for chunk, digest in zip(batch, hashes):
+            if digest not in cached and digest not in texts:
+                texts[digest] = chunk['content'] or ''
+
+        vectors = dict(cached)
+        if texts:
+            encoded = normalize_vectors(self.model.encode(list(texts.values()), batch_size=len(texts)))
+            vectors.update(zip(texts.keys(), encoded))
+
+        return np.stack([vectors[digest] for digest in hashes]), set(texts)
+
+    def _pop(self, pending: deque):
+        batch, checkpoint, future = pending.popleft()
+        return (batch, checkpoint) + future.result()
+
+    def _write(self, job_id: int, batch: List[Any], checkpoint: Optional[int], embeddings,
+               new_hashes=frozenset()) -> None:
+        """Ghi một batch embedding bằng upsert hàng loạt cùng với checkpoint"""
+        vectors = normalize_vectors(embeddings, self.vector_dtype)
+        cursor = self.db.conn.cursor()
+
+        try:
+            if self.use_cache and new_hashes:
+                rows = {}
+                for chunk, vector in zip(batch, vectors):
+                    digest = text_hash(chunk['content'])
+                    if digest in new_hashes:
+                        rows[digest] = (digest, self.model_name, vector.tobytes(), self.vector_dtype)
+                cursor.executemany(
+                    """INSERT OR REPLACE INTO embedding_cache (text_hash, model, vector, dtype)
+                       VALUES (?, ?, ?, ?)""",
+                    list(rows.values()))
+
+            cursor.executemany(
+                """INSERT INTO embeddings (content_id, file_id, vector, dtype, model)
+                   VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(content_id) DO UPDATE SET
+                       file_id = excluded.file_id, vector = excluded.vector,
+                       dtype = excluded.dtype, model = excluded.model""",
+                [(chunk['id'], chunk['file_id'], vector.tobytes(), self.vector_dtype, self.model_name)
+                 for chunk, vector in zip(batch, vectors)])
+
+            # Checkpoint chỉ tiến lên khi cả trang đã được ghi (các trang ghi theo thứ tự id)
+            cursor.execute(
+                """UPDATE embedding_jobs SET last_content_id = COALESCE(?, last_content_id),
+                   processed = processed + ?, updated_ts = ? WHERE id = ?""",
+                (checkpoint, len(batch), datetime.now(), job_id))
+
+            self.db.conn.commit()
+        except Exception:
+            self.db.conn.rollback()
+            raise
+
+        self.stats['processed'] += len(batch)
+        self.stats['encoded'] += len(new_hashes)
+        self.stats['cache_hits'] += len(batch) - len(new_hashes)
+        self.stats['batches'] += 1
+
+    def _report(self, total: int, start: float) -> None:
+        elapsed = time.perf_counter() - start
+        self.stats['elapsed'] = elapsed
+        self.stats['chunks_per_second'] = self.stats['processed'] / elapsed if elapsed > 0 else 0.0
+        print(f"Đã tạo embedding cho {self.stats['processed']}/{total} đoạn văn bản "
+              f"({self.stats['chunks_per_second']:.1f} đoạn/s)")
+
+    def _resume_or_create(self, rebuild: bool):
+        """Tiếp tục công việc dang dở cùng loại hoặc tạo công việc mới"""
+        cursor = self.db.conn.cursor()
+        cursor.execute(
+            """SELECT id, last_content_id FROM embedding_jobs
+               WHERE model = ? AND rebuild = ? AND status != 'completed'
+               ORDER BY id DESC LIMIT 1""",
+            (self.model_name, int(rebuild)))
+        existing = cursor.fetchone()
+
+        if existing:
+            cursor.execute(
+                "UPDATE embedding_jobs SET status = 'running', updated_ts = ? WHERE id = ?",
+                (datetime.now(), existing['id']))
+            self.db.conn.commit()
+            return existing['id'], existing['last_content_id'] or 0
+
+        now = datetime.now()
+        cursor.execute(
+            """INSERT INTO embedding_jobs (model, rebuild, last_content_id, processed, status, started_ts, updated_ts)
+               VALUES (?, ?, 0, 0, 'running', ?, ?)""",
+            (self.model_name, int(rebuild), now, now))
+        self.db.conn.commit()
+        return cursor.lastrowid, 0
+
+    def _count_pending(self, rebuild: bool, last_id: int) -> int:
+        cursor = self.db.conn.cursor()
+        if rebuild:
+            cursor.execute("SELECT COUNT(*) AS count FROM content_index WHERE id > ?", (last_id,))
+        else:
+            cursor.execute(
+                """SELECT COUNT(*) AS count FROM content_index ci
+                   LEFT JOIN embeddings e ON ci.id = e.content_id
+                   WHERE e.id IS NULL AND ci.id > ?""",
+                (last_id,))
+        return cursor.fetchone()['count']
+
+    def _finish(self, job_id: int, status: str) -> None:
+        self.db.conn.execute(
+            "UPDATE embedding_jobs SET status = ?, updated_ts = ? WHERE id = ?",
+            (status, datetime.now(), job_id))
+        self.db.conn.commit()
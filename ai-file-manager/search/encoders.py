@@ -0,0 +1,146 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from search.models import DEFAULT_MODEL, get_model
+
+# Mô hình của tiến trình con (mỗi tiến trình tải một bản riêng)
+_worker_model = None
+
+# Biến môi trường giới hạn số luồng của OpenMP/BLAS, chỉ có tác dụng nếu có
+# trước khi numpy được import nên phải đặt ở tiến trình cha trước khi tạo tiến trình con
+_THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+
+def _init_worker(model_name: str, threads: int) -> None:
+    """Khởi tạo tiến trình con: cố định số luồng của torch rồi tải mô hình"""
+    global _worker_model
+
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+    from sentence_transformers import SentenceTransformer
+    _worker_model = SentenceTransformer(model_name, device='cpu')
+
+
+def _encode_in_worker(texts: List[str]) -> np.ndarray:
+    return _worker_model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+
+
+def length_sorted_batches(texts: Sequence[str], batch_size: int) -> List[List[int]]:
+    """Chia chỉ số các đoạn thành batch theo độ dài tăng dần để giảm padding"""
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i] or ''))
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+class ParallelEncoder:
+    """Encode trên CPU bằng pool tiến trình, gom batch theo độ dài đoạn văn bản
+
+    Mỗi tiến trình có số luồng cố định (threads_per_worker) để các tiến trình
+    không tranh giành lõi CPU. Với workers <= 1, việc encode diễn ra ngay trong
+    tiến trình hiện tại bằng mô hình dùng chung.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL, workers: Optional[int] = None,
+                 threads_per_worker: int = 1, batch_size: int = 32):
+        """Khởi tạo với tên mô hình, số tiến trình và số luồng cho mỗi tiến trình"""
+        self.model_name = model_name
+        self.workers = workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+        self.threads_per_worker = threads_per_worker
+        self.batch_size = batch_size
+        self._pool = None
+        self._saved_env = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self) -> None:
+        """Khởi động pool tiến trình (mỗi tiến trình tải mô hình một lần)"""
+        if self.workers <= 1 or self._pool is not None:
+            return
+
+        # Tiến trình con (spawn) kế thừa môi trường khi được tạo; pool có thể tạo
+        # tiến trình khi nhận việc nên giữ các biến này đến khi close()
+        self._saved_env = {var: os.environ.get(var) for var in _THREAD_ENV_VARS}
+        for var in _THREAD_ENV_VARS:
+            os.environ[var] = str(self.threads_per_worker)
+
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.model_name, self.threads_per_worker))
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+        if self._saved_env is not None:
+            for var, value in self._saved_env.items():
+                if value is None:
+                    os.environ.pop(var, None)
+                else:
+                    os.environ[var] = value
+            self._saved_env = None
+
+    def encode(self, sentences, batch_size: Optional[int] = None, **kwargs) -> np.ndarray:
+        """Tạo embedding theo đúng thứ tự đầu vào"""
+        texts = [sentences] if isinstance(sentences, str) else list(sentences)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        batches = length_sorted_batches(texts, batch_size or self.batch_size)
+        grouped = [[texts[i] for i in batch] for batch in batches]
+
+        if self.workers <= 1:
+            model = get_model(self.model_name)
+            if model is None:
+                raise RuntimeError("Thư viện sentence-transformers không khả dụng")
+            results = [model.encode(group, batch_size=len(group), convert_to_numpy=True)
+                       for group in grouped]
+        else:
+            self.start()
+            results = list(self._pool.map(_encode_in_worker, grouped))
+
+        # Đưa các vector về đúng thứ tự ban đầu
+        output = np.zeros((len(texts), results[0].shape[1]), dtype=np.float32)
+        for batch, vectors in zip(batches, results):
+            output[batch] = vectors
+        return output
+
+
+def benchmark_encoder(texts: Sequence[str], worker_counts: Sequence[int] = (1, 2, 4),
+                      model_name: str = DEFAULT_MODEL, threads_per_worker: int = 1,
+                      batch_size: int = 32) -> List[Dict[str, Any]]:
+    """Đo thông lượng (đoạn/giây) theo số tiến trình encode"""
+    results = []
+
+    for workers in worker_counts:
+        with ParallelEncoder(model_name, workers=workers,
+                             threads_per_worker=threads_per_worker, batch_size=batch_size) as encoder:
+            # Chạy khởi động để không tính thời gian tải mô hình
+            encoder.encode(list(texts[:workers]), batch_size=1)
+
+            start = time.perf_counter()
+            encoder.encode(texts)
+            elapsed = time.perf_counter() - start
+
+        results.append({
+            'workers': workers,
+            'elapsed': elapsed,
+            'chunks_per_second': len(texts) / elapsed if elapsed > 0 else 0.0
+        })
+
+    return results
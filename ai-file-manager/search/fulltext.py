@@ -0,0 +1,133 @@
+import json
+import re
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional
+
+from core.db import fold_fulltext
+
+# Cụm từ trong ngoặc kép hoặc một từ (có thể kết thúc bằng * để tìm theo tiền tố)
+_TOKEN_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+
+# Ký tự được coi là một phần của từ khi đưa vào truy vấn MATCH
+_WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """Chuyển truy vấn người dùng thành biểu thức MATCH của FTS5
+
+    - "cụm từ"  : tìm đúng cụm từ
+    - tiền_tố*  : tìm các từ bắt đầu bằng tiền tố
+    - từ khác   : tất cả các từ đều phải xuất hiện (AND)
+
+    Mọi từ đều được đặt trong ngoặc kép nên ký tự đặc biệt của FTS5 trong
+    truy vấn không gây lỗi cú pháp. Trả về None nếu truy vấn không có từ nào.
+    """
+    parts = []
+
+    # Đổi đ -> d như văn bản trong chỉ mục để "duong" khớp "Đường"
+    for phrase, term in _TOKEN_PATTERN.findall(fold_fulltext(query or '')):
+        if phrase:
+            words = _WORD_PATTERN.findall(phrase)
+            if words:
+                parts.append('"' + ' '.join(words) + '"')
+            continue
+
+        prefix = term.endswith('*')
+        words = _WORD_PATTERN.findall(term)
+        if not words:
+            continue
+
+        # Từ ghép như "file-manager" được coi là một cụm từ, giống cách tokenizer tách từ
+        expression = '"' + ' '.join(words) + '"'
+        parts.append(expression + '*' if prefix else expression)
+
+    return ' AND '.join(parts) if parts else None
+
+
+def search_chunks(conn, query: str, limit: int = 10, snippet_tokens: int = 12,
+                  highlight: tuple = ('[', ']'),
+                  file_ids: Optional[Iterable[int]] = None) -> Optional[List[Dict[str, Any]]]:
+    """Tìm các đoạn văn bản khớp truy vấn, xếp hạng theo BM25
+
+    Điểm số là -bm25 (càng lớn càng liên quan). file_ids giới hạn kết quả trong
+    các file cho trước. Trả về None nếu không dùng được FTS5 (SQLite thiếu FTS5
+    hoặc bảng chưa được tạo) để nơi gọi chuyển sang LIKE.
+    """
+    match = build_match_query(query)
+    if match is None:
+        return []
+
+    file_filter = ''
+    params = [highlight[0], highlight[1], snippet_tokens, match]
+    if file_ids is not None:
+        # Truyền tập id dưới dạng JSON để không bị giới hạn số tham số của SQLite
+        file_filter = """AND rowid IN (SELECT id FROM content_index
+                                       WHERE file_id IN (SELECT value FROM json_each(?)))"""
+        params.append(json.dumps(sorted(file_ids)))
+
+    try:
+        cursor = conn.execute(
+            f"""SELECT ci.id AS content_id, ci.file_id, ci.content, f.abs_path, f.filename,
+                      hits.rank, hits.snippet
+               FROM (
+                   SELECT rowid, bm25(content_fts) AS rank,
+                          snippet(content_fts, 0, ?, ?, '…', ?) AS snippet
+                   FROM content_fts
+                   WHERE content_fts MATCH ? {file_filter}
+                   ORDER BY rank
+                   LIMIT ?
+               ) hits
+               JOIN content_index ci ON ci.id = hits.rowid
+               JOIN files f ON f.id = ci.file_id
+               ORDER BY hits.rank""",
+            params + [limit])
+    except sqlite3.OperationalError:
+        return None
+
+    return [{
+        'content_id': row['content_id'],
+        'file_id': row['file_id'],
+        'file_path': row['abs_path'],
+        'filename': row['filename'],
+        'content': row['content'],
+        'snippet': row['snippet'],
+        'score': -row['rank']
+    } for row in cursor.fetchall()]
+
+
+def search_files(conn, query: str, limit: int = 10, **kwargs) -> Optional[List[Dict[str, Any]]]:
+    """Tìm các file có nội dung khớp truy vấn (mỗi file một kết quả, đoạn tốt nhất)"""
+    seen = {}
+    fetch = limit * 4
+
+    while True:
+        hits = search_chunks(conn, query, fetch, **kwargs)
+        if hits is None:
+            return None
+
+        for hit in hits:
+            if hit['file_id'] not in seen:
+                seen[hit['file_id']] = hit
+
+        # Đủ số file hoặc đã hết đoạn khớp
+        if len(seen) >= limit or len(hits) < fetch:
+            break
+        fetch *= 4
+
+    best = sorted(seen.values(), key=lambda hit: -hit['score'])[:limit]
+    if not best:
+        return []
+
+    placeholders = ','.join('?' * len(best))
+    cursor = conn.execute(f"SELECT * FROM files WHERE id IN ({placeholders})",
+                          [hit['file_id'] for hit in best])
+    files = {row['id']: dict(row) for row in cursor.fetchall()}
+
+    results = []
+    for hit in best:
+        file = files.get(hit['file_id'])
+        if file:
+            file['score'] = hit['score']
+            file['snippet'] = hit['snippet']
+            results.append(file)
+    return results
@@ -0,0 +1,49 @@
+import math
+from typing import List, Tuple
+
+# Bán kính trung bình của Trái Đất (km)
+EARTH_RADIUS_KM = 6371.0088
+
+# Khoảng cách lớn nhất giữa hai điểm trên mặt đất (nửa vòng tròn lớn)
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM
+
+# Hộp giới hạn: (min_lat, max_lat, min_lon, max_lon)
+Box = Tuple[float, float, float, float]
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Khoảng cách theo vòng tròn lớn giữa hai điểm (km)"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_boxes(lat: float, lon: float, radius_km: float) -> List[Box]:
+    """Các hộp lat/lon chứa trọn hình tròn bán kính radius_km quanh (lat, lon)
+
+    Thường là một hộp; là hai hộp khi hình tròn vắt qua kinh tuyến 180°. Khi
+    hình tròn chứa một cực, hộp trải hết mọi kinh độ. Hộp chỉ dùng để lọc thô,
+    khoảng cách chính xác được tính lại bằng haversine_km.
+    """
+    delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = lat - delta_lat, lat + delta_lat
+
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return [(max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0)]
+
+    # Độ rộng kinh độ lớn nhất của hình tròn (đạt tại vĩ độ tiếp tuyến)
+    ratio = math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(lat))
+    if ratio >= 1.0:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+
+    delta_lon = math.degrees(math.asin(ratio))
+    min_lon, max_lon = lon - delta_lon, lon + delta_lon
+
+    if min_lon < -180.0:
+        return [(min_lat, max_lat, min_lon + 360.0, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+    if max_lon > 180.0:
+        return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360.0)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
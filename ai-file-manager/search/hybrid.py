@@ -0,0 +1,176 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from search.fulltext import search_chunks
+from search.hydrate import fetch_contents, fetch_files
+from search.quantization import QuantizedIndex
+
+# Hằng số k của reciprocal rank fusion (giá trị thường dùng trong tài liệu)
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(rankings: List[List[Any]], k: int = RRF_K) -> List[Tuple[Any, float]]:
+    """Hợp nhất nhiều danh sách xếp hạng: điểm = tổng 1 / (k + thứ hạng)"""
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+def collapse_to_files(hits: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """Giữ đoạn tốt nhất (xuất hiện đầu tiên) của mỗi file, theo thứ tự xếp hạng"""
+    files = {}
+    for hit in hits:
+        files.setdefault(hit['file_id'], hit)
+    return files
+
+
+class HybridSearcher:
+    """Tìm kiếm kết hợp BM25 (FTS5) và vector, hợp nhất bằng reciprocal rank fusion
+
+    Phần encode truy vấn và quét chỉ mục vector chạy ở luồng nền trong khi truy
+    vấn BM25 chạy ở luồng hiện tại, nên độ trễ xấp xỉ bằng giai đoạn chậm hơn.
+    Mọi truy cập database đều ở luồng hiện tại (kết nối SQLite gắn với luồng).
+    """
+
+    def __init__(self, indexer, rrf_k: int = RRF_K, candidates: int = 50):
+        """Khởi tạo với ContentIndexer và số ứng viên lấy từ mỗi giai đoạn"""
+        self.indexer = indexer
+        self.rrf_k = rrf_k
+        self.candidates = candidates
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hybrid-vector')
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def search(self, query: str, top_k: int = 10, criteria: Optional[Dict[str, Any]] = None,
+               file_ids: Optional[Iterable[int]] = None) -> Dict[str, Any]:
+        """Tìm kiếm kết hợp, trả về {'results': [...], 'timings': {giai đoạn: giây}}
+
+        criteria/file_ids lọc trước cả hai giai đoạn theo metadata của file.
+        """
+        timings = {}
+        if not query:
+            return {'results': [], 'timings': timings}
+
+        start = time.perf_counter()
+        count = max(top_k, self.candidates)
+
+        positions = None
+        if criteria:
+            from search.searcher import FileSearcher
+            allowed = FileSearcher(self.indexer.db).resolve_file_ids(criteria)
+            file_ids = allowed if file_ids is None else allowed & set(file_ids)
+        if file_ids is not None:
+            file_ids = set(file_ids)
+            positions = self.indexer.positions_for_files(file_ids) if self.indexer.index is not None else None
+            timings['filter'] = time.perf_counter() - start
+
+        future = self._executor.submit(self._vector_stage, query, count, timings, positions)
+        lexical = self._lexical_stage(query, count, timings, file_ids)
+        vector = self._finish_vector_stage(future, count, timings)
+
+        fuse_start = time.perf_counter()
+        lexical_files = collapse_to_files(lexical)
+        vector_files = collapse_to_files(vector)
+        fused = reciprocal_rank_fusion([list(lexical_files), list(vector_files)], self.rrf_k)[:top_k]
+        timings['fuse'] = time.perf_counter() - fuse_start
+
+        hydrate_start = time.perf_counter()
+        results = self._hydrate(fused, lexical_files, vector_files)
+        timings['hydrate'] = time.perf_counter() - hydrate_start
+        timings['total'] = time.perf_counter() - start
+
+        return {'results': results, 'timings': timings}
+
+    def _lexical_stage(self, query: str, count: int, timings: Dict[str, float],
+                       file_ids: Optional[Set[int]] = None) -> List[Dict[str, Any]]:
+        start = time.perf_counter()
+        hits = search_chunks(self.indexer.db.conn, query, count, file_ids=file_ids)
+        if hits is None:
+            # Không có FTS5: dùng tìm kiếm từ khóa (LIKE) của ContentIndexer
+            hits = self.indexer._keyword_search(query, count, file_ids)
+        timings['lexical'] = time.perf_counter() - start
+        return hits
+
+    def _vector_stage(self, query: str, count: int, timings: Dict[str, float], positions=None):
+        """Encode truy vấn và quét chỉ mục (chạy ở luồng nền, không dùng database)"""
+        index = self.indexer.index
+        if not self.indexer.model or index is None:
+            return None, []
+        if positions is not None and not len(positions):
+            return None, []
+
+        start = time.perf_counter()
+        query_vector = self.indexer.model.encode([query])[0]
+        timings['encode'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if isinstance(index, QuantizedIndex):
+            # Xếp hạng lại cần đọc vector từ database nên để luồng chính làm
+            hits = index.candidates(query_vector, count * index.rerank_factor, positions)
+        else:
+            hits = index.search(query_vector, count, positions=positions)
+        timings['vector'] = time.perf_counter() - start
+
+        return query_vector, hits
+
+    def _finish_vector_stage(self, future, count: int, timings: Dict[str, float]) -> List[Dict[str, Any]]:
+        try:
+            query_vector, hits = future.result()
+        except Exception as e:
+            print(f"Lỗi khi tìm kiếm vector: {e}")
+            return []
+
+        index = self.indexer.index
+        if isinstance(index, QuantizedIndex) and hits:
+            start = time.perf_counter()
+            hits = index.rerank(query_vector, hits, count)
+            timings['rerank'] = time.perf_counter() - start
+
+        results = []
+        for position, score in hits:
+            if 0 <= position < len(self.indexer.file_ids):
+                file_id, content_id = self.indexer.file_ids[position]
+                results.append({'file_id': file_id, 'content_id': content_id, 'score': score})
+        return results
+
+    def _hydrate(self, fused, lexical_files, vector_files) -> List[Dict[str, Any]]:
+        """Lấy thông tin file và nội dung đoạn cho kết quả cuối (truy vấn IN theo lô)"""
+        if not fused:
+            return []
+
+        conn = self.indexer.db.conn
+        file_ids = [file_id for file_id, _ in fused]
+        files = fetch_files(conn, file_ids, 'id, abs_path, filename')
+
+        # Nội dung của các đoạn chỉ được tìm thấy bằng vector
+        contents = fetch_contents(conn, [vector_files[file_id]['content_id'] for file_id in file_ids
+                                         if file_id not in lexical_files and file_id in vector_files])
+
+        lexical_ranks = {file_id: rank for rank, file_id in enumerate(lexical_files, start=1)}
+        vector_ranks = {file_id: rank for rank, file_id in enumerate(vector_files, start=1)}
+
+        results = []
+        for file_id, score in fused:
+            file = files.get(file_id)
+            if not file:
+                continue
+
+            lexical = lexical_files.get(file_id)
+            vector = vector_files.get(file_id)
+            results.append({
+                'file_id': file_id,
+                'file_path': file['abs_path'],
+                'filename': file['filename'],
+                'content': lexical['content'] if lexical else contents.get(vector['content_id']),
+                'snippet': lexical.get('snippet') if lexical else None,
+                'score': score,
+                'lexical_rank': lexical_ranks.get(file_id),
+                'vector_rank': vector_ranks.get(file_id),
+                'vector_score': vector['score'] if vector else None
+            })
+
+        return results
@@ -0,0 +1,75 @@
+from typing import Any, Dict, Iterable, List, Sequence
+
+from core.db import MAX_IN_PARAMS, chunked
+
+
+def fetch_files(conn, file_ids: Iterable[int], columns: str = '*') -> Dict[int, Dict[str, Any]]:
+    """Lấy thông tin các file theo id (một truy vấn cho mỗi lô MAX_IN_PARAMS id)"""
+    files = {}
+    for batch in chunked(file_ids):
+        placeholders = ','.join('?' * len(batch))
+        cursor = conn.execute(f"SELECT {columns} FROM files WHERE id IN ({placeholders})", batch)
+        files.update((row['id'], dict(row)) for row in cursor.fetchall())
+    return files
+
+
+def fetch_contents(conn, content_ids: Iterable[int]) -> Dict[int, str]:
+    """Lấy nội dung các đoạn văn bản theo id"""
+    contents = {}
+    for batch in chunked(content_ids):
+        placeholders = ','.join('?' * len(batch))
+        cursor = conn.execute(
+            f"SELECT id, content FROM content_index WHERE id IN ({placeholders})", batch)
+        contents.update((row['id'], row['content']) for row in cursor.fetchall())
+    return contents
+
+
+def fetch_tags(conn, file_ids: Iterable[int]) -> Dict[int, List[str]]:
+    """Lấy danh sách tag của nhiều file bằng một phép join"""
+    tags = {}
+    for batch in chunked(file_ids):
+        placeholders = ','.join('?' * len(batch))
+        cursor = conn.execute(
+            f"""SELECT ft.file_id, t.name
+                FROM file_tags ft
+                JOIN tags t ON t.id = ft.tag_id
+                WHERE ft.file_id IN ({placeholders})
+                ORDER BY t.name""",
+            batch)
+        for row in cursor.fetchall():
+            tags.setdefault(row['file_id'], []).append(row['name'])
+    return tags
+
+
+def hydrate_hits(conn, hits: Sequence[Dict[str, Any]], with_tags: bool = False) -> List[Dict[str, Any]]:
+    """Bổ sung thông tin file, nội dung đoạn (và tag) cho các kết quả tìm kiếm
+
+    Mỗi hit cần có 'file_id' và 'content_id'; các khóa khác (như 'score') được
+    giữ nguyên. Số truy vấn không phụ thuộc số kết quả. Hit có file hoặc đoạn
+    văn bản đã bị xóa sẽ bị bỏ qua.
+    """
+    if not hits:
+        return []
+
+    files = fetch_files(conn, (hit['file_id'] for hit in hits), 'id, abs_path, filename')
+    contents = fetch_contents(conn, (hit['content_id'] for hit in hits))
+    tags = fetch_tags(conn, files) if with_tags else {}
+
+    results = []
+    for hit in hits:
+        file_info = files.get(hit['file_id'])
+        content = contents.get(hit['content_id'])
+        if not file_info or not content:
+            continue
+
+        result = dict(hit)
+        result.update({
+            'file_path': file_info['abs_path'],
+            'filename': file_info['filename'],
+            'content': content
+        })
+        if with_tags:
+            result['tags'] = tags.get(hit['file_id'], [])
+        results.append(result)
+
+    return results
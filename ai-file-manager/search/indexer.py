@@ -1,46 +1,52 @@
 import os
-import sqlite3
 import numpy as np
-from pathlib import Path
-from typing import List, Dict, Any, Optional, Tuple, Union
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 
-try:
-    import faiss
-    FAISS_AVAILABLE = True
-except ImportError:
-    FAISS_AVAILABLE = False
-
-try:
-    from sentence_transformers import SentenceTransformer
-    SENTENCE_TRANSFORMERS_AVAILABLE = True
-except ImportError:
-    SENTENCE_TRANSFORMERS_AVAILABLE = False
+from core.cache import cached_query, resolve_cache
+from core.db import chunked
+from search.embedding_job import EmbeddingJob
+from search.encoders import ParallelEncoder
+from search.fulltext import search_chunks
+from search.hydrate import fetch_tags, hydrate_hits
+from search.models import DEFAULT_MODEL, SENTENCE_TRANSFORMERS_AVAILABLE, get_model
+from search.quantization import QuantizedIndex
+from search.vector_store import FAISS_AVAILABLE, VectorIndex, vector_to_bytes, vector_from_bytes
 
 class ContentIndexer:
     """Lớp đánh chỉ mục và tìm kiếm nội dung"""
     
-    def __init__(self, db, model_name='paraphrase-multilingual-MiniLM-L12-v2'):
-        """Khởi tạo với kết nối database và mô hình embedding"""
+    def __init__(self, db, model_name=DEFAULT_MODEL, vector_dtype='float32', index_precision=None,
+                 rerank_factor=4, cache=None):
+        """Khởi tạo với kết nối database và mô hình embedding
+        
+        vector_dtype là kiểu lưu vector trong database (float32/float16), index_precision
+        là kiểu mã trong bộ nhớ khi tìm kiếm (float32/float16/int8/binary). Với int8 và
+        binary, các ứng viên được xếp hạng lại bằng vector đầy đủ đọc từ database.
+        cache=False tắt cache kết quả tìm kiếm.
+        """
         self.db = db
         self.model_name = model_name
+        self.vector_dtype = vector_dtype
+        self.index_precision = index_precision or vector_dtype
+        self.rerank_factor = rerank_factor
         self.model = None
         self.index = None
         self.file_ids = []
+        self._positions_by_file = None
+        self.job_stats = None
+        self.cache = resolve_cache(cache)
+        # Tăng mỗi lần xây dựng lại chỉ mục để kết quả cache cũ không còn khớp
+        self.index_version = 0
         
         # Kiểm tra các thư viện cần thiết
         if not FAISS_AVAILABLE:
-            print("Cảnh báo: Thư viện FAISS không khả dụng. Tìm kiếm vector sẽ bị vô hiệu hóa.")
+            print("Cảnh báo: Thư viện FAISS không khả dụng. Tìm kiếm vector sẽ dùng numpy (chậm hơn).")
         
         if not SENTENCE_TRANSFORMERS_AVAILABLE:
             print("Cảnh báo: Thư viện sentence-transformers không khả dụng. Tạo embedding sẽ bị vô hiệu hóa.")
         
-        # Tải mô hình nếu có thể
-        if SENTENCE_TRANSFORMERS_AVAILABLE:
-            try:
-                self.model = SentenceTransformer(model_name)
-                print(f"Đã tải mô hình embedding: {model_name}")
-            except Exception as e:
-                print(f"Lỗi khi tải mô hình embedding: {e}")
+        # Mô hình dùng chung trong tiến trình, chỉ được tải khi encode lần đầu
+        self.model = get_model(model_name)
     
     def index_text_content(self, file_id: int, content: str, chunk_size: int = 1000, overlap: int = 200) -> bool:
         """Đánh chỉ mục nội dung văn bản của file"""
@@ -53,7 +59,11 @@ class ContentIndexer:
         # Lưu các đoạn vào database
         cursor = self.db.conn.cursor()
         try:
-            # Xóa các đoạn cũ nếu có
+            # Xóa các đoạn cũ và embedding của chúng (nội dung không đổi sẽ được
+            # lấy lại từ embedding_cache khi tạo embedding, không phải encode lại)
+            cursor.execute(
+                "DELETE FROM embeddings WHERE content_id IN (SELECT id FROM content_index WHERE file_id = ?)",
+                (file_id,))
             cursor.execute("DELETE FROM content_index WHERE file_id = ?", (file_id,))
             
             # Thêm các đoạn mới
@@ -62,6 +72,7 @@ class ContentIndexer:
                     "INSERT INTO content_index (file_id, chunk_index, content) VALUES (?, ?, ?)",
                     (file_id, i, chunk))
             
+            self.db.bump_generation()
             self.db.conn.commit()
             return True
         except Exception as e:
@@ -69,78 +80,35 @@ class ContentIndexer:
             print(f"Lỗi khi đánh chỉ mục nội dung: {e}")
             return False
     
-    def create_embeddings(self, rebuild: bool = False) -> bool:
-        """Tạo embedding cho tất cả các đoạn văn bản"""
-        if not SENTENCE_TRANSFORMERS_AVAILABLE or not self.model:
+    def create_embeddings(self, rebuild: bool = False, workers: Optional[int] = None) -> bool:
+        """Tạo embedding cho tất cả các đoạn văn bản (có thể tiếp tục nếu bị gián đoạn)
+        
+        workers > 1 sẽ encode bằng pool tiến trình CPU thay vì một tiến trình.
+        """
+        if not self.model:
             print("Không thể tạo embedding: Mô hình không khả dụng")
             return False
         
-        cursor = self.db.conn.cursor()
-        
+        encoder = None
         try:
-            # Lấy các đoạn chưa có embedding hoặc tất cả nếu rebuild
-            if rebuild:
-                cursor.execute("SELECT id, file_id, content FROM content_index")
-            else:
-                cursor.execute(
-                    """SELECT ci.id, ci.file_id, ci.content 
-                       FROM content_index ci 
-                       LEFT JOIN embeddings e ON ci.id = e.content_id 
-                       WHERE e.id IS NULL""")
-            
-            chunks = cursor.fetchall()
-            
-            if not chunks:
-                print("Không có đoạn văn bản nào cần tạo embedding")
-                return True
-            
-            print(f"Đang tạo embedding cho {len(chunks)} đoạn văn bản...")
-            
-            # Tạo embedding theo batch
-            batch_size = 32
-            for i in range(0, len(chunks), batch_size):
-                batch = chunks[i:i+batch_size]
-                texts = [chunk['content'] for chunk in batch]
-                embeddings = self.model.encode(texts)
-                
-                # Lưu embedding vào database
-                for j, emb in enumerate(embeddings):
-                    chunk_id = batch[j]['id']
-                    file_id = batch[j]['file_id']
-                    
-                    # Chuyển đổi embedding thành bytes
-                    emb_bytes = np.array(emb, dtype=np.float32).tobytes()
-                    
-                    # Kiểm tra xem embedding đã tồn tại chưa
-                    cursor.execute(
-                        "SELECT id FROM embeddings WHERE content_id = ?", 
-                        (chunk_id,))
-                    existing = cursor.fetchone()
-                    
-                    if existing:
-                        cursor.execute(
-                            "UPDATE embeddings SET vector = ? WHERE id = ?",
-                            (emb_bytes, existing['id']))
-                    else:
-                        cursor.execute(
-                            "INSERT INTO embeddings (content_id, file_id, vector) VALUES (?, ?, ?)",
-                            (chunk_id, file_id, emb_bytes))
-                
-                self.db.conn.commit()
-                print(f"Đã tạo embedding cho {min(i+batch_size, len(chunks))}/{len(chunks)} đoạn văn bản")
+            if workers and workers > 1:
+                encoder = ParallelEncoder(self.model_name, workers=workers)
             
+            self.job_stats = self.embedding_job(encoder).run(rebuild=rebuild)
             return True
         except Exception as e:
-            self.db.conn.rollback()
             print(f"Lỗi khi tạo embedding: {e}")
             return False
+        finally:
+            if encoder:
+                encoder.close()
+    
+    def embedding_job(self, encoder=None) -> EmbeddingJob:
+        """Tạo công việc embedding dạng luồng cho mô hình của chỉ mục"""
+        return EmbeddingJob(self.db, encoder or self.model, self.model_name, vector_dtype=self.vector_dtype)
     
     def build_faiss_index(self) -> bool:
-        """Xây dựng chỉ mục FAISS từ các embedding"""
-        if not FAISS_AVAILABLE:
-            print("Không thể xây dựng chỉ mục FAISS: Thư viện không khả dụng")
-            return False
-        
+        """Xây dựng chỉ mục tích vô hướng (cosine) từ các embedding"""
         if not self.model:
             print("Không thể xây dựng chỉ mục FAISS: Mô hình không khả dụng")
             return False
@@ -148,87 +116,151 @@ class ContentIndexer:
         cursor = self.db.conn.cursor()
         
         try:
-            # Lấy tất cả các embedding
+            # Đọc embedding theo lô để không phải giữ toàn bộ vector float trong bộ nhớ
             cursor.execute(
-                """SELECT e.id, e.file_id, e.content_id, e.vector, ci.content 
+                """SELECT e.file_id, e.content_id, e.vector, e.dtype 
                    FROM embeddings e 
-                   JOIN content_index ci ON e.content_id = ci.id""")
+                   JOIN content_index ci ON e.content_id = ci.id
+                   ORDER BY e.content_id""")
             
-            embeddings = cursor.fetchall()
+            self.index = None
+            self.file_ids = []
+            self._positions_by_file = None
+            self.index_version += 1
+            
+            while True:
+                rows = cursor.fetchmany(4096)
+                if not rows:
+                    break
+                
+                vectors = np.stack([vector_from_bytes(row['vector'], row['dtype'] or 'float32') for row in rows])
+                if self.index is None:
+                    self.index = self._create_index(vectors.shape[1])
+                
+                self.index.add(vectors)
+                self.file_ids.extend((row['file_id'], row['content_id']) for row in rows)
             
-            if not embeddings:
+            if self.index is None:
                 print("Không có embedding nào để xây dựng chỉ mục FAISS")
                 return False
             
-            print(f"Đang xây dựng chỉ mục FAISS cho {len(embeddings)} embedding...")
-            
-            # Lấy kích thước embedding
-            vector_size = len(np.frombuffer(embeddings[0]['vector'], dtype=np.float32))
-            
-            # Tạo chỉ mục FAISS
-            self.index = faiss.IndexFlatL2(vector_size)
-            
-            # Thêm các embedding vào chỉ mục
-            vectors = np.zeros((len(embeddings), vector_size), dtype=np.float32)
-            self.file_ids = []
-            
-            for i, emb in enumerate(embeddings):
-                vector = np.frombuffer(emb['vector'], dtype=np.float32)
-                vectors[i] = vector
-                self.file_ids.append((emb['file_id'], emb['content_id']))
-            
-            self.index.add(vectors)
-            print(f"Đã xây dựng chỉ mục FAISS cho {len(embeddings)} embedding")
+            print(f"Đã xây dựng chỉ mục FAISS ({self.index_precision}) cho {len(self.file_ids)} embedding")
             
             return True
         except Exception as e:
             print(f"Lỗi khi xây dựng chỉ mục FAISS: {e}")
             return False
     
-    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        """Tìm kiếm nội dung dựa trên truy vấn"""
+    def positions_for_files(self, file_ids: Iterable[int]) -> np.ndarray:
+        """Các vị trí trong chỉ mục thuộc về tập file cho trước (tăng dần)"""
+        if self._positions_by_file is None:
+            grouped = {}
+            for position, (file_id, _) in enumerate(self.file_ids):
+                grouped.setdefault(file_id, []).append(position)
+            self._positions_by_file = {file_id: np.array(found, dtype=np.int64)
+                                       for file_id, found in grouped.items()}
+        
+        found = [self._positions_by_file[file_id] for file_id in file_ids
+                 if file_id in self._positions_by_file]
+        return np.sort(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+    
+    def _create_index(self, dim: int):
+        """Tạo chỉ mục theo độ chính xác đã chọn"""
+        if self.index_precision in ('int8', 'binary'):
+            return QuantizedIndex(dim, self.index_precision, self.rerank_factor,
+                                  fetch_vectors=self._fetch_vectors)
+        
+        # Tạo chỉ mục tích vô hướng trên vector đã chuẩn hóa
+        return VectorIndex(dim, dtype=self.index_precision)
+    
+    def _fetch_vectors(self, positions: np.ndarray) -> np.ndarray:
+        """Đọc vector đầy đủ của các vị trí trong chỉ mục để xếp hạng lại
+        
+        Truy vấn theo lô MAX_IN_PARAMS id. Vị trí không còn embedding nhận một
+        dòng NaN để QuantizedIndex.rerank bỏ ứng viên đó.
+        """
+        content_ids = [self.file_ids[pos][1] for pos in positions]
+        
+        found = {}
+        cursor = self.db.conn.cursor()
+        for batch in chunked(content_ids):
+            placeholders = ','.join('?' * len(batch))
+            cursor.execute(
+                f"SELECT content_id, vector, dtype FROM embeddings WHERE content_id IN ({placeholders})",
+                batch)
+            found.update((row['content_id'], vector_from_bytes(row['vector'], row['dtype'] or 'float32'))
+                         for row in cursor.fetchall())
+        
+        missing = np.full(self.index.dim, np.nan, dtype=np.float32)
+        return np.stack([found.get(cid, missing) for cid in content_ids])
+    
+    @cached_query('content.search', context=('model_name', 'index_precision', 'index_version'))
+    def search(self, query: str, top_k: int = 5, min_score: Optional[float] = None,
+               criteria: Optional[Dict[str, Any]] = None,
+               file_ids: Optional[Iterable[int]] = None,
+               with_tags: bool = False) -> List[Dict[str, Any]]:
+        """Tìm kiếm nội dung dựa trên truy vấn
+        
+        Điểm số là độ tương đồng cosine thực sự (từ -1 đến 1) nên có thể dùng
+        min_score làm ngưỡng lọc kết quả.
+        
+        criteria (giống FileSearcher.search_by_multiple_criteria, thêm root/ext)
+        hoặc file_ids giới hạn tìm kiếm trong các file thỏa điều kiện trước khi
+        quét chỉ mục, nên vẫn trả về đủ top_k kết quả thuộc tập đó.
+        """
         if not query:
             return []
         
-        # Tìm kiếm theo từ khóa nếu không có FAISS hoặc mô hình
-        if not FAISS_AVAILABLE or not self.model or not self.index:
-            return self._keyword_search(query, top_k)
+        if criteria:
+            from search.searcher import FileSearcher
+            allowed = FileSearcher(self.db).resolve_file_ids(criteria)
+            file_ids = allowed if file_ids is None else allowed & set(file_ids)
+        
+        # Tìm kiếm theo từ khóa nếu không có mô hình hoặc chỉ mục
+        if not self.model or not self.index:
+            return self._keyword_search(query, top_k, file_ids, with_tags)
         
         try:
+            positions = None
+            if file_ids is not None:
+                positions = self.positions_for_files(file_ids)
+                if not len(positions):
+                    return []
+            
             # Tạo embedding cho truy vấn
-            query_vector = self.model.encode([query])[0].reshape(1, -1).astype(np.float32)
+            query_vector = self.model.encode([query])[0]
             
-            # Tìm kiếm các embedding gần nhất
-            distances, indices = self.index.search(query_vector, top_k)
+            # Tìm kiếm các embedding gần nhất (chỉ trong các vị trí được phép nếu có lọc)
+            hits = self.index.search(query_vector, top_k, positions=positions)
             
-            results = []
-            for i, idx in enumerate(indices[0]):
+            matches = []
+            for idx, score in hits:
                 if idx < 0 or idx >= len(self.file_ids):
                     continue
                 
-                file_id, content_id = self.file_ids[idx]
-                distance = distances[0][i]
-                
-                # Lấy thông tin file và nội dung
-                file_info = self._get_file_info(file_id)
-                content = self._get_content(content_id)
+                if min_score is not None and score < min_score:
+                    continue
                 
-                if file_info and content:
-                    results.append({
-                        'file_id': file_id,
-                        'file_path': file_info['abs_path'],
-                        'filename': file_info['filename'],
-                        'content': content,
-                        'score': float(1.0 / (1.0 + distance))  # Chuyển đổi khoảng cách thành điểm số
-                    })
+                file_id, content_id = self.file_ids[idx]
+                matches.append({'file_id': file_id, 'content_id': content_id,
+                                'score': score})  # Độ tương đồng cosine
+            
+            # Lấy thông tin file và nội dung của mọi kết quả bằng một số truy vấn cố định
+            results = hydrate_hits(self.db.conn, matches, with_tags=with_tags)
             
             return results
         except Exception as e:
             print(f"Lỗi khi tìm kiếm vector: {e}")
-            return self._keyword_search(query, top_k)
+            return self._keyword_search(query, top_k, file_ids, with_tags)
     
-    def _keyword_search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        """Tìm kiếm nội dung dựa trên từ khóa"""
+    def _keyword_search(self, query: str, top_k: int = 5,
+                        file_ids: Optional[Iterable[int]] = None,
+                        with_tags: bool = False) -> List[Dict[str, Any]]:
+        """Tìm kiếm nội dung dựa trên từ khóa (FTS5 + BM25, dùng LIKE nếu không có FTS5)"""
+        results = search_chunks(self.db.conn, query, top_k, file_ids=file_ids)
+        if results is not None:
+            return self._add_tags(results) if with_tags else results
+        
         cursor = self.db.conn.cursor()
         
         # Chuẩn bị truy vấn SQL
@@ -240,6 +272,11 @@ class ContentIndexer:
             like_clauses.append("ci.content LIKE ?")
             params.append(f"%{term}%")
         
+        if file_ids is not None:
+            file_ids = list(file_ids)
+            like_clauses.append(f"ci.file_id IN ({','.join('?' * len(file_ids))})")
+            params.extend(file_ids)
+        
         where_clause = " AND ".join(like_clauses)
         
         try:
@@ -262,28 +299,17 @@ class ContentIndexer:
                     'score': 1.0  # Điểm số mặc định cho tìm kiếm từ khóa
                 })
             
-            return results
+            return self._add_tags(results) if with_tags else results
         except Exception as e:
             print(f"Lỗi khi tìm kiếm từ khóa: {e}")
             return []
     
-    def _get_file_info(self, file_id: int) -> Optional[Dict[str, Any]]:
-        """Lấy thông tin file từ database"""
-        cursor = self.db.conn.cursor()
-        cursor.execute(
-            "SELECT id, abs_path, filename, size, created_at, modified_at, hash FROM files WHERE id = ?",
-            (file_id,))
-        
-        file_info = cursor.fetchone()
-        return dict(file_info) if file_info else None
-    
-    def _get_content(self, content_id: int) -> Optional[str]:
-        """Lấy nội dung từ database"""
-        cursor = self.db.conn.cursor()
-        cursor.execute("SELECT content FROM content_index WHERE id = ?", (content_id,))
-        
-        content = cursor.fetchone()
-        return content['content'] if content else None
+    def _add_tags(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Bổ sung tag cho kết quả tìm kiếm từ khóa (giống hydrate_hits với with_tags)"""
+        tags = fetch_tags(self.db.conn, (result['file_id'] for result in results))
+        for result in results:
+            result['tags'] = tags.get(result['file_id'], [])
+        return results
     
     def _chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
         """Chia văn bản thành các đoạn nhỏ với độ chồng lấp"""
@@ -308,7 +334,12 @@ class ContentIndexer:
                     end = min(start + chunk_size, text_len)
             
             chunks.append(text[start:end])
-            start = end - overlap  # Chồng lấp với đoạn trước
+            
+            # Dừng khi đã tới cuối văn bản (tránh lặp vô hạn ở đoạn cuối)
+            if end >= text_len:
+                break
+            
+            start = max(end - overlap, start + 1)  # Chồng lấp với đoạn trước
             
             # Đảm bảo vị trí bắt đầu hợp lệ
             if start < 0:
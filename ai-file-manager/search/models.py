@@ -0,0 +1,91 @@
+import importlib.util
+import threading
+import time
+from typing import Dict, Optional
+
+# Chỉ kiểm tra thư viện có được cài đặt hay không, không import (import torch mất vài giây)
+SENTENCE_TRANSFORMERS_AVAILABLE = importlib.util.find_spec('sentence_transformers') is not None
+
+DEFAULT_MODEL = 'paraphrase-multilingual-MiniLM-L12-v2'
+
+_registry: Dict[str, 'LazyModel'] = {}
+_registry_lock = threading.Lock()
+
+
+class LazyModel:
+    """Mô hình embedding chỉ được tải khi encode lần đầu"""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._model = None
+        self._error = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def load(self):
+        """Tải mô hình (một lần duy nhất, an toàn khi gọi từ nhiều luồng)"""
+        if self._model is not None:
+            return self._model
+
+        with self._lock:
+            if self._model is None:
+                if self._error is not None:
+                    raise RuntimeError(f"Không thể tải mô hình embedding {self.model_name}: {self._error}")
+
+                try:
+                    from sentence_transformers import SentenceTransformer
+
+                    start = time.perf_counter()
+                    self._model = SentenceTransformer(self.model_name)
+                    print(f"Đã tải mô hình embedding: {self.model_name} ({time.perf_counter() - start:.1f}s)")
+                except Exception as e:
+                    self._error = e
+                    raise RuntimeError(f"Không thể tải mô hình embedding {self.model_name}: {e}")
+
+        return self._model
+
+    def encode(self, sentences, **kwargs):
+        """Tạo embedding, tải mô hình nếu chưa tải"""
+        return self.load().encode(sentences, **kwargs)
+
+    def __getattr__(self, name):
+        # Các thuộc tính khác (tokenizer, max_seq_length, ...) được chuyển cho mô hình thật
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+
+def get_model(model_name: str = DEFAULT_MODEL) -> Optional[LazyModel]:
+    """Lấy mô hình dùng chung trong toàn tiến trình (None nếu thiếu sentence-transformers)"""
+    if not SENTENCE_TRANSFORMERS_AVAILABLE:
+        return None
+
+    with _registry_lock:
+        model = _registry.get(model_name)
+        if model is None:
+            model = LazyModel(model_name)
+            _registry[model_name] = model
+        return model
+
+
+def preload_model(model_name: str = DEFAULT_MODEL, background: bool = True) -> Optional[LazyModel]:
+    """Tải trước mô hình (ví dụ khi khởi động web server) để truy vấn đầu tiên không phải chờ"""
+    model = get_model(model_name)
+    if model is None or model.loaded:
+        return model
+
+    def _load():
+        try:
+            model.load()
+        except RuntimeError as e:
+            print(e)
+
+    if background:
+        threading.Thread(target=_load, name=f"preload-{model_name}", daemon=True).start()
+    else:
+        _load()
+
+    return model
@@ -0,0 +1,57 @@
+import base64
+import binascii
+import json
+from typing import Any, Dict, List, Optional, Sequence
+
+# Số kết quả mặc định của một trang
+PAGE_SIZE = 50
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Mã hóa vị trí (khóa của dòng cuối cùng) thành chuỗi cursor mờ, an toàn cho URL"""
+    raw = json.dumps(list(values), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    """Giải mã cursor, kiểm tra số thành phần; ValueError nếu cursor không hợp lệ"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError(f"Cursor không hợp lệ: {cursor}")
+
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError(f"Cursor không hợp lệ: {cursor}")
+    return values
+
+
+def page_offset(page: Optional[int], limit: int) -> int:
+    """Vị trí bắt đầu của trang (đánh số từ 1)"""
+    if page is None:
+        return 0
+    if page < 1:
+        raise ValueError(f"Số trang phải từ 1 trở lên: {page}")
+    return (page - 1) * limit
+
+
+def paginate_ranked(search, limit: int = PAGE_SIZE, cursor: Optional[str] = None,
+                    page: Optional[int] = None) -> Dict[str, Any]:
+    """Phân trang cho kết quả đã xếp hạng theo điểm (tìm kiếm ngữ nghĩa)
+
+    Thứ hạng phụ thuộc truy vấn nên cursor lưu vị trí trong bảng xếp hạng.
+    search(n) trả về n kết quả tốt nhất; chỉ lấy thêm một kết quả để biết
+    còn trang sau hay không.
+    """
+    offset = decode_cursor(cursor, 1)[0] if cursor else page_offset(page, limit)
+    if not isinstance(offset, int) or offset < 0:
+        raise ValueError(f"Cursor không hợp lệ: {cursor}")
+
+    ranked = search(offset + limit + 1)
+    results = ranked[offset:offset + limit]
+    has_more = len(ranked) > offset + limit
+
+    return {
+        'results': results,
+        'next_cursor': encode_cursor([offset + limit]) if has_more else None
+    }
@@ -0,0 +1,179 @@
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from search.vector_store import normalize_vectors, top_k_scores
+
+PRECISIONS = ('float32', 'float16', 'int8', 'binary')
+
+# Số byte cho mỗi chiều (binary: 1 bit)
+BYTES_PER_DIM = {'float32': 4, 'float16': 2, 'int8': 1, 'binary': 1 / 8}
+
+# Bảng đếm bit cho từng giá trị byte (dùng tính khoảng cách Hamming)
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+# Số hàng được chấm điểm mỗi lần để không phải giải nén toàn bộ ma trận mã
+_SCAN_BLOCK = 65536
+
+
+def quantize(vectors, precision: str) -> np.ndarray:
+    """Lượng tử hóa các vector (đã chuẩn hóa L2) theo độ chính xác cho trước"""
+    vectors = normalize_vectors(vectors)
+
+    if precision == 'float32':
+        return vectors
+    if precision == 'float16':
+        return vectors.astype(np.float16)
+    if precision == 'int8':
+        # Các thành phần của vector chuẩn hóa nằm trong [-1, 1] nên dùng thang cố định 127
+        return np.clip(np.round(vectors * 127), -127, 127).astype(np.int8)
+    if precision == 'binary':
+        # Chỉ giữ bit dấu của từng thành phần
+        return np.packbits(vectors > 0, axis=1)
+
+    raise ValueError(f"Độ chính xác vector không hợp lệ: {precision}")
+
+
+def dequantize(codes: np.ndarray, precision: str, dim: int) -> np.ndarray:
+    """Giải lượng tử về float32 (xấp xỉ, dùng cho chấm điểm sơ bộ)"""
+    if precision in ('float32', 'float16'):
+        return codes.astype(np.float32)
+    if precision == 'int8':
+        return codes.astype(np.float32) / 127.0
+    if precision == 'binary':
+        bits = np.unpackbits(codes, axis=1, count=dim).astype(np.float32)
+        return (bits * 2 - 1) / np.sqrt(dim)
+
+    raise ValueError(f"Độ chính xác vector không hợp lệ: {precision}")
+
+
+def hamming_distances(codes: np.ndarray, query_code: np.ndarray) -> np.ndarray:
+    """Khoảng cách Hamming giữa mã nhị phân của truy vấn và từng hàng"""
+    return _POPCOUNT[np.bitwise_xor(codes, query_code)].sum(axis=1, dtype=np.int32)
+
+
+class QuantizedIndex:
+    """Chỉ mục hai giai đoạn: quét mã lượng tử rẻ rồi xếp hạng lại bằng vector float
+
+    Chỉ các mã lượng tử (int8 hoặc bit dấu) nằm trong RAM. Vector float đầy đủ
+    của các ứng viên được đọc qua hàm fetch_vectors (ví dụ từ database) để tính
+    điểm cosine chính xác; dòng chứa NaN nghĩa là không còn vector và ứng viên
+    đó bị bỏ.
+    """
+
+    def __init__(self, dim: int, precision: str = 'int8', rerank_factor: int = 4,
+                 fetch_vectors: Optional[Callable[[np.ndarray], np.ndarray]] = None):
+        """Khởi tạo với số chiều, độ chính xác và hệ số lấy ứng viên để xếp hạng lại"""
+        if precision not in PRECISIONS:
+            raise ValueError(f"Độ chính xác vector không hợp lệ: {precision}")
+
+        self.dim = dim
+        self.precision = precision
+        self.rerank_factor = rerank_factor
+        self.fetch_vectors = fetch_vectors
+        self.codes = None
+        self._blocks = []
+
+    def __len__(self) -> int:
+        self._consolidate()
+        return 0 if self.codes is None else len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        self._consolidate()
+        return 0 if self.codes is None else int(self.codes.nbytes)
+
+    def add(self, vectors) -> None:
+        """Lượng tử hóa và thêm các vector vào chỉ mục"""
+        self._blocks.append(quantize(vectors, self.precision))
+
+    def _consolidate(self) -> None:
+        if self._blocks:
+            blocks = ([self.codes] if self.codes is not None else []) + self._blocks
+            self.codes = np.ascontiguousarray(np.concatenate(blocks))
+            self._blocks = []
+
+    def candidates(self, query_vector, count: int,
+                   positions: Optional[Sequence[int]] = None) -> List[Tuple[int, float]]:
+        """Giai đoạn 1: chọn ứng viên bằng điểm xấp xỉ trên mã lượng tử
+        
+        positions giới hạn việc quét trong các vị trí cho trước.
+        """
+        self._consolidate()
+        if self.codes is None or count <= 0:
+            return []
+
+        query = normalize_vectors(query_vector)[0]
+        codes = self.codes
+        if positions is not None:
+            positions = np.asarray(positions, dtype=np.int64)
+            codes = codes[positions]
+
+        if self.precision == 'binary':
+            # Khoảng cách Hamming nhỏ ~ góc nhỏ, đổi dấu để dùng chung top_k_scores
+            distances = hamming_distances(codes, quantize(query, 'binary')[0])
+            scores = 1.0 - 2.0 * distances.astype(np.float32) / self.dim
+        else:
+            scores = np.empty(len(codes), dtype=np.float32)
+            for start in range(0, len(codes), _SCAN_BLOCK):
+                block = codes[start:start + _SCAN_BLOCK]
+                scores[start:start + len(block)] = dequantize(block, self.precision, self.dim) @ query
+
+        hits = top_k_scores(scores, count)
+        if positions is not None:
+            return [(int(positions[i]), score) for i, score in hits]
+        return hits
+
+    def search(self, query_vector, top_k: int = 5,
+               positions: Optional[Sequence[int]] = None) -> List[Tuple[int, float]]:
+        """Tìm top_k vị trí, xếp hạng lại bằng vector float nếu có fetch_vectors"""
+        if self.fetch_vectors is None or self.precision in ('float32', 'float16'):
+            return self.candidates(query_vector, top_k, positions)
+
+        hits = self.candidates(query_vector, top_k * self.rerank_factor, positions)
+        return self.rerank(query_vector, hits, top_k)
+
+    def rerank(self, query_vector, hits: List[Tuple[int, float]], top_k: int) -> List[Tuple[int, float]]:
+        """Giai đoạn 2: tính lại điểm cosine chính xác cho các ứng viên bằng vector float"""
+        if not hits or self.fetch_vectors is None:
+            return hits[:top_k]
+
+        positions = np.array([pos for pos, _ in hits], dtype=np.int64)
+        vectors = np.asarray(self.fetch_vectors(positions))
+        # Bỏ ứng viên không còn vector đầy đủ thay vì xếp hạng với điểm giả
+        valid = np.isfinite(vectors).all(axis=1)
+        positions, vectors = positions[valid], vectors[valid]
+        if not len(positions):
+            return []
+        exact = normalize_vectors(vectors) @ normalize_vectors(query_vector)[0]
+        return [(int(positions[i]), score) for i, score in top_k_scores(exact, top_k)]
+
+
+def measure_tradeoffs(vectors, queries, top_k: int = 10, rerank_factor: int = 4,
+                      precisions: Sequence[str] = PRECISIONS) -> List[Dict[str, Any]]:
+    """Đo bộ nhớ và recall@k của từng độ chính xác so với tìm kiếm float32 chính xác"""
+    vectors = normalize_vectors(vectors)
+    queries = normalize_vectors(queries)
+    top_k = min(top_k, len(vectors))
+
+    exact = [{pos for pos, _ in top_k_scores(vectors @ q, top_k)} for q in queries]
+    results = []
+
+    for precision in precisions:
+        for rerank in ((False, True) if precision in ('int8', 'binary') else (False,)):
+            index = QuantizedIndex(
+                vectors.shape[1], precision, rerank_factor,
+                fetch_vectors=(lambda positions: vectors[positions]) if rerank else None)
+            index.add(vectors)
+
+            found = [{pos for pos, _ in index.search(q, top_k)} for q in queries]
+            recall = np.mean([len(f & e) / len(e) for f, e in zip(found, exact)]) if exact else 0.0
+
+            results.append({
+                'precision': precision,
+                'rerank': rerank,
+                'bytes_per_vector': int(np.ceil(vectors.shape[1] * BYTES_PER_DIM[precision])),
+                'memory_bytes': index.nbytes,
+                'recall': float(recall)
+            })
+
+    return results
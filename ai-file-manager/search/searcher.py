@@ -2,84 +2,114 @@ import os
 import re
 import sqlite3
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Tuple, Union
+from typing import List, Dict, Any, Iterator, Optional, Set, Tuple, Union
 from datetime import datetime
 
+from core.cache import cached_query, resolve_cache
+from core.db import exif_value, fold_name
+from search.geo import MAX_DISTANCE_KM, bounding_boxes, haversine_km
+from search.pagination import PAGE_SIZE, decode_cursor, encode_cursor, page_offset
+
 class FileSearcher:
     """Lớp tìm kiếm file dựa trên các tiêu chí khác nhau"""
     
-    def __init__(self, db):
-        """Khởi tạo với kết nối database"""
+    def __init__(self, db, cache=None):
+        """Khởi tạo với kết nối database
+        
+        cache mặc định là cache truy vấn dùng chung của tiến trình; truyền
+        False để tắt cache.
+        """
         self.db = db
+        self.cache = resolve_cache(cache)
     
-    def search_by_filename(self, pattern: str, case_sensitive: bool = False) -> List[Dict[str, Any]]:
-        """Tìm kiếm file theo tên file"""
-        cursor = self.db.conn.cursor()
-        
+    @cached_query('files.filename')
+    def search_by_filename(self, pattern: str, case_sensitive: bool = False,
+                           limit: Optional[int] = PAGE_SIZE) -> List[Dict[str, Any]]:
+        """Tìm kiếm file theo tên file (tối đa limit kết quả, None: không giới hạn)"""
         if case_sensitive:
-            cursor.execute(
+            return self._fetch(
                 "SELECT * FROM files WHERE filename LIKE ? ORDER BY filename",
-                (f"%{pattern}%",))
-        else:
-            cursor.execute(
-                "SELECT * FROM files WHERE filename LIKE ? COLLATE NOCASE ORDER BY filename",
-                (f"%{pattern}%",))
+                [f"%{pattern}%"], limit)
         
-        results = [dict(row) for row in cursor.fetchall()]
-        return results
+        # Không phân biệt hoa/thường và dấu: dùng chỉ mục trigram trên name_key
+        clause, params = self._filename_filter(pattern)
+        return self._fetch(
+            f"SELECT * FROM files f WHERE {clause} ORDER BY filename",
+            params, limit)
     
-    def search_by_extension(self, extension: str) -> List[Dict[str, Any]]:
-        """Tìm kiếm file theo phần mở rộng"""
-        if extension.startswith('.'):
-            extension = extension[1:]
+    def _fetch(self, query: str, params: List[Any], limit: Optional[int]) -> List[Dict[str, Any]]:
+        """Thực hiện truy vấn với LIMIT trong SQL thay vì cắt danh sách sau fetchall()
+        
+        limit None đọc toàn bộ kết quả; để duyệt kết quả lớn với bộ nhớ giới hạn
+        dùng iter_search.
+        """
+        if limit is not None:
+            query += " LIMIT ?"
+            params = list(params) + [limit]
         
         cursor = self.db.conn.cursor()
-        cursor.execute(
-            "SELECT * FROM files WHERE filename LIKE ? ORDER BY filename",
-            (f"%.{extension}",))
+        cursor.execute(query, params)
+        return [dict(row) for row in cursor.fetchall()]
+    
+    def _filename_filter(self, pattern: str) -> Tuple[str, List[Any]]:
+        """Điều kiện SQL tìm chuỗi con trong tên file (bảng files có bí danh f)
         
-        results = [dict(row) for row in cursor.fetchall()]
-        return results
+        Với chuỗi từ 3 ký tự trở lên, điều kiện dùng chỉ mục FTS5 trigram nên
+        không phải quét toàn bộ bảng; chuỗi ngắn hơn quét name_key bằng LIKE.
+        """
+        key = fold_name(pattern)
+        
+        if getattr(self.db, 'name_index_enabled', False) and len(key) >= 3:
+            phrase = '"' + key.replace('"', '""') + '"'
+            return "f.id IN (SELECT rowid FROM files_name_fts WHERE files_name_fts MATCH ?)", [phrase]
+        
+        escaped = key.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return "coalesce(f.name_key, lower(f.filename)) LIKE ? ESCAPE '\\'", [f"%{escaped}%"]
     
-    def search_by_mimetype(self, mimetype: str) -> List[Dict[str, Any]]:
-        """Tìm kiếm file theo loại MIME"""
-        cursor = self.db.conn.cursor()
-        cursor.execute(
-            "SELECT * FROM files WHERE mime_type LIKE ? ORDER BY filename",
-            (f"{mimetype}%",))
+    @cached_query('files.extension')
+    def search_by_extension(self, extension: str, limit: Optional[int] = PAGE_SIZE) -> List[Dict[str, Any]]:
+        """Tìm kiếm file theo phần mở rộng (tối đa limit kết quả)"""
+        if extension.startswith('.'):
+            extension = extension[1:]
         
-        results = [dict(row) for row in cursor.fetchall()]
-        return results
+        return self._fetch(
+            "SELECT * FROM files WHERE filename LIKE ? ORDER BY filename",
+            [f"%.{extension}"], limit)
     
-    def search_by_size(self, min_size: Optional[int] = None, max_size: Optional[int] = None) -> List[Dict[str, Any]]:
-        """Tìm kiếm file theo kích thước (bytes)"""
-        cursor = self.db.conn.cursor()
+    @cached_query('files.mimetype')
+    def search_by_mimetype(self, mimetype: str, limit: Optional[int] = PAGE_SIZE) -> List[Dict[str, Any]]:
+        """Tìm kiếm file theo loại MIME (tối đa limit kết quả)"""
+        return self._fetch(
+            "SELECT * FROM files WHERE mimetype LIKE ? ORDER BY filename",
+            [f"{mimetype}%"], limit)
+    
+    def search_by_size(self, min_size: Optional[int] = None, max_size: Optional[int] = None,
+                       limit: Optional[int] = PAGE_SIZE) -> List[Dict[str, Any]]:
+        """Tìm kiếm file theo kích thước (bytes), tối đa limit kết quả
         
+        Không có giới hạn kích thước thì vẫn chỉ đọc limit dòng đầu (theo size);
+        để duyệt toàn bộ bảng files dùng iter_search({'min_size': 0}).
+        """
         if min_size is not None and max_size is not None:
-            cursor.execute(
+            return self._fetch(
                 "SELECT * FROM files WHERE size BETWEEN ? AND ? ORDER BY size",
-                (min_size, max_size))
+                [min_size, max_size], limit)
         elif min_size is not None:
-            cursor.execute(
+            return self._fetch(
                 "SELECT * FROM files WHERE size >= ? ORDER BY size",
-                (min_size,))
+                [min_size], limit)
         elif max_size is not None:
-            cursor.execute(
+            return self._fetch(
                 "SELECT * FROM files WHERE size <= ? ORDER BY size",
-                (max_size,))
-        else:
-            cursor.execute("SELECT * FROM files ORDER BY size")
-        
-        results = [dict(row) for row in cursor.fetchall()]
-        return results
+                [max_size], limit)
+        return self._fetch("SELECT * FROM files ORDER BY size", [], limit)
     
     def search_by_date(self, 
                       start_date: Optional[Union[str, datetime]] = None, 
                       end_date: Optional[Union[str, datetime]] = None,
-                      date_type: str = 'created') -> List[Dict[str, Any]]:
-        """Tìm kiếm file theo ngày tạo hoặc sửa đổi"""
-        cursor = self.db.conn.cursor()
-        
+                      date_type: str = 'created',
+                      limit: Optional[int] = PAGE_SIZE) -> List[Dict[str, Any]]:
+        """Tìm kiếm file theo ngày tạo hoặc sửa đổi (tối đa limit kết quả)"""
         # Chuyển đổi ngày thành chuỗi nếu cần
         if isinstance(start_date, datetime):
             start_date = start_date.strftime('%Y-%m-%d %H:%M:%S')
@@ -87,103 +117,137 @@ class FileSearcher:
             end_date = end_date.strftime('%Y-%m-%d %H:%M:%S')
         
         # Xác định trường ngày
-        date_field = 'created_at' if date_type == 'created' else 'modified_at'
+        date_field = 'created_ts' if date_type == 'created' else 'modified_ts'
         
         if start_date is not None and end_date is not None:
-            cursor.execute(
+            return self._fetch(
                 f"SELECT * FROM files WHERE {date_field} BETWEEN ? AND ? ORDER BY {date_field}",
-                (start_date, end_date))
+                [start_date, end_date], limit)
         elif start_date is not None:
-            cursor.execute(
+            return self._fetch(
                 f"SELECT * FROM files WHERE {date_field} >= ? ORDER BY {date_field}",
-                (start_date,))
+                [start_date], limit)
         elif end_date is not None:
-            cursor.execute(
+            return self._fetch(
                 f"SELECT * FROM files WHERE {date_field} <= ? ORDER BY {date_field}",
-                (end_date,))
-        else:
-            cursor.execute(f"SELECT * FROM files ORDER BY {date_field}")
-        
-        results = [dict(row) for row in cursor.fetchall()]
-        return results
+                [end_date], limit)
+        return self._fetch(f"SELECT * FROM files ORDER BY {date_field}", [], limit)
     
-    def search_by_hash(self, file_hash: str) -> List[Dict[str, Any]]:
-        """Tìm kiếm file theo hash"""
-        cursor = self.db.conn.cursor()
-        cursor.execute(
-            "SELECT * FROM files WHERE hash = ?",
-            (file_hash,))
-        
-        results = [dict(row) for row in cursor.fetchall()]
-        return results
+    def search_by_hash(self, file_hash: str, limit: Optional[int] = PAGE_SIZE) -> List[Dict[str, Any]]:
+        """Tìm kiếm file theo hash (tối đa limit kết quả)"""
+        return self._fetch("SELECT * FROM files WHERE hash_sha256 = ? ORDER BY abs_path", [file_hash], limit)
     
-    def search_by_tag(self, tag_name: str) -> List[Dict[str, Any]]:
-        """Tìm kiếm file theo thẻ"""
-        cursor = self.db.conn.cursor()
-        cursor.execute(
+    @cached_query('files.tag')
+    def search_by_tag(self, tag_name: str, limit: Optional[int] = PAGE_SIZE) -> List[Dict[str, Any]]:
+        """Tìm kiếm file theo thẻ (tối đa limit kết quả)"""
+        return self._fetch(
             """SELECT f.* 
                FROM files f 
                JOIN file_tags ft ON f.id = ft.file_id 
                JOIN tags t ON ft.tag_id = t.id 
                WHERE t.name = ? 
                ORDER BY f.filename""",
-            (tag_name,))
-        
-        results = [dict(row) for row in cursor.fetchall()]
-        return results
+            [tag_name], limit)
     
-    def search_by_exif(self, exif_field: str, value: str) -> List[Dict[str, Any]]:
-        """Tìm kiếm file theo thông tin EXIF"""
-        cursor = self.db.conn.cursor()
-        cursor.execute(
-            """SELECT f.* 
-               FROM files f 
-               JOIN metadata_media mm ON f.id = mm.file_id 
-               WHERE mm.exif_data LIKE ? 
-               ORDER BY f.filename""",
-            (f"%\"{exif_field}\":\"{value}\"%",))
-        
-        results = [dict(row) for row in cursor.fetchall()]
-        return results
+    @cached_query('files.exif')
+    def search_by_exif(self, exif_field: str, value: Any, limit: Optional[int] = PAGE_SIZE) -> List[Dict[str, Any]]:
+        """Tìm kiếm file theo thông tin EXIF (value có thể là danh sách giá trị), tối đa limit kết quả"""
+        clause, params = self._exif_filter(exif_field, value)
+        return self._fetch(
+            f"SELECT f.* FROM files f WHERE {clause} ORDER BY f.filename",
+            params, limit)
     
+    def _exif_filter(self, exif_field: str, value: Any) -> Tuple[str, List[Any]]:
+        """Điều kiện SQL so khớp một trường EXIF (tra chỉ mục (key, value) của exif_tags)
+        
+        Giá trị dạng chuỗi số (từ dòng lệnh) cũng khớp với giá trị số đã lưu.
+        """
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        candidates = []
+        for item in values:
+            item = exif_value(item)
+            if item is None:
+                continue
+            candidates.append(item)
+            if isinstance(item, str):
+                try:
+                    candidates.append(int(item))
+                except ValueError:
+                    try:
+                        candidates.append(float(item))
+                    except ValueError:
+                        pass
+        
+        candidates = list(dict.fromkeys(candidates)) or [None]
+        placeholders = ','.join('?' * len(candidates))
+        return (f"f.id IN (SELECT file_id FROM exif_tags WHERE key = ? AND value IN ({placeholders}))",
+                [exif_field] + candidates)
+    
+    @cached_query('files.location')
     def search_by_location(self, lat: float, lon: float, radius_km: float = 1.0) -> List[Dict[str, Any]]:
-        """Tìm kiếm file theo vị trí địa lý (cần thông tin GPS trong EXIF)"""
-        # Chuyển đổi bán kính từ km sang độ (xấp xỉ)
-        radius_deg = radius_km / 111.0  # 1 độ ~ 111 km
+        """Tìm kiếm file trong bán kính radius_km quanh một vị trí (cần tọa độ GPS)
         
-        cursor = self.db.conn.cursor()
-        cursor.execute(
-            """SELECT f.*, mm.gps_latitude, mm.gps_longitude 
-               FROM files f 
-               JOIN metadata_media mm ON f.id = mm.file_id 
-               WHERE mm.gps_latitude IS NOT NULL AND mm.gps_longitude IS NOT NULL 
-               ORDER BY f.filename"""
-        )
+        Lọc thô bằng hộp giới hạn trên chỉ mục R*Tree, sau đó tính khoảng cách
+        haversine cho các ứng viên. Kết quả sắp xếp theo distance_km tăng dần.
+        """
+        return self._within_radius(lat, lon, radius_km)
+    
+    @cached_query('files.nearest')
+    def search_nearest(self, lat: float, lon: float, k: int = 10,
+                       max_radius_km: float = MAX_DISTANCE_KM) -> List[Dict[str, Any]]:
+        """k file gần vị trí cho trước nhất (trong phạm vi max_radius_km)
+        
+        Bán kính tìm kiếm được nới rộng dần cho đến khi có đủ k file nằm trong
+        hình tròn; mọi file gần hơn file thứ k chắc chắn nằm trong hình tròn đó.
+        """
+        radius_km = min(1.0, max_radius_km)
+        while True:
+            results = self._within_radius(lat, lon, radius_km)
+            if len(results) >= k or radius_km >= max_radius_km:
+                return results[:k]
+            radius_km = min(radius_km * 4, max_radius_km)
+    
+    def _within_radius(self, lat: float, lon: float, radius_km: float) -> List[Dict[str, Any]]:
+        """Các file trong hình tròn, kèm distance_km (mỗi file một kết quả)"""
+        boxes = bounding_boxes(lat, lon, radius_km)
+        params = [value for box in boxes for value in box]
+        
+        if getattr(self.db, 'geo_index_enabled', False):
+            # Hộp trong R*Tree là float 32-bit, chỉ nở ra khi làm tròn nên không bỏ sót điểm
+            box_filter = " OR ".join(
+                "(g.max_lat >= ? AND g.min_lat <= ? AND g.max_lon >= ? AND g.min_lon <= ?)" for _ in boxes)
+            query = f"""SELECT f.*, mm.gps_lat, mm.gps_lon 
+                        FROM media_geo g 
+                        JOIN metadata_media mm ON mm.id = g.id 
+                        JOIN files f ON f.id = mm.file_id 
+                        WHERE {box_filter}"""
+        else:
+            box_filter = " OR ".join(
+                "(mm.gps_lat BETWEEN ? AND ? AND mm.gps_lon BETWEEN ? AND ?)" for _ in boxes)
+            query = f"""SELECT f.*, mm.gps_lat, mm.gps_lon 
+                        FROM metadata_media mm 
+                        JOIN files f ON f.id = mm.file_id 
+                        WHERE {box_filter}"""
         
-        all_files = cursor.fetchall()
-        results = []
+        cursor = self.db.conn.cursor()
+        cursor.execute(query, params)
         
-        for file in all_files:
-            file_lat = file['gps_latitude']
-            file_lon = file['gps_longitude']
-            
-            if file_lat is None or file_lon is None:
+        found = {}
+        for row in cursor.fetchall():
+            distance = haversine_km(lat, lon, row['gps_lat'], row['gps_lon'])
+            if distance > radius_km:
                 continue
-            
-            # Tính khoảng cách (xấp xỉ)
-            distance = ((file_lat - lat) ** 2 + (file_lon - lon) ** 2) ** 0.5
-            
-            if distance <= radius_deg:
-                file_dict = dict(file)
-                file_dict['distance_km'] = distance * 111.0
-                results.append(file_dict)
+            if row['id'] not in found or distance < found[row['id']]['distance_km']:
+                file_dict = dict(row)
+                file_dict['distance_km'] = distance
+                found[row['id']] = file_dict
         
-        # Sắp xếp theo khoảng cách
-        results.sort(key=lambda x: x.get('distance_km', float('inf')))
-        return results
+        return sorted(found.values(), key=lambda x: (x['distance_km'], x['id']))
     
-    def search_duplicates(self, by_content: bool = True) -> List[List[Dict[str, Any]]]:
-        """Tìm kiếm các file trùng lặp"""
+    @cached_query('files.duplicates')
+    def search_duplicates(self, by_content: bool = True,
+                          limit: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+        """Tìm kiếm các file trùng lặp (tối đa limit nhóm, None: mọi nhóm)"""
         cursor = self.db.conn.cursor()
         
         if by_content:
@@ -193,7 +257,9 @@ class FileSearcher:
                    FROM files 
                    WHERE hash_sha256 IS NOT NULL 
                    GROUP BY hash_sha256 
-                   HAVING count > 1""")
+                   HAVING count > 1
+                   LIMIT ?""",
+                (-1 if limit is None else limit,))
             
             duplicate_hashes = [row['hash_sha256'] for row in cursor.fetchall()]
             
@@ -213,7 +279,9 @@ class FileSearcher:
                 """SELECT filename, COUNT(*) as count 
                    FROM files 
                    GROUP BY filename 
-                   HAVING count > 1""")
+                   HAVING count > 1
+                   LIMIT ?""",
+                (-1 if limit is None else limit,))
             
             duplicate_names = [row['filename'] for row in cursor.fetchall()]
             
@@ -228,30 +296,132 @@ class FileSearcher:
             
             return duplicate_groups
     
-    def search_by_multiple_criteria(self, criteria: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """Tìm kiếm file theo nhiều tiêu chí kết hợp"""
+    @cached_query('files.criteria')
+    def search_by_multiple_criteria(self, criteria: Dict[str, Any],
+                                    limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Tìm kiếm file theo nhiều tiêu chí kết hợp (limit được đẩy xuống SQL)"""
+        joins, where_clauses, params = self._criteria_clauses(criteria)
+        
         # Xây dựng truy vấn SQL
         query_parts = ["SELECT f.* FROM files f"]
+        if joins:
+            query_parts.extend(joins)
+        
+        if where_clauses:
+            query_parts.append("WHERE " + " AND ".join(where_clauses))
+        
+        query_parts.append("ORDER BY f.filename")
+        if limit is not None:
+            query_parts.append("LIMIT ?")
+            params.append(limit)
+        query = " ".join(query_parts)
+        
+        # Thực hiện truy vấn
+        cursor = self.db.conn.cursor()
+        cursor.execute(query, params)
+        
+        results = [dict(row) for row in cursor.fetchall()]
+        return results
+    
+    @cached_query('files.page')
+    def search_page(self, criteria: Dict[str, Any], limit: int = PAGE_SIZE,
+                    cursor: Optional[str] = None, page: Optional[int] = None) -> Dict[str, Any]:
+        """Một trang kết quả theo tiêu chí, sắp xếp theo tên file
+        
+        Trả về {'results': [...], 'next_cursor': ...}. Truyền next_cursor vào lần
+        gọi sau để lấy trang tiếp theo (phân trang keyset: không dùng OFFSET nên
+        trang sau nhanh như trang đầu). page (từ 1) chỉ dùng khi không có cursor.
+        next_cursor là None ở trang cuối. ValueError nếu cursor không hợp lệ.
+        """
+        after = decode_cursor(cursor, 2) if cursor else None
+        offset = 0 if cursor else page_offset(page, limit)
+        
+        # Lấy thêm một dòng để biết còn trang sau hay không
+        rows = self._fetch_page(criteria, limit + 1, after, offset)
+        results = rows[:limit]
+        
+        next_cursor = None
+        if len(rows) > limit:
+            last = results[-1]
+            next_cursor = encode_cursor([last['filename'] or '', last['id']])
+        
+        return {'results': results, 'next_cursor': next_cursor}
+    
+    def iter_search(self, criteria: Dict[str, Any], batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Duyệt tất cả file thỏa tiêu chí theo từng lô
+        
+        Bộ nhớ chỉ giữ một lô batch_size dòng dù kết quả lớn đến đâu (ví dụ
+        {'min_size': 0} duyệt toàn bộ bảng files). Không dùng cache.
+        """
+        after = None
+        while True:
+            rows = self._fetch_page(criteria, batch_size, after)
+            yield from rows
+            
+            if len(rows) < batch_size:
+                return
+            after = [rows[-1]['filename'] or '', rows[-1]['id']]
+    
+    def _fetch_page(self, criteria: Dict[str, Any], limit: int,
+                    after: Optional[List[Any]] = None, offset: int = 0) -> List[Dict[str, Any]]:
+        """Các dòng sau khóa (filename, id) cho trước, tối đa limit dòng"""
+        joins, where_clauses, params = self._criteria_clauses(criteria)
+        
+        if after is not None:
+            where_clauses.append("(coalesce(f.filename, ''), f.id) > (?, ?)")
+            params.extend(after)
+        
+        query = " ".join(["SELECT f.* FROM files f"] + joins +
+                         (["WHERE " + " AND ".join(where_clauses)] if where_clauses else []) +
+                         ["ORDER BY coalesce(f.filename, ''), f.id LIMIT ? OFFSET ?"])
+        
+        cursor = self.db.conn.cursor()
+        cursor.execute(query, params + [limit, offset])
+        return [dict(row) for row in cursor.fetchall()]
+    
+    @cached_query('files.ids')
+    def resolve_file_ids(self, criteria: Dict[str, Any]) -> Set[int]:
+        """Chuyển các tiêu chí (giống search_by_multiple_criteria) thành tập id file
+        
+        Dùng để lọc trước cho tìm kiếm vector thay vì lọc sau trên top-k toàn cục.
+        """
+        joins, where_clauses, params = self._criteria_clauses(criteria)
+        
+        query = " ".join(["SELECT DISTINCT f.id FROM files f"] + joins +
+                         (["WHERE " + " AND ".join(where_clauses)] if where_clauses else []))
+        
+        cursor = self.db.conn.cursor()
+        cursor.execute(query, params)
+        return {row[0] for row in cursor.fetchall()}
+    
+    def _criteria_clauses(self, criteria: Dict[str, Any]) -> Tuple[List[str], List[str], List[Any]]:
+        """Xây dựng các JOIN, điều kiện WHERE và tham số cho các tiêu chí tìm kiếm"""
         joins = []
         where_clauses = []
         params = []
         
         # Xử lý các tiêu chí
         if 'filename' in criteria:
-            where_clauses.append("f.filename LIKE ? COLLATE NOCASE")
-            params.append(f"%{criteria['filename']}%")
+            clause, clause_params = self._filename_filter(criteria['filename'])
+            where_clauses.append(clause)
+            params.extend(clause_params)
         
-        if 'extension' in criteria:
-            ext = criteria['extension']
-            if ext.startswith('.'):
-                ext = ext[1:]
-            where_clauses.append("f.filename LIKE ?")
-            params.append(f"%.{ext}")
+        if 'extension' in criteria or 'ext' in criteria:
+            ext = criteria.get('extension') or criteria.get('ext')
+            where_clauses.append("f.ext = ?")
+            params.append(ext.lower().lstrip('.'))
         
         if 'mimetype' in criteria:
-            where_clauses.append("f.mime_type LIKE ?")
+            where_clauses.append("f.mimetype LIKE ?")
             params.append(f"{criteria['mimetype']}%")
         
+        if 'root' in criteria:
+            # Các file nằm trong thư mục gốc (so khớp tiền tố đường dẫn)
+            root = os.path.join(os.path.abspath(criteria['root']), '')
+            escaped = root.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            where_clauses.append("f.abs_path LIKE ? ESCAPE '\\'")
+            params.append(f"{escaped}%")
+        
         if 'min_size' in criteria:
             where_clauses.append("f.size >= ?")
             params.append(criteria['min_size'])
@@ -260,13 +430,13 @@ class FileSearcher:
             where_clauses.append("f.size <= ?")
             params.append(criteria['max_size'])
         
+        date_field = 'f.created_ts' if criteria.get('date_type', 'created') == 'created' else 'f.modified_ts'
+        
         if 'start_date' in criteria:
-            date_field = 'f.created_at' if criteria.get('date_type', 'created') == 'created' else 'f.modified_at'
             where_clauses.append(f"{date_field} >= ?")
             params.append(criteria['start_date'])
         
         if 'end_date' in criteria:
-            date_field = 'f.created_at' if criteria.get('date_type', 'created') == 'created' else 'f.modified_at'
             where_clauses.append(f"{date_field} <= ?")
             params.append(criteria['end_date'])
         
@@ -276,24 +446,13 @@ class FileSearcher:
             where_clauses.append("t.name = ?")
             params.append(criteria['tag'])
         
+        exif = dict(criteria.get('exif') or {})
         if 'exif_field' in criteria and 'exif_value' in criteria:
-            joins.append("JOIN metadata_media mm ON f.id = mm.file_id")
-            where_clauses.append("mm.exif_data LIKE ?")
-            params.append(f"%\"{criteria['exif_field']}\":\"{criteria['exif_value']}\"%")
-        
-        # Kết hợp các phần truy vấn
-        if joins:
-            query_parts.extend(joins)
-        
-        if where_clauses:
-            query_parts.append("WHERE " + " AND ".join(where_clauses))
+            exif[criteria['exif_field']] = criteria['exif_value']
         
-        query_parts.append("ORDER BY f.filename")
-        query = " ".join(query_parts)
+        for exif_field, value in exif.items():
+            clause, clause_params = self._exif_filter(exif_field, value)
+            where_clauses.append(clause)
+            params.extend(clause_params)
         
-        # Thực hiện truy vấn
-        cursor = self.db.conn.cursor()
-        cursor.execute(query, params)
-        
-        results = [dict(row) for row in cursor.fetchall()]
-        return results
\ No newline at end of file
+        return joins, where_clauses, params
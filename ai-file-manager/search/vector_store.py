@@ -0,0 +1,202 @@
+import os
+import numpy as np
+from typing import Iterable, List, Tuple, Optional, Sequence
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+SUPPORTED_DTYPES = ('float32', 'float16')
+
+
+def normalize_vectors(vectors, dtype: str = 'float32') -> np.ndarray:
+    """Chuẩn hóa L2 từng hàng để tích vô hướng bằng đúng độ tương đồng cosine"""
+    matrix = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    # Vector 0 giữ nguyên để tránh chia cho 0 (cosine với mọi vector sẽ là 0)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=dtype)
+
+
+def vector_to_bytes(vector, dtype: str = 'float32') -> bytes:
+    """Chuẩn hóa vector và chuyển thành bytes để lưu vào database"""
+    return normalize_vectors(vector, dtype)[0].tobytes()
+
+
+def vector_from_bytes(blob: bytes, dtype: str = 'float32') -> np.ndarray:
+    """Đọc vector từ bytes trong database và trả về float32"""
+    return np.frombuffer(blob, dtype=dtype).astype(np.float32)
+
+
+class VectorIndex:
+    """Chỉ mục tích vô hướng trên các vector đã chuẩn hóa L2 (điểm số = cosine)"""
+
+    def __init__(self, dim: int, dtype: str = 'float32'):
+        """Khởi tạo chỉ mục với số chiều và kiểu dữ liệu lưu trữ"""
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Kiểu dữ liệu vector không hợp lệ: {dtype}")
+
+        self.dim = dim
+        self.dtype = dtype
+        self.index = None
+        self.matrix = np.zeros((0, dim), dtype=dtype)
+
+        if FAISS_AVAILABLE:
+            if dtype == 'float16':
+                self.index = faiss.IndexScalarQuantizer(
+                    dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+            else:
+                self.index = faiss.IndexFlatIP(dim)
+
+    def __len__(self) -> int:
+        return self.index.ntotal if self.index is not None else len(self.matrix)
+
+    def add(self, vectors) -> None:
+        """Thêm các vector (sẽ được chuẩn hóa L2) vào chỉ mục"""
+        vectors = normalize_vectors(vectors)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Số chiều vector không khớp: {vectors.shape[1]} != {self.dim}")
+
+        if self.index is not None:
+            self.index.add(vectors)
+        else:
+            self.matrix = np.vstack([self.matrix, vectors.astype(self.dtype)])
+
+    def search(self, query_vector, top_k: int = 5,
+               positions: Optional[Sequence[int]] = None) -> List[Tuple[int, float]]:
+        """Tìm top_k vector gần nhất, trả về danh sách (vị trí, điểm cosine)
+        
+        positions giới hạn tìm kiếm trong các vị trí cho trước (lọc trước theo
+        metadata), nên vẫn trả về đủ top_k kết quả thuộc tập đó.
+        """
+        total = len(self) if positions is None else len(positions)
+        if total == 0 or top_k <= 0:
+            return []
+
+        query = normalize_vectors(query_vector)
+        top_k = min(top_k, total)
+
+        if self.index is not None:
+            if positions is None:
+                scores, found = self.index.search(query, top_k)
+                return [(int(p), float(s)) for p, s in zip(found[0], scores[0]) if p >= 0]
+
+            positions = np.asarray(positions, dtype=np.int64)
+            if hasattr(faiss, 'SearchParameters'):
+                # FAISS bỏ qua các vector không thuộc bộ chọn ngay trong lúc quét
+                params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(positions))
+                scores, found = self.index.search(query, top_k, params=params)
+                return [(int(p), float(s)) for p, s in zip(found[0], scores[0]) if p >= 0]
+
+            # FAISS cũ không có SearchParameters: lấy lại vector ứng viên và tính bằng numpy
+            scores = self.index.reconstruct_batch(positions) @ query[0]
+            return [(int(positions[i]), score) for i, score in top_k_scores(scores, top_k)]
+
+        if positions is not None:
+            positions = np.asarray(positions, dtype=np.int64)
+            scores = self.matrix[positions].astype(np.float32, copy=False) @ query[0]
+            return [(int(positions[i]), score) for i, score in top_k_scores(scores, top_k)]
+
+        scores = self.matrix.astype(np.float32, copy=False) @ query[0]
+        return top_k_scores(scores, top_k)
+
+
+def top_k_scores(scores: np.ndarray, top_k: int,
+                 candidates: Optional[Sequence[int]] = None) -> List[Tuple[int, float]]:
+    """Chọn top_k điểm cao nhất (theo thứ tự giảm dần) bằng argpartition"""
+    if candidates is not None:
+        candidates = np.asarray(candidates, dtype=np.int64)
+        scores = scores[candidates]
+
+    if len(scores) == 0 or top_k <= 0:
+        return []
+
+    top_k = min(top_k, len(scores))
+    best = np.argpartition(-scores, top_k - 1)[:top_k]
+    best = best[np.argsort(-scores[best])]
+
+    if candidates is not None:
+        return [(int(candidates[i]), float(scores[i])) for i in best]
+    return [(int(i), float(scores[i])) for i in best]
+
+
+class EmbeddingMatrix:
+    """Ma trận embedding liền khối được lưu trên đĩa và ánh xạ bộ nhớ (memmap)
+
+    Mỗi hàng là một vector đã chuẩn hóa L2, đi kèm một mảng id tăng dần.
+    Ma trận chỉ được đọc một lần, sau đó mỗi truy vấn là một phép nhân
+    ma trận-vector duy nhất.
+    """
+
+    def __init__(self, path: str):
+        """Khởi tạo với đường dẫn file .npy của ma trận"""
+        self.path = path
+        self.ids_path = os.path.splitext(path)[0] + '_ids.npy'
+        self.matrix = None
+        self.ids = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path) and os.path.exists(self.ids_path)
+
+    def build(self, ids: Sequence[int], vectors: Iterable) -> None:
+        """Ghi các vector (theo thứ tự ids tăng dần) vào file memmap rồi nạp lại"""
+        ids = np.asarray(ids, dtype=np.int64)
+        matrix = None
+
+        for row, vector in enumerate(vectors):
+            vector = normalize_vectors(np.ravel(vector))[0]
+            if matrix is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                matrix = np.lib.format.open_memmap(
+                    self.path, mode='w+', dtype=np.float32, shape=(len(ids), len(vector)))
+            matrix[row] = vector
+
+        if matrix is None:
+            matrix = np.lib.format.open_memmap(
+                self.path, mode='w+', dtype=np.float32, shape=(0, 0))
+        matrix.flush()
+        del matrix
+
+        np.save(self.ids_path, ids)
+        self.load()
+
+    def load(self) -> bool:
+        """Nạp ma trận dưới dạng memmap chỉ đọc"""
+        if not self.exists():
+            return False
+
+        self.matrix = np.load(self.path, mmap_mode='r')
+        self.ids = np.load(self.ids_path)
+        return True
+    
+    def positions_of(self, ids: Iterable[int]) -> np.ndarray:
+        """Chuyển tập id thành vị trí hàng trong ma trận (bỏ qua id không có)"""
+        ids = np.unique(np.fromiter(ids, dtype=np.int64))
+        positions = np.searchsorted(self.ids, ids)
+        valid = positions < len(self.ids)
+        positions, ids = positions[valid], ids[valid]
+        return positions[self.ids[positions] == ids]
+
+    def __len__(self) -> int:
+        return 0 if self.ids is None else len(self.ids)
+
+    def search(self, query_vector, top_k: int = 10,
+               candidate_ids: Optional[Iterable[int]] = None) -> List[Tuple[int, float]]:
+        """Tìm top_k id có điểm cosine cao nhất, có thể giới hạn trong tập id cho trước"""
+        if not len(self) or top_k <= 0:
+            return []
+
+        query = normalize_vectors(query_vector)[0]
+
+        if candidate_ids is not None:
+            positions = self.positions_of(candidate_ids)
+            if not len(positions):
+                return []
+            scores = self.matrix[positions] @ query
+            hits = top_k_scores(scores, top_k)
+            return [(int(self.ids[positions[pos]]), score) for pos, score in hits]
+
+        scores = self.matrix @ query
+        return [(int(self.ids[pos]), score) for pos, score in top_k_scores(scores, top_k)]
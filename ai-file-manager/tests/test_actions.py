@@ -3,15 +3,23 @@ import sys
 import unittest
 import tempfile
 import shutil
+import errno
+import hashlib
 from pathlib import Path
 from unittest.mock import patch, MagicMock
 
 # Thêm thư mục gốc vào sys.path để import các module
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from actions import copy_engine
+from actions.deduper import Deduper
+from actions.journal import ActionJournal
 from actions.mover import FileMover
+from actions.organizer import Organizer
 from actions.tagger import FileTagger
 from core.db import Database
+from rules.engine import RulesEngine
+from rules.planner import RulePlanner
 
 class TestFileMover(unittest.TestCase):
     """Kiểm thử cho module FileMover"""
@@ -241,5 +249,436 @@ class TestFileTagger(unittest.TestCase):
         # Kiểm tra xem hàm execute đã được gọi không
         mock_cursor.execute.assert_called()
 
+class TestOrganizer(unittest.TestCase):
+    """Kiểm thử cho việc lập kế hoạch và thực hiện organize song song"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.temp_dir, "test.db"))
+        self.source_dir = os.path.join(self.temp_dir, "source")
+        self.target_dir = os.path.join(self.temp_dir, "target")
+        os.makedirs(self.source_dir)
+        
+        for name in ('a.jpg', 'b.jpg', 'c.txt'):
+            path = os.path.join(self.source_dir, name)
+            with open(path, 'w') as f:
+                f.write(name)
+            self.db.add_file({
+                'abs_path': path, 'root_id': None, 'filename': name, 'ext': name.rsplit('.', 1)[1],
+                'mimetype': None, 'size': 5, 'hash_sha256': None,
+                'created_ts': '2023-05-01 10:00:00', 'modified_ts': None, 'ingested_ts': None})
+        # Một file khác nằm sẵn ở đích của c.txt
+        os.makedirs(os.path.join(self.target_dir, "docs"))
+        with open(os.path.join(self.target_dir, "docs", "c.txt"), 'w') as f:
+            f.write("có sẵn")
+        
+        self.engine = RulesEngine()
+        self.engine.rules = [
+            {'name': 'ảnh', 'if': {'ext': 'jpg'},
+             'then': {'move_to': os.path.join(self.target_dir, "{year}", "{month}"), 'tags_add': ['ảnh']}},
+            {'name': 'sao lưu', 'if': {'ext': 'jpg'}, 'then': {'copy_to': os.path.join(self.target_dir, "backup")}},
+            {'name': 'một tên', 'if': {'ext': 'jpg'},
+             'then': {'copy_to': os.path.join(self.target_dir, "latest"), 'rename': 'latest.jpg'}},
+            {'name': 'tài liệu', 'if': {'ext': 'txt'}, 'then': {'move_to': os.path.join(self.target_dir, "docs")}},
+        ]
+        self.organizer = Organizer(self.db, self.engine, workers=4, per_device=2, batch_size=2)
+        self.matched = RulePlanner(self.db, self.engine.compiled_rules).match()
+    
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def test_plan_detects_conflicts(self):
+        """Kiểm tra phát hiện đích đã tồn tại và hai file cùng một đích"""
+        tasks, conflicts = self.organizer.plan(self.matched)
+        
+        self.assertEqual([result['source'] for result in conflicts],
+                         [os.path.join(self.target_dir, "2023", "05", "b.jpg"),
+                          os.path.join(self.source_dir, "c.txt")])
+        # Bước sao chép của b.jpg dùng vị trí mới sau bước di chuyển
+        steps = [(step['action_type'], step['source']) for step in tasks[1].steps]
+        self.assertEqual(steps, [('move', os.path.join(self.source_dir, "b.jpg")),
+                                 ('copy', os.path.join(self.target_dir, "2023", "05", "b.jpg"))])
+        self.assertTrue(os.path.isdir(os.path.join(self.target_dir, "backup")))
+        self.assertEqual(self.organizer.stats['directories'], 3)
+    
+    def test_execute_updates_database_in_batches(self):
+        """Kiểm tra thực hiện song song rồi ghi đường dẫn, nhật ký và thẻ vào database"""
+        tasks, _ = self.organizer.plan(self.matched)
+        results = list(self.organizer.execute(tasks))
+        
+        self.assertTrue(all(result['success'] for result in results))
+        self.assertEqual(len(results), 5)
+        for name in ('a.jpg', 'b.jpg'):
+            moved = os.path.join(self.target_dir, "2023", "05", name)
+            self.assertTrue(os.path.exists(moved))
+            self.assertTrue(os.path.exists(os.path.join(self.target_dir, "backup", name)))
+            self.assertIsNotNone(self.db.get_file_by_path(moved))
+        self.assertTrue(os.path.exists(os.path.join(self.source_dir, "c.txt")))
+        
+        log_count = self.db.conn.execute("SELECT COUNT(*) FROM actions_log").fetchone()[0]
+        tag_count = self.db.conn.execute("SELECT COUNT(*) FROM file_tags").fetchone()[0]
+        self.assertEqual(log_count, 5)
+        self.assertEqual(tag_count, 2)
+    
+    def test_dry_run(self):
+        """Kiểm tra dry run không tạo thư mục và không thay đổi file"""
+        tasks, _ = self.organizer.plan(self.matched, dry_run=True)
+        results = list(self.organizer.execute(tasks, dry_run=True))
+        
+        self.assertTrue(all(result['dry_run'] for result in results))
+        self.assertFalse(os.path.exists(os.path.join(self.target_dir, "backup")))
+        self.assertTrue(os.path.exists(os.path.join(self.source_dir, "a.jpg")))
+
+class TestActionJournal(unittest.TestCase):
+    """Kiểm thử cho nhật ký ghi trước: phục hồi lô bị gián đoạn và hoàn tác"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.temp_dir, "test.db"))
+        self.source_dir = os.path.join(self.temp_dir, "source")
+        self.target_dir = os.path.join(self.temp_dir, "target")
+        os.makedirs(self.source_dir)
+        
+        self.paths = {}
+        for name in ('a.jpg', 'b.jpg', 'c.jpg'):
+            path = os.path.join(self.source_dir, name)
+            with open(path, 'w') as f:
+                f.write(name * 100)
+            self.paths[name] = path
+            self.db.add_file({
+                'abs_path': path, 'root_id': None, 'filename': name, 'ext': 'jpg',
+                'mimetype': None, 'size': 500, 'hash_sha256': None,
+                'created_ts': None, 'modified_ts': None, 'ingested_ts': None})
+        self.ids = {name: self.db.get_file_by_path(path)['id'] for name, path in self.paths.items()}
+        
+        self.engine = RulesEngine()
+        self.engine.rules = [
+            {'name': 'sao lưu', 'if': {'ext': 'jpg'}, 'then': {'copy_to': os.path.join(self.target_dir, "backup")}},
+            {'name': 'ảnh', 'if': {'ext': 'jpg'}, 'then': {'move_to': os.path.join(self.target_dir, "photos")}},
+        ]
+        self.journal = ActionJournal(self.db)
+    
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def _statuses(self, batch_id):
+        rows = self.db.conn.execute(
+            "SELECT status FROM actions_log WHERE batch_id = ? ORDER BY id", (batch_id,)).fetchall()
+        return [row['status'] for row in rows]
+    
+    def test_intents_recorded_before_execution(self):
+        """Kiểm tra mọi bước được ghi 'pending' trước khi chạy và database khớp với đĩa sau khi dừng giữa chừng"""
+        for index in range(37):
+            path = os.path.join(self.source_dir, f"extra{index}.jpg")
+            with open(path, 'w') as f:
+                f.write(str(index))
+            self.db.add_file({
+                'abs_path': path, 'root_id': None, 'filename': os.path.basename(path), 'ext': 'jpg',
+                'mimetype': None, 'size': None, 'hash_sha256': None,
+                'created_ts': None, 'modified_ts': None, 'ingested_ts': None})
+        organizer = Organizer(self.db, self.engine, workers=8, batch_size=100)
+        tasks, _ = organizer.plan(RulePlanner(self.db, self.engine.compiled_rules).match())
+        results = organizer.execute(tasks)
+        next(results)
+        
+        self.assertEqual(self._statuses(organizer.batch_id), ['pending'] * 80)
+        self.assertEqual(self.journal.get_batch(organizer.batch_id)['status'], 'running')
+        
+        # Dừng giữa chừng: mọi file đã di chuyển trên đĩa đều được cập nhật đường dẫn
+        results.close()
+        self.assertEqual(self.journal.get_batch(organizer.batch_id)['status'], 'interrupted')
+        photos = os.path.join(self.target_dir, "photos")
+        moved = set(os.listdir(photos))
+        self.assertTrue(moved)
+        for name in moved:
+            self.assertIsNotNone(self.db.get_file_by_path(os.path.join(photos, name)))
+        
+        # Phục hồi: không còn ý định dang dở, database khớp với đĩa
+        self.assertEqual(self.journal.recover()['batches'], 1)
+        self.assertNotIn('pending', self._statuses(organizer.batch_id))
+        for row in self.db.conn.execute("SELECT abs_path FROM files").fetchall():
+            self.assertTrue(os.path.exists(row['abs_path']))
+    
+    def test_recover_interrupted_batch(self):
+        """Kiểm tra phục hồi lô của tiến trình đã chết bằng cách đối chiếu với đĩa"""
+        batch_id = self.journal.begin('organize')
+        self.db.conn.execute("UPDATE action_batches SET pid = NULL WHERE id = ?", (batch_id,))
+        moved = os.path.join(self.target_dir, "a.jpg")
+        partial = os.path.join(self.target_dir, "c.jpg")
+        self.journal.record_intents(batch_id, [
+            (self.ids['a.jpg'], 'move', self.paths['a.jpg'], moved),
+            (self.ids['b.jpg'], 'move', self.paths['b.jpg'], os.path.join(self.target_dir, "b.jpg")),
+            (self.ids['c.jpg'], 'copy', self.paths['c.jpg'], partial),
+        ])
+        # Tiến trình dừng sau khi di chuyển a.jpg và khi đang sao chép c.jpg
+        os.makedirs(self.target_dir)
+        shutil.move(self.paths['a.jpg'], moved)
+        with open(partial, 'w') as f:
+            f.write('c')
+        
+        stats = self.journal.recover()
+        
+        self.assertEqual(stats, {'batches': 1, 'completed': 1, 'failed': 2})
+        self.assertEqual(self._statuses(batch_id), ['completed', 'failed', 'failed'])
+        self.assertEqual(self.journal.get_batch(batch_id)['status'], 'recovered')
+        self.assertIsNotNone(self.db.get_file_by_path(moved))
+        self.assertFalse(os.path.exists(partial))
+        # Lô của tiến trình đang chạy không bị động tới
+        running = self.journal.begin('organize')
+        self.assertEqual(self.journal.recover()['batches'], 0)
+        self.assertEqual(self.journal.get_batch(running)['status'], 'running')
+    
+    def test_undo_restores_files_and_paths(self):
+        """Kiểm tra hoàn tác đưa file về chỗ cũ, xóa bản sao và cập nhật database"""
+        organizer = Organizer(self.db, self.engine, workers=2)
+        tasks, _ = organizer.plan(RulePlanner(self.db, self.engine.compiled_rules).match())
+        self.assertTrue(all(result['success'] for result in organizer.execute(tasks)))
+        self.assertFalse(os.path.exists(self.paths['a.jpg']))
+        
+        result = self.journal.undo(organizer.batch_id)
+        
+        self.assertEqual((result['undone'], result['failed']), (6, 0))
+        for name, path in self.paths.items():
+            self.assertTrue(os.path.exists(path))
+            self.assertEqual(self.db.get_file_by_path(path)['id'], self.ids[name])
+        self.assertEqual(os.listdir(os.path.join(self.target_dir, "backup")), [])
+        self.assertEqual(os.listdir(os.path.join(self.target_dir, "photos")), [])
+        self.assertEqual(set(self._statuses(organizer.batch_id)), {'undone'})
+        self.assertEqual(self.journal.get_batch(organizer.batch_id)['status'], 'undone')
+        with self.assertRaises(ValueError):
+            self.journal.undo(organizer.batch_id)
+
+class TestDeduper(unittest.TestCase):
+    """Kiểm thử cho việc thay file trùng lặp bằng liên kết"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.temp_dir, "test.db"))
+        self.paths = {}
+        for name, content in (('a.bin', b'x' * 4096), ('b.bin', b'x' * 4096), ('c.bin', b'x' * 4096)):
+            path = os.path.join(self.temp_dir, name)
+            with open(path, 'wb') as f:
+                f.write(content)
+            self.paths[name] = path
+            self.db.add_file({
+                'abs_path': path, 'root_id': None, 'filename': name, 'ext': 'bin',
+                'mimetype': None, 'size': len(content), 'hash_sha256': 'cùng-hash',
+                'created_ts': None, 'modified_ts': None, 'ingested_ts': None})
+        self.groups = [[dict(self.db.get_file_by_path(path)) for path in self.paths.values()]]
+    
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def _inode(self, name):
+        return os.stat(self.paths[name]).st_ino
+    
+    def test_replaces_duplicates_with_hard_links(self):
+        """Kiểm tra thay bằng hard link, ghi nhật ký và tính dung lượng giải phóng"""
+        deduper = Deduper(self.db, workers=2)
+        tasks = deduper.plan(self.groups)
+        results = list(deduper.execute(tasks))
+        
+        self.assertTrue(all(result['success'] for result in results))
+        self.assertEqual(self._inode('a.bin'), self._inode('b.bin'))
+        self.assertEqual(self._inode('a.bin'), self._inode('c.bin'))
+        self.assertEqual(deduper.stats['bytes_reclaimed'], 2 * 4096)
+        rows = self.db.conn.execute(
+            "SELECT action_type, status FROM actions_log WHERE batch_id = ?", (deduper.batch_id,)).fetchall()
+        self.assertEqual([tuple(row) for row in rows], [('dedupe_hard', 'completed')] * 2)
+        
+        # Lần chạy sau: các file đã là liên kết nên không còn gì để thay
+        self.assertEqual(Deduper(self.db).plan(self.groups), [])
+    
+    def test_changed_content_is_not_linked(self):
+        """Kiểm tra file đã đổi nội dung (hash trong database cũ) không bị thay khi so từng byte"""
+        with open(self.paths['c.bin'], 'wb') as f:
+            f.write(b'y' * 4096)
+        
+        deduper = Deduper(self.db)
+        results = {result['target']: result for result in deduper.execute(deduper.plan(self.groups))}
+        
+        self.assertTrue(results[self.paths['b.bin']]['success'])
+        self.assertFalse(results[self.paths['c.bin']]['success'])
+        with open(self.paths['c.bin'], 'rb') as f:
+            self.assertEqual(f.read(), b'y' * 4096)
+        self.assertEqual(deduper.stats['bytes_reclaimed'], 4096)
+    
+    def test_failed_reflink_keeps_duplicate(self):
+        """Kiểm tra reflink không được hỗ trợ thì file trùng lặp giữ nguyên, không để lại file tạm"""
+        deduper = Deduper(self.db, link_type='reflink')
+        with patch.object(copy_engine, '_reflink', side_effect=copy_engine._Unsupported()):
+            results = list(deduper.execute(deduper.plan(self.groups)))
+        
+        self.assertFalse(any(result['success'] for result in results))
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ['a.bin', 'b.bin', 'c.bin', 'test.db'])
+        self.assertNotEqual(self._inode('a.bin'), self._inode('b.bin'))
+    
+    def test_undo_splits_links(self):
+        """Kiểm tra hoàn tác tách liên kết thành các bản sao độc lập"""
+        deduper = Deduper(self.db)
+        list(deduper.execute(deduper.plan(self.groups)))
+        
+        result = ActionJournal(self.db).undo(deduper.batch_id)
+        
+        self.assertEqual((result['undone'], result['failed']), (2, 0))
+        self.assertEqual(len({self._inode(name) for name in self.paths}), 3)
+        for path in self.paths.values():
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'x' * 4096)
+
+class TestFastPathMove(unittest.TestCase):
+    """Kiểm thử cho di chuyển nhanh (rename) và xác minh khi khác thiết bị"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.temp_dir, "test.db"))
+        self.mover = FileMover(self.db)
+        self.source = os.path.join(self.temp_dir, "source", "video.mp4")
+        os.makedirs(os.path.dirname(self.source))
+        with open(self.source, 'wb') as f:
+            f.write(b"noi dung video" * 1000)
+        os.utime(self.source, (1_600_000_000, 1_600_000_000))
+        self.file_hash = self.mover._calculate_hash(self.source)
+        self.db.add_file({
+            'abs_path': self.source, 'root_id': None, 'filename': 'video.mp4', 'ext': 'mp4',
+            'mimetype': 'video/mp4', 'size': 14000, 'hash_sha256': self.file_hash,
+            'created_ts': None, 'modified_ts': None, 'ingested_ts': None})
+        self.target = os.path.join(self.temp_dir, "target", "video.mp4")
+    
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def test_same_device_skips_hashing(self):
+        """Kiểm tra di chuyển trên cùng thiết bị không đọc nội dung file"""
+        with patch.object(self.mover, '_calculate_hash') as mock_hash, \
+                patch.object(self.mover, '_copy_with_hash') as mock_copy:
+            self.mover.move_file(self.source, self.target)
+        
+        mock_hash.assert_not_called()
+        mock_copy.assert_not_called()
+        self.assertTrue(os.path.exists(self.target))
+        self.assertIsNotNone(self.db.get_file_by_path(self.target))
+    
+    def test_cross_device_verifies_during_copy(self):
+        """Kiểm tra di chuyển khác thiết bị: sao chép kèm hash, giữ metadata, không đọc lại đích"""
+        self.mover.copy_methods = ('userspace',)
+        with patch.object(self.mover, '_same_device', return_value=False), \
+                patch.object(self.mover, '_calculate_hash') as mock_hash:
+            self.mover.move_file(self.source, self.target)
+        
+        mock_hash.assert_not_called()
+        self.assertFalse(os.path.exists(self.source))
+        self.assertEqual(FileMover()._calculate_hash(self.target), self.file_hash)
+        self.assertEqual(os.stat(self.target).st_mtime, 1_600_000_000)
+    
+    def test_kernel_copy_is_verified_before_delete(self):
+        """Kiểm tra sao chép trong kernel (không có hash) vẫn được xác minh trước khi xóa file nguồn"""
+        with open(self.source, 'ab') as f:
+            f.write(b"thay doi sau khi nap")
+        
+        self.mover.copy_methods = ('copy_file_range', 'sendfile')
+        with patch.object(self.mover, '_same_device', return_value=False):
+            with self.assertRaises(RuntimeError):
+                self.mover.move_file(self.source, self.target)
+        
+        self.assertTrue(os.path.exists(self.source))
+        self.assertFalse(os.path.exists(self.target))
+    
+    def test_size_checked_without_known_hash(self):
+        """Kiểm tra không có database: bản sao sai kích thước thì giữ nguyên file nguồn"""
+        mover = FileMover()
+        
+        def truncated_copy(source_path, target_path):
+            with open(target_path, 'wb') as f:
+                f.write(b"thieu")
+            return None
+        
+        with patch.object(mover, '_same_device', return_value=False), \
+                patch.object(mover, '_copy_with_hash', side_effect=truncated_copy):
+            with self.assertRaises(RuntimeError):
+                mover.move_file(self.source, self.target)
+        
+        self.assertTrue(os.path.exists(self.source))
+        self.assertFalse(os.path.exists(self.target))
+    
+    def test_cross_device_hash_mismatch_keeps_source(self):
+        """Kiểm tra hash khác với hash trong database thì giữ nguyên file nguồn"""
+        with open(self.source, 'ab') as f:
+            f.write(b"thay doi sau khi nap")
+        
+        # Chỉ sao chép qua userspace mới có hash tính trong lúc sao chép
+        self.mover.copy_methods = ('userspace',)
+        with patch.object(self.mover, '_same_device', return_value=False):
+            with self.assertRaises(RuntimeError):
+                self.mover.move_file(self.source, self.target)
+        
+        self.assertTrue(os.path.exists(self.source))
+        self.assertFalse(os.path.exists(self.target))
+
+class TestCopyEngine(unittest.TestCase):
+    """Kiểm thử cho copy_engine (reflink, sao chép trong kernel, userspace)"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.temp_dir, "video.mp4")
+        self.data = os.urandom(3 * copy_engine.BUFFER_SIZE + 123)
+        with open(self.source, 'wb') as f:
+            f.write(self.data)
+        os.chmod(self.source, 0o640)
+        os.utime(self.source, (1_600_000_000, 1_600_000_000))
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+    
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+    
+    def test_every_method_copies_content_and_metadata(self):
+        """Kiểm tra mọi cách sao chép cho cùng nội dung và giữ metadata"""
+        for method in ('copy_file_range', 'sendfile', 'userspace'):
+            with self.subTest(method=method):
+                target = os.path.join(self.temp_dir, method)
+                result = copy_engine.copy_file(self.source, target, methods=[method, 'userspace'])
+                
+                self.assertEqual(self._read(target), self.data)
+                self.assertEqual(result['size'], len(self.data))
+                self.assertEqual(os.stat(target).st_mtime, 1_600_000_000)
+                self.assertEqual(os.stat(target).st_mode & 0o777, 0o640)
+                if result['method'] == 'userspace':
+                    self.assertEqual(result['hash'], hashlib.sha256(self.data).hexdigest())
+                else:
+                    self.assertIsNone(result['hash'])
+    
+    def test_falls_back_when_unsupported(self):
+        """Kiểm tra chuyển sang cách tiếp theo khi hệ thống file không hỗ trợ"""
+        target = os.path.join(self.temp_dir, "copy.mp4")
+        with patch.object(copy_engine.os, 'copy_file_range',
+                          side_effect=OSError(errno.EXDEV, "cross-device"), create=True):
+            result = copy_engine.copy_file(self.source, target,
+                                           methods=['reflink', 'copy_file_range', 'userspace'])
+        
+        self.assertEqual(result['method'], 'userspace')
+        self.assertEqual(self._read(target), self.data)
+    
+    def test_never_overwrites_and_cleans_up(self):
+        """Kiểm tra không ghi đè file có sẵn và xóa file đích dở dang khi lỗi"""
+        existing = os.path.join(self.temp_dir, "existing.mp4")
+        with open(existing, 'wb') as f:
+            f.write(b"giu nguyen")
+        with self.assertRaises(FileExistsError):
+            copy_engine.copy_file(self.source, existing)
+        self.assertEqual(self._read(existing), b"giu nguyen")
+        
+        target = os.path.join(self.temp_dir, "broken.mp4")
+        with patch.object(copy_engine, '_userspace', side_effect=OSError(errno.EIO, "I/O error")):
+            with self.assertRaises(OSError):
+                copy_engine.copy_file(self.source, target, methods=['userspace'])
+        self.assertFalse(os.path.exists(target))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,8 +1,10 @@
 import os
 import sys
+import time
 import unittest
 import tempfile
 import shutil
+import subprocess
 from pathlib import Path
 from unittest.mock import patch, MagicMock
 
@@ -252,5 +254,42 @@ class TestCommandHandler(unittest.TestCase):
         # Kiểm tra xem phương thức index_text_content đã được gọi chưa
         mock_ci.index_text_content.assert_called()
 
+class TestStartupTime(unittest.TestCase):
+    """Kiểm thử thời gian khởi động của giao diện dòng lệnh"""
+    
+    # Ngân sách thời gian import cho cli.commands (giây)
+    IMPORT_TIME_BUDGET = 1.0
+    
+    def test_import_budget(self):
+        """Kiểm tra cli.commands không import các thư viện nặng và nằm trong ngân sách thời gian"""
+        code = (
+            "import sys, time\n"
+            "start = time.perf_counter()\n"
+            "import cli.commands\n"
+            "print(time.perf_counter() - start)\n"
+            "heavy = ('torch', 'sentence_transformers', 'faiss', 'numpy', 'pdfplumber', 'marshmallow')\n"
+            "print(','.join(m for m in heavy if m in sys.modules))\n"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=str(Path(__file__).parent.parent),
+            capture_output=True, text=True, check=True).stdout.splitlines()
+        
+        self.assertEqual(output[1] if len(output) > 1 else '', '')
+        self.assertLess(float(output[0]), self.IMPORT_TIME_BUDGET)
+    
+    def test_content_indexer_created_lazily(self):
+        """Kiểm tra setup không tạo ContentIndexer cho các lệnh không cần tới"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            handler = CommandHandler()
+            handler.setup(os.path.join(temp_dir, "test.db"))
+            
+            self.assertIsNone(handler._content_indexer)
+            self.assertIsNotNone(handler.content_indexer)
+            handler.db.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -9,7 +9,13 @@ from unittest.mock import patch, MagicMock, mock_open
 # Thêm thư mục gốc vào sys.path để import các module
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from datetime import datetime
+
 from rules.engine import RulesEngine
+from rules.compiler import FileContext, compile_rule, compile_rules
+from rules.matcher import KeywordMatcher
+from rules.planner import RulePlanner, condition_clause
+from core.db import Database
 from rules.schemas import validate_rules_file, get_rule_template
 
 class TestRulesEngine(unittest.TestCase):
@@ -173,6 +179,226 @@ class TestRulesEngine(unittest.TestCase):
         self.assertEqual(action_plan['target_path'], 'Documents/vi/test.pdf')
         self.assertEqual(action_plan['tags'], ["tài liệu"])
 
+class TestCompiledRules(unittest.TestCase):
+    """Kiểm thử cho quy tắc đã biên dịch"""
+    
+    CONDITIONS = [
+        {'mimetype': 'image/*'},
+        {'mimetype': 'application/pdf', 'language': 'vi'},
+        {'ext': ['JPG', 'png']},
+        {'ext': 'PDF'},
+        {'exif.camera_model': ['iPhone', 'Pixel']},
+        {'exif.iso': 100},
+        {'text.contains_any': ['Bài Giảng', 'đề cương']},
+        {'text.contains_all': ['bài', 'tập']},
+        {'text.contains_any': 'HỢP ĐỒNG'},
+        {'filename.contains': ['scan', 'IMG']},
+        {'size.gt': 1000, 'size.lt': 5000},
+        {'created_after': '2023-01-01'},
+        {'created_before': '2023-06-30', 'mimetype': 'image/*'},
+        {'created_after': 'không-phải-ngày'},
+    ]
+    
+    FILES = [
+        {'mimetype': 'image/jpeg', 'ext': 'jpg', 'filename': 'IMG_001.jpg', 'size': 2048,
+         'created_ts': datetime(2023, 3, 1), 'metadata': {'camera_model': 'iPhone', 'iso': 100}},
+        {'mimetype': 'application/pdf', 'ext': 'pdf', 'filename': 'bai_giang.pdf', 'size': 10,
+         'language': 'vi', 'text': 'Bài giảng và bài tập', 'created_ts': datetime(2022, 5, 1)},
+        {'mimetype': 'text/plain', 'ext': 'txt', 'filename': 'scan.txt', 'size': 4000,
+         'text': 'Hợp đồng thuê nhà', 'created_ts': datetime(2024, 1, 1), 'metadata': {}},
+        {'mimetype': 'image/png', 'ext': 'PNG', 'filename': 'logo.png', 'size': 0,
+         'created_ts': datetime(2023, 12, 31), 'metadata': {'camera_model': 'Canon'}},
+    ]
+    
+    def test_same_result_as_interpreter(self):
+        """Kiểm tra quy tắc biên dịch cho kết quả giống evaluate_condition"""
+        engine = RulesEngine()
+        for condition in self.CONDITIONS:
+            compiled = compile_rule({'name': 'r', 'if': condition, 'then': {}})
+            for file_info in self.FILES:
+                with self.subTest(condition=condition, file=file_info['filename']):
+                    self.assertEqual(compiled.matches(FileContext(file_info)),
+                                     engine.evaluate_condition(condition, file_info))
+    
+    def test_apply_rules_uses_compiled_rules(self):
+        """Kiểm tra apply_rules giữ thứ tự quy tắc và biên dịch lại khi đổi quy tắc"""
+        engine = RulesEngine()
+        engine.rules = [
+            {'name': 'Ảnh', 'if': {'text.contains_any': ['x'], 'mimetype': 'image/*'}, 'then': {'move_to': 'a'}},
+            {'name': 'Thiếu then', 'if': {'ext': 'jpg'}},
+            {'name': 'JPG', 'if': {'ext': 'jpg'}, 'then': {'move_to': 'b'}},
+        ]
+        
+        # Điều kiện mimetype (rẻ) được kiểm tra trước nên văn bản không bị xử lý
+        ctx = FileContext({'mimetype': 'text/plain', 'text': 'x'})
+        self.assertFalse(engine.compiled_rules[0].matches(ctx))
+        self.assertIs(ctx._text, FileContext._MISSING)
+        self.assertEqual([a['rule_name'] for a in engine.apply_rules(self.FILES[0])], ['JPG'])
+        
+        engine.rules = engine.rules[:1]
+        self.assertEqual(engine.apply_rules(self.FILES[0]), [])
+
+class TestKeywordMatcher(unittest.TestCase):
+    """Kiểm thử cho bộ tìm nhiều từ khóa (Aho-Corasick)"""
+    
+    KEYWORDS = ['he', 'she', 'his', 'hers', 'bài', 'bài giảng', 'giảng', 'x', '']
+    TEXTS = ['ushers', 'bài giảng môn toán', 'không có gì', '', 'hishe', 'ahishers bài']
+    
+    def test_backends_agree_with_brute_force(self):
+        """Kiểm tra mọi backend cho cùng tập từ khóa với phép `in`"""
+        for backend in ('automaton', 'scan'):
+            matcher = KeywordMatcher(self.KEYWORDS, backend=backend)
+            for text in self.TEXTS:
+                with self.subTest(backend=backend, text=text):
+                    self.assertEqual(matcher.find(text), {k for k in self.KEYWORDS if k in text})
+    
+    def test_rule_set_scans_text_once(self):
+        """Kiểm tra văn bản của mỗi file chỉ được quét một lần cho mọi quy tắc"""
+        rules = [{'name': f'r{i}', 'if': {'text.contains_any': [f'từ{i}', 'chung']}, 'then': {}}
+                 for i in range(50)]
+        rules.append({'name': 'all', 'if': {'text.contains_all': ['Từ3', 'từ7']}, 'then': {}})
+        rule_set = compile_rules(rules, matcher_backend='automaton')
+        self.assertEqual(len(rule_set.matcher), 51)
+        
+        calls = []
+        find = rule_set.matcher.find
+        rule_set.matcher.find = lambda text: calls.append(text) or find(text)
+        
+        matched = rule_set.match({'text': 'Có TỪ3 và từ7 ở đây'})
+        self.assertEqual([rule.name for rule in matched], ['r3', 'r7', 'all'])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(rule_set.match({'text': None}), [])
+
+class TestRuleDispatch(unittest.TestCase):
+    """Kiểm thử cho chỉ mục quy tắc theo mimetype và đuôi file"""
+    
+    RULES = [
+        {'name': 'pdf', 'if': {'mimetype': 'application/pdf'}, 'then': {}},
+        {'name': 'ảnh', 'if': {'mimetype': 'image/*', 'size.gt': 10}, 'then': {}},
+        {'name': 'jpg', 'if': {'ext': ['JPG', 'jpeg']}, 'then': {}},
+        {'name': 'lớn', 'if': {'size.gt': 1000}, 'then': {}},
+        {'name': 'png exact', 'if': {'mimetype': 'image/png', 'ext': 'png'}, 'then': {}},
+    ] + [{'name': f'docx{i}', 'if': {'ext': 'docx', 'filename.contains': str(i)}, 'then': {}}
+         for i in range(20)]
+    
+    FILES = [
+        {'mimetype': 'image/jpeg', 'ext': 'jpg', 'size': 5000},
+        {'mimetype': 'image/png', 'ext': 'png', 'size': 5},
+        {'mimetype': 'application/pdf', 'ext': 'pdf', 'size': 1},
+        {'mimetype': None, 'ext': 'docx', 'filename': 'bao_cao_7.docx', 'size': 2000},
+        {'ext': None},
+    ]
+    
+    def test_same_matches_as_full_scan(self):
+        """Kiểm tra chỉ mục cho cùng kết quả (và thứ tự) như thử mọi quy tắc"""
+        rule_set = compile_rules(self.RULES)
+        for file_info in self.FILES:
+            ctx = FileContext(file_info)
+            expected = [rule.name for rule in rule_set if rule.matches(ctx)]
+            self.assertEqual([rule.name for rule in rule_set.match(file_info)], expected)
+    
+    def test_stats(self):
+        """Kiểm tra thống kê số quy tắc được đánh giá cho mỗi file"""
+        engine = RulesEngine()
+        engine.rules = self.RULES
+        for file_info in self.FILES:
+            engine.apply_rules(file_info)
+        
+        stats = engine.get_stats()
+        self.assertEqual(stats['files'], 5)
+        self.assertEqual(stats['unindexed_rules'], 1)
+        # jpg: ảnh, jpg, lớn; png: ảnh, lớn, png exact; pdf: pdf, lớn; docx: lớn + 20; khác: lớn
+        self.assertEqual(stats['rules_evaluated'], 3 + 3 + 2 + 21 + 1)
+        self.assertLess(stats['rules_per_file'], len(self.RULES))
+
+class TestRulePlanner(unittest.TestCase):
+    """Kiểm thử cho việc đẩy điều kiện quy tắc xuống SQL"""
+    
+    RULES = [
+        {'name': 'ảnh canon', 'if': {'mimetype': 'image/*', 'exif.camera_make': 'Canon'}, 'then': {}},
+        {'name': 'pdf nhỏ', 'if': {'ext': ['PDF'], 'size.lt': 150}, 'then': {}},
+        {'name': 'báo cáo', 'if': {'filename.contains': ['BÁO', 'report'], 'created_after': '2023-01-01'},
+         'then': {}},
+        {'name': 'mới', 'if': {'created_before': '2023-06-01', 'size.gt': 250}, 'then': {}},
+    ]
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.temp_dir, "test.db"))
+        files = [('a.jpg', 'jpg', 'image/jpeg', 100, '2022-05-01 10:00:00', 'Canon'),
+                 ('b.png', 'png', 'image/png', 200, '2023-06-01 00:00:00', 'Nikon'),
+                 ('report.pdf', 'pdf', 'application/pdf', 120, '2023-02-01 08:30:00', None),
+                 ('BÁO_cáo.docx', 'docx', None, 300, '2023-01-01 00:00:00', None),
+                 ('c.pdf', 'pdf', 'application/pdf', None, None, None)]
+        for name, ext, mimetype, size, created, make in files:
+            file_id = self.db.add_file({
+                'abs_path': f'/data/{name}', 'root_id': None, 'filename': name, 'ext': ext,
+                'mimetype': mimetype, 'size': size, 'hash_sha256': None,
+                'created_ts': created, 'modified_ts': None, 'ingested_ts': None})
+            if make:
+                self.db.add_exif_data(file_id, {'camera_make': make})
+        for i in range(50):
+            self.db.add_file({
+                'abs_path': f'/data/other{i}.txt', 'root_id': None, 'filename': f'other{i}.txt',
+                'ext': 'txt', 'mimetype': 'text/plain', 'size': 10, 'hash_sha256': None,
+                'created_ts': '2020-01-01 00:00:00', 'modified_ts': None, 'ingested_ts': None})
+    
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def _full_scan(self, rules):
+        rows = [dict(row) for row in self.db.conn.execute("SELECT * FROM files").fetchall()]
+        exif = self.db.get_exif_data([row['id'] for row in rows])
+        rule_set = compile_rules(rules)
+        expected = []
+        for row in rows:
+            row['metadata'] = exif.get(row['id'], {})
+            names = [rule.name for rule in rule_set if rule.matches(FileContext(row))]
+            if names:
+                expected.append((row['filename'], names))
+        return expected
+    
+    def _planned(self, planner, scope=None):
+        return [(row['filename'], [rule.name for rule in rules]) for row, rules in planner.match(scope)]
+    
+    def test_same_matches_as_full_scan(self):
+        """Kiểm tra kết quả (và thứ tự quy tắc của mỗi file) giống đánh giá từng dòng"""
+        planner = RulePlanner(self.db, compile_rules(self.RULES))
+        result = self._planned(planner)
+        
+        self.assertEqual(result, self._full_scan(self.RULES))
+        self.assertEqual(result, [('a.jpg', ['ảnh canon']), ('report.pdf', ['pdf nhỏ', 'báo cáo']),
+                                  ('BÁO_cáo.docx', ['báo cáo', 'mới']), ('c.pdf', ['pdf nhỏ'])])
+        
+        stats = planner.stats()
+        self.assertFalse(stats['full_scan'])
+        self.assertEqual(stats['queries'], len(self.RULES))
+        self.assertLess(stats['rows_fetched'], 15)
+    
+    def test_scope(self):
+        """Kiểm tra giới hạn tập file theo đường dẫn"""
+        planner = RulePlanner(self.db, compile_rules(self.RULES))
+        self.assertEqual(self._planned(planner, ("abs_path LIKE ?", ['/data/rep%'])),
+                         [('report.pdf', ['pdf nhỏ', 'báo cáo'])])
+    
+    def test_full_scan_fallback(self):
+        """Kiểm tra quy tắc không lọc được bằng SQL dẫn đến quét toàn bộ một lần"""
+        rules = self.RULES + [{'name': 'tiếng việt', 'if': {'language': 'vi'}, 'then': {}}]
+        planner = RulePlanner(self.db, compile_rules(rules))
+        
+        self.assertEqual(self._planned(planner), self._full_scan(rules))
+        self.assertTrue(planner.stats()['full_scan'])
+        self.assertEqual(planner.stats()['queries'], 1)
+    
+    def test_condition_clause(self):
+        """Kiểm tra các điều kiện không đẩy xuống được hoặc không bao giờ thỏa"""
+        self.assertIsNone(condition_clause('text.contains_any', ['a']))
+        self.assertIsNone(condition_clause('size.gt', -1))
+        self.assertIsNone(condition_clause('mimetype', None))
+        self.assertEqual(condition_clause('created_after', 'không-phải-ngày')[0], '0')
+        self.assertEqual(condition_clause('exif.iso', {'a': 1})[0], '0')
+
 class TestRulesSchemas(unittest.TestCase):
     """Kiểm thử cho module schemas"""
     
@@ -11,7 +11,22 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from search.indexer import ContentIndexer
 from search.searcher import FileSearcher
+from search import models
+from search.embedding_job import EmbeddingJob
+from search.encoders import ParallelEncoder, length_sorted_batches
+from search.vector_store import VectorIndex, EmbeddingMatrix, normalize_vectors
+from search.quantization import QuantizedIndex, measure_tradeoffs, quantize
+from search.fulltext import build_match_query, search_chunks, search_files
+from search.hybrid import HybridSearcher, reciprocal_rank_fusion
+from search.hydrate import hydrate_hits
+from search.pagination import PAGE_SIZE, decode_cursor, paginate_ranked
+from search.geo import bounding_boxes, haversine_km
+from actions.tagger import FileTagger
+from core.cache import QueryCache, make_key
 from core.db import Database
+from core.database import Database as LegacyDatabase
+from core.search import Searcher as WebSearcher
+import numpy as np
 
 class TestContentIndexer(unittest.TestCase):
     """Kiểm thử cho module ContentIndexer"""
@@ -253,5 +268,817 @@ class TestFileSearcher(unittest.TestCase):
         # Kiểm tra xem hàm execute đã được gọi với tham số đúng không
         mock_cursor.execute.assert_called()
 
+class TestVectorIndex(unittest.TestCase):
+    """Kiểm thử cho chỉ mục vector cosine"""
+    
+    def test_normalize_vectors(self):
+        """Kiểm tra chuẩn hóa L2 và xử lý vector 0"""
+        vectors = normalize_vectors([[3.0, 4.0], [0.0, 0.0]])
+        self.assertAlmostEqual(float(np.linalg.norm(vectors[0])), 1.0, places=6)
+        self.assertTrue(np.all(vectors[1] == 0))
+    
+    def test_search_returns_cosine_scores(self):
+        """Kiểm tra điểm số trả về là cosine thực sự, không phụ thuộc độ dài vector"""
+        for dtype in ('float32', 'float16'):
+            index = VectorIndex(3, dtype=dtype)
+            index.add([[10.0, 0.0, 0.0], [1.0, 1.0, 0.0], [0.0, 0.0, -2.0]])
+            
+            hits = index.search([5.0, 0.0, 0.0], top_k=3)
+            
+            self.assertEqual([pos for pos, _ in hits], [0, 1, 2])
+            self.assertAlmostEqual(hits[0][1], 1.0, places=3)
+            self.assertAlmostEqual(hits[1][1], 1 / np.sqrt(2), places=3)
+            self.assertAlmostEqual(hits[2][1], 0.0, places=3)
+    
+    def test_indexer_scores_match_threshold(self):
+        """Kiểm tra ContentIndexer trả về điểm cosine và lọc theo min_score"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            db = Database(os.path.join(temp_dir, "test.db"))
+            cursor = db.conn.cursor()
+            cursor.execute("INSERT INTO files (abs_path, filename) VALUES ('/a.txt', 'a.txt')")
+            
+            indexer = ContentIndexer(db)
+            indexer.model = MagicMock()
+            indexer.index_text_content(1, "mèo")
+            indexer.index_text_content(1, "mèo chó")
+            
+            vectors = {"mèo chó": [2.0, 0.0], "chó": [1.0, 1.0]}
+            indexer.model.encode.side_effect = lambda texts, **kwargs: np.array([vectors[t] for t in texts])
+            indexer.create_embeddings()
+            indexer.build_faiss_index()
+            
+            results = indexer.search("chó", top_k=5)
+            self.assertEqual(len(results), 1)
+            self.assertAlmostEqual(results[0]['score'], 1 / np.sqrt(2), places=5)
+            self.assertEqual(indexer.search("chó", top_k=5, min_score=0.9), [])
+            
+            # Chỉ mục int8 xếp hạng lại bằng vector lưu trong database nên điểm vẫn chính xác
+            indexer.index_precision = 'int8'
+            indexer.build_faiss_index()
+            results = indexer.search("chó", top_k=5)
+            self.assertAlmostEqual(results[0]['score'], 1 / np.sqrt(2), places=5)
+            db.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+class TestEmbeddingMatrix(unittest.TestCase):
+    """Kiểm thử cho ma trận embedding memmap"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.matrix = EmbeddingMatrix(os.path.join(self.temp_dir, "embeddings.npy"))
+        self.matrix.build([3, 7, 9], [[1.0, 0.0], [0.0, 2.0], [1.0, 1.0]])
+    
+    def tearDown(self):
+        self.matrix = None
+        shutil.rmtree(self.temp_dir)
+    
+    def test_search_top_k(self):
+        """Kiểm tra tìm top-k bằng một phép nhân ma trận-vector"""
+        hits = self.matrix.search([1.0, 0.1], top_k=2)
+        
+        self.assertEqual([file_id for file_id, _ in hits], [3, 9])
+        self.assertGreater(hits[0][1], hits[1][1])
+    
+    def test_search_with_candidate_ids(self):
+        """Kiểm tra giới hạn ứng viên theo tập id cho trước"""
+        hits = self.matrix.search([1.0, 0.1], top_k=5, candidate_ids={7, 42})
+        
+        self.assertEqual([file_id for file_id, _ in hits], [7])
+    
+    def test_reload_from_disk(self):
+        """Kiểm tra nạp lại ma trận từ file memmap"""
+        matrix = EmbeddingMatrix(self.matrix.path)
+        
+        self.assertTrue(matrix.load())
+        self.assertIsInstance(matrix.matrix, np.memmap)
+        self.assertEqual(list(matrix.ids), [3, 7, 9])
+
+class TestSemanticSearcherMatrix(unittest.TestCase):
+    """Kiểm thử cho việc nạp ma trận embedding của Searcher (giao diện web)"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = LegacyDatabase(os.path.join(self.temp_dir, "web.db"))
+        self.db.init_database()
+        self.paths = {}
+        for file_id in (1, 2, 3):
+            self.paths[file_id] = os.path.join(self.temp_dir, f"{file_id}.npy")
+            self.db.cursor.execute("INSERT INTO files (id, path, embedding_path) VALUES (?, ?, ?)",
+                                   (file_id, f"/data/{file_id}.txt", self.paths[file_id]))
+            if file_id != 3:
+                np.save(self.paths[file_id], np.array([1.0, float(file_id)]))
+        self.db.conn.commit()
+    
+    def tearDown(self):
+        self.db.disconnect()
+        shutil.rmtree(self.temp_dir)
+    
+    def _load(self):
+        return WebSearcher(self.db)._load_embedding_matrix()
+    
+    def test_reuses_matrix_and_picks_up_rewritten_npy(self):
+        """Kiểm tra không xây lại khi thiếu .npy, nhưng xây lại khi .npy được ghi đè"""
+        self.assertEqual(list(self._load().ids), [1, 2])
+        
+        with patch.object(EmbeddingMatrix, 'build') as build:
+            self.assertEqual(list(self._load().ids), [1, 2])
+        build.assert_not_called()
+        
+        # .npy mới hơn ma trận (cùng id) phải được đọc lại
+        np.save(self.paths[2], np.array([0.0, 1.0]))
+        built = os.path.getmtime(os.path.join(self.temp_dir, "embeddings.npy"))
+        os.utime(self.paths[2], (built + 10, built + 10))
+        matrix = self._load()
+        self.assertEqual(matrix.search([0.0, 1.0], top_k=1)[0][0], 2)
+        self.assertAlmostEqual(matrix.search([0.0, 1.0], top_k=1)[0][1], 1.0, places=5)
+
+class TestEmbeddingJob(unittest.TestCase):
+    """Kiểm thử cho công việc tạo embedding dạng luồng"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.temp_dir, "test.db"))
+        self.db.conn.executemany(
+            "INSERT INTO content_index (file_id, chunk_index, content) VALUES (1, ?, ?)",
+            [(i, f"đoạn văn bản số {i}") for i in range(10)])
+        self.db.conn.commit()
+        
+        self.model = MagicMock()
+        self.model.encode.side_effect = lambda texts, **kwargs: np.ones((len(texts), 4))
+        self.job = EmbeddingJob(self.db, self.model, 'test-model', page_size=3, max_batch_size=3)
+    
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def _count_embeddings(self):
+        return self.db.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    
+    def test_adaptive_batches(self):
+        """Kiểm tra batch nhỏ hơn khi các đoạn dài hơn"""
+        job = EmbeddingJob(self.db, self.model, 'test-model', token_budget=100, max_batch_size=50)
+        short_chunks = [{'content': 'một hai'}] * 20
+        long_chunks = [{'content': 'từ ' * 60}] * 20
+        
+        self.assertGreater(len(next(job.make_batches(short_chunks))),
+                           len(next(job.make_batches(long_chunks))))
+    
+    def test_run_and_rebuild_upsert(self):
+        """Kiểm tra tạo embedding và rebuild không tạo bản ghi trùng"""
+        stats = self.job.run()
+        self.assertEqual(stats['processed'], 10)
+        self.assertEqual(self._count_embeddings(), 10)
+        
+        self.job.run(rebuild=True)
+        self.assertEqual(self._count_embeddings(), 10)
+    
+    def test_cache_skips_known_text(self):
+        """Kiểm tra rebuild và đánh chỉ mục lại chỉ encode nội dung mới"""
+        self.job.run()
+        self.model.encode.reset_mock()
+        
+        stats = EmbeddingJob(self.db, self.model, 'test-model').run(rebuild=True)
+        self.assertEqual(stats['cache_hits'], 10)
+        self.model.encode.assert_not_called()
+        
+        # Đánh chỉ mục lại: embedding cũ bị xóa, chỉ đoạn mới được encode
+        indexer = ContentIndexer(self.db)
+        indexer.index_text_content(1, "đoạn văn bản số 0")
+        indexer.index_text_content(2, "nội dung hoàn toàn mới")
+        self.assertEqual(self._count_embeddings(), 0)
+        
+        stats = EmbeddingJob(self.db, self.model, 'test-model').run()
+        self.assertEqual((stats['encoded'], stats['cache_hits']), (1, 1))
+        self.model.encode.assert_called_once_with(["nội dung hoàn toàn mới"], batch_size=1)
+    
+    def test_resume_after_interruption(self):
+        """Kiểm tra tiếp tục từ checkpoint sau khi bị gián đoạn"""
+        calls = []
+        
+        def flaky_encode(texts, **kwargs):
+            calls.append(len(texts))
+            if len(calls) == 2:
+                raise KeyboardInterrupt()
+            return np.ones((len(texts), 4))
+        
+        self.model.encode.side_effect = flaky_encode
+        with self.assertRaises(KeyboardInterrupt):
+            self.job.run(rebuild=True)
+        done = self._count_embeddings()
+        self.assertGreater(done, 0)
+        
+        self.model.encode.side_effect = lambda texts, **kwargs: np.ones((len(texts), 4))
+        stats = EmbeddingJob(self.db, self.model, 'test-model', page_size=4).run(rebuild=True)
+        
+        self.assertEqual(stats['processed'], 10 - done)
+        self.assertEqual(self._count_embeddings(), 10)
+
+class TestParallelEncoder(unittest.TestCase):
+    """Kiểm thử cho bộ encode gom batch theo độ dài"""
+    
+    def test_length_sorted_batches(self):
+        """Kiểm tra các đoạn có độ dài tương tự được gom cùng batch"""
+        texts = ["a" * 50, "b", "c" * 40, "d" * 2]
+        
+        self.assertEqual(length_sorted_batches(texts, 2), [[1, 3], [2, 0]])
+    
+    def test_encode_preserves_order(self):
+        """Kiểm tra kết quả encode trả về đúng thứ tự đầu vào"""
+        model = MagicMock()
+        model.encode.side_effect = lambda texts, **kwargs: np.array([[len(t), 0.0] for t in texts])
+        
+        with patch('search.encoders.get_model', return_value=model):
+            vectors = ParallelEncoder('test-model', workers=1, batch_size=2).encode(
+                ["aaaa", "b", "ccc", "dd"])
+        
+        self.assertEqual(list(vectors[:, 0]), [4, 1, 3, 2])
+        self.assertEqual(model.encode.call_count, 2)
+    
+    def test_thread_limits_set_before_spawning_workers(self):
+        """Kiểm tra biến số luồng BLAS được đặt ở tiến trình cha khi tạo pool và khôi phục khi đóng"""
+        seen = {}
+        
+        def fake_pool(**kwargs):
+            seen.update({var: os.environ.get(var) for var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS')})
+            return MagicMock()
+        
+        with patch.dict(os.environ, {'OMP_NUM_THREADS': '8'}), \
+                patch('search.encoders.ProcessPoolExecutor', side_effect=fake_pool):
+            os.environ.pop('OPENBLAS_NUM_THREADS', None)
+            with ParallelEncoder('test-model', workers=2, threads_per_worker=3):
+                self.assertEqual(os.environ['OMP_NUM_THREADS'], '3')
+            
+            self.assertEqual(seen, {'OMP_NUM_THREADS': '3', 'OPENBLAS_NUM_THREADS': '3'})
+            self.assertEqual(os.environ['OMP_NUM_THREADS'], '8')
+            self.assertNotIn('OPENBLAS_NUM_THREADS', os.environ)
+
+class TestQuantizedIndex(unittest.TestCase):
+    """Kiểm thử cho chỉ mục lượng tử hóa hai giai đoạn"""
+    
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = normalize_vectors(rng.standard_normal((500, 32)))
+        self.queries = self.vectors[:20] + 0.1 * rng.standard_normal((20, 32))
+    
+    def test_code_sizes(self):
+        """Kiểm tra kích thước mã int8 và binary"""
+        self.assertEqual(quantize(self.vectors, 'int8').nbytes, 500 * 32)
+        self.assertEqual(quantize(self.vectors, 'binary').nbytes, 500 * 4)
+    
+    def test_rerank_returns_exact_scores(self):
+        """Kiểm tra xếp hạng lại trả về điểm cosine chính xác"""
+        for precision in ('int8', 'binary'):
+            index = QuantizedIndex(32, precision, rerank_factor=10,
+                                   fetch_vectors=lambda positions: self.vectors[positions])
+            index.add(self.vectors)
+            
+            hits = index.search(self.vectors[7], top_k=3)
+            
+            self.assertEqual(hits[0][0], 7)
+            self.assertAlmostEqual(hits[0][1], 1.0, places=5)
+            
+            # Giới hạn trong tập vị trí cho trước
+            hits = index.search(self.vectors[7], top_k=3, positions=[3, 100, 200])
+            self.assertEqual(sorted(pos for pos, _ in hits), [3, 100, 200])
+    
+    def test_measure_tradeoffs(self):
+        """Kiểm tra bảng bộ nhớ/recall và xếp hạng lại cải thiện recall của binary"""
+        results = {(r['precision'], r['rerank']): r for r in measure_tradeoffs(self.vectors, self.queries)}
+        
+        self.assertEqual(results[('float32', False)]['recall'], 1.0)
+        self.assertEqual(results[('binary', False)]['bytes_per_vector'], 4)
+        self.assertGreater(results[('int8', True)]['recall'], 0.9)
+        self.assertGreaterEqual(results[('binary', True)]['recall'], results[('binary', False)]['recall'])
+
+class TestFullTextSearch(unittest.TestCase):
+    """Kiểm thử cho tìm kiếm toàn văn FTS5"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.temp_dir, "test.db"))
+        if not self.db.fts_enabled:
+            self.skipTest("SQLite không hỗ trợ FTS5")
+        
+        self.db.conn.executemany("INSERT INTO files (abs_path, filename) VALUES (?, ?)",
+                                 [('/a.txt', 'a.txt'), ('/b.txt', 'b.txt')])
+        self.indexer = ContentIndexer(self.db)
+        self.indexer.index_text_content(1, "Báo cáo tài chính tiếng Việt năm 2023")
+        self.indexer.index_text_content(2, "Tài liệu hướng dẫn cài đặt phần mềm quản lý tài chính tài chính")
+    
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def test_build_match_query(self):
+        """Kiểm tra phân tích cụm từ, tiền tố và ký tự đặc biệt"""
+        self.assertEqual(build_match_query('"báo cáo" tài* AND'), '"báo cáo" AND "tài"* AND "AND"')
+        self.assertIsNone(build_match_query('()'))
+    
+    def test_diacritics_phrase_and_prefix(self):
+        """Kiểm tra tìm không dấu, cụm từ và tiền tố"""
+        self.assertEqual([r['file_id'] for r in search_chunks(self.db.conn, 'tieng viet')], [1])
+        self.assertEqual([r['file_id'] for r in search_chunks(self.db.conn, '"cài đặt phần"')], [2])
+        self.assertEqual([r['file_id'] for r in search_chunks(self.db.conn, 'huong*')], [2])
+    
+    def test_d_stroke_folding(self):
+        """Kiểm tra "duong" khớp "Đường" (đ không được tokenizer bỏ dấu)"""
+        self.indexer.index_text_content(1, "Đường dây nóng hỗ trợ")
+        
+        for query in ('duong', 'Đường', '"đuong day"'):
+            hits = search_chunks(self.db.conn, query)
+            self.assertEqual([r['file_id'] for r in hits], [1])
+        self.assertIn('[Đường dây]', hits[0]['snippet'])
+    
+    def test_bm25_ranking_and_snippet(self):
+        """Kiểm tra xếp hạng BM25 và trích đoạn được đánh dấu"""
+        results = search_files(self.db.conn, 'tài chính')
+        
+        self.assertEqual([r['id'] for r in results], [2, 1])
+        self.assertIn('[tài]', results[0]['snippet'])
+    
+    def test_triggers_keep_index_in_sync(self):
+        """Kiểm tra trigger cập nhật chỉ mục khi nội dung thay đổi hoặc bị xóa"""
+        self.indexer.index_text_content(1, "nội dung mới")
+        
+        self.assertEqual(search_chunks(self.db.conn, 'báo cáo'), [])
+        self.assertEqual(len(search_chunks(self.db.conn, 'mới')), 1)
+
+class TestHybridSearch(unittest.TestCase):
+    """Kiểm thử cho tìm kiếm kết hợp BM25 + vector"""
+    
+    def test_reciprocal_rank_fusion(self):
+        """Kiểm tra tài liệu xuất hiện ở cả hai danh sách được xếp trên cùng"""
+        fused = reciprocal_rank_fusion([['a', 'b'], ['c', 'b']], k=60)
+        
+        self.assertEqual(fused[0][0], 'b')
+        self.assertAlmostEqual(fused[0][1], 2 / 62)
+    
+    def test_fuses_lexical_and_vector_hits(self):
+        """Kiểm tra hợp nhất ở mức file và trả về thời gian từng giai đoạn"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            db = Database(os.path.join(temp_dir, "test.db"))
+            if not db.fts_enabled:
+                self.skipTest("SQLite không hỗ trợ FTS5")
+            db.conn.executemany("INSERT INTO files (abs_path, filename) VALUES (?, ?)",
+                                [('/a.txt', 'a.txt'), ('/b.txt', 'b.txt'), ('/c.txt', 'c.txt')])
+            
+            indexer = ContentIndexer(db)
+            indexer.model = MagicMock()
+            texts = {"hợp đồng thuê nhà": [1.0, 0.0], "thỏa thuận cho thuê căn hộ": [0.9, 0.1],
+                     "hóa đơn tiền điện": [0.0, 1.0], "hợp đồng": [1.0, 0.0]}
+            indexer.model.encode.side_effect = lambda items, **kwargs: np.array([texts[t] for t in items])
+            for file_id, text in enumerate(["hợp đồng thuê nhà", "thỏa thuận cho thuê căn hộ",
+                                            "hóa đơn tiền điện"], start=1):
+                indexer.index_text_content(file_id, text)
+            indexer.create_embeddings()
+            indexer.build_faiss_index()
+            
+            searcher = HybridSearcher(indexer, candidates=2)
+            response = searcher.search("hợp đồng", top_k=2)
+            searcher.close()
+            
+            results = response['results']
+            self.assertEqual([r['file_id'] for r in results], [1, 2])
+            self.assertEqual((results[0]['lexical_rank'], results[0]['vector_rank']), (1, 1))
+            self.assertIsNone(results[1]['lexical_rank'])
+            self.assertEqual(results[1]['content'], "thỏa thuận cho thuê căn hộ")
+            for stage in ('lexical', 'encode', 'vector', 'fuse', 'total'):
+                self.assertIn(stage, response['timings'])
+            db.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+class TestFilteredVectorSearch(unittest.TestCase):
+    """Kiểm thử cho tìm kiếm vector lọc trước theo metadata"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.temp_dir, "test.db"))
+        files = [('/projects/a.pdf', 'pdf', 'application/pdf', 100),
+                 ('/projects/b.txt', 'txt', 'text/plain', 200),
+                 ('/other/c.pdf', 'pdf', 'application/pdf', 300),
+                 ('/projects/d.pdf', 'pdf', 'application/pdf', 400)]
+        for path, ext, mimetype, size in files:
+            self.db.add_file({
+                'abs_path': path, 'root_id': None, 'filename': os.path.basename(path), 'ext': ext,
+                'mimetype': mimetype, 'size': size, 'hash_sha256': None,
+                'created_ts': None, 'modified_ts': None, 'ingested_ts': None})
+        
+        self.indexer = ContentIndexer(self.db)
+        self.indexer.model = MagicMock()
+        # Các file không phải PDF trong /projects gần truy vấn nhất
+        vectors = {"a": [0.5, 0.5], "b": [1.0, 0.0], "c": [0.99, 0.1], "d": [0.0, 1.0], "q": [1.0, 0.0]}
+        self.indexer.model.encode.side_effect = lambda texts, **kwargs: np.array([vectors[t] for t in texts])
+        for file_id, text in enumerate("abcd", start=1):
+            self.indexer.index_text_content(file_id, text)
+        self.indexer.create_embeddings()
+        self.indexer.build_faiss_index()
+    
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def test_resolve_file_ids(self):
+        """Kiểm tra chuyển tiêu chí thành tập id file"""
+        searcher = FileSearcher(self.db)
+        
+        self.assertEqual(searcher.resolve_file_ids({'ext': '.PDF', 'root': '/projects'}), {1, 4})
+        self.assertEqual(searcher.resolve_file_ids({'min_size': 150, 'max_size': 350}), {2, 3})
+    
+    def test_filtered_search_returns_full_top_k(self):
+        """Kiểm tra tìm kiếm có lọc trả về đủ top_k kết quả thuộc tập lọc"""
+        for precision in ('float32', 'int8'):
+            self.indexer.index_precision = precision
+            self.indexer.build_faiss_index()
+            
+            results = self.indexer.search("q", top_k=2, criteria={'mimetype': 'application/pdf',
+                                                                  'root': '/projects'})
+            
+            self.assertEqual([r['file_id'] for r in results], [1, 4])
+            self.assertEqual(self.indexer.search("q", top_k=2, criteria={'tag': 'không-có'}), [])
+    
+    def test_rerank_drops_missing_embeddings(self):
+        """Kiểm tra ứng viên không còn embedding bị bỏ khi xếp hạng lại"""
+        self.indexer.index_precision = 'int8'
+        self.indexer.build_faiss_index()
+        self.db.conn.execute("DELETE FROM embeddings WHERE content_id IN "
+                             "(SELECT id FROM content_index WHERE file_id = 2)")
+        
+        results = self.indexer.search("q", top_k=4)
+        
+        self.assertNotIn(2, [r['file_id'] for r in results])
+        self.assertEqual(len(results), 3)
+    
+    def test_fallback_keeps_filter(self):
+        """Kiểm tra khi tìm kiếm vector lỗi, tìm kiếm từ khóa vẫn giữ bộ lọc file"""
+        self.indexer.model.encode.side_effect = RuntimeError("lỗi mô hình")
+        
+        results = self.indexer.search("b", top_k=5, file_ids=[1, 4], with_tags=True)
+        
+        self.assertEqual(results, [])
+        results = self.indexer.search("d", top_k=5, file_ids=[1, 4], with_tags=True)
+        self.assertEqual([(r['file_id'], r['tags']) for r in results], [(4, [])])
+
+class TestHydration(unittest.TestCase):
+    """Kiểm thử cho việc lấy thông tin kết quả tìm kiếm theo lô"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.temp_dir, "test.db"))
+        cursor = self.db.conn.cursor()
+        cursor.executemany("INSERT INTO files (id, abs_path, filename) VALUES (?, ?, ?)",
+                           [(i, f"/f{i}.txt", f"f{i}.txt") for i in range(1, 2001)])
+        cursor.executemany("INSERT INTO content_index (id, file_id, content) VALUES (?, ?, ?)",
+                           [(i, i, f"đoạn {i}") for i in range(1, 2001)])
+        cursor.execute("INSERT INTO tags (id, name) VALUES (1, 'b'), (2, 'a')")
+        cursor.executemany("INSERT INTO file_tags (file_id, tag_id) VALUES (?, ?)",
+                           [(5, 1), (5, 2), (1500, 1)])
+        self.db.conn.commit()
+        
+        self.statements = []
+        self.db.conn.set_trace_callback(self.statements.append)
+    
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def test_constant_number_of_queries(self):
+        """Kiểm tra số truy vấn không phụ thuộc số kết quả"""
+        hits = [{'file_id': i, 'content_id': i, 'score': 1.0 / i} for i in range(2000, 0, -1)]
+        hits.append({'file_id': 9999, 'content_id': 9999, 'score': 0.0})
+        
+        results = hydrate_hits(self.db.conn, hits, with_tags=True)
+        
+        self.assertEqual(len(results), 2000)
+        self.assertEqual(results[0]['filename'], 'f2000.txt')
+        self.assertEqual(results[-5]['tags'], ['a', 'b'])
+        # 3 bảng x 3 lô (900 id mỗi lô)
+        self.assertEqual(len(self.statements), 9)
+    
+    def test_tagger_batch(self):
+        """Kiểm tra lấy thẻ cho nhiều file bằng một truy vấn"""
+        tags = FileTagger(self.db).get_tags_for_files([5, 6, 1500])
+        
+        self.assertEqual(tags, {5: ['a', 'b'], 1500: ['b']})
+        self.assertEqual(len(self.statements), 1)
+
+class TestFilenameIndex(unittest.TestCase):
+    """Kiểm thử cho chỉ mục trigram trên tên file"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.temp_dir, "test.db"))
+        if not self.db.name_index_enabled:
+            self.skipTest("SQLite không hỗ trợ tokenizer trigram")
+        
+        for name in ("Báo_Cáo_Tài_Chính.pdf", "hop-dong-thue-nha.docx", "ảnh.jpg"):
+            self.db.add_file({
+                'abs_path': f"/data/{name}", 'root_id': None, 'filename': name,
+                'ext': os.path.splitext(name)[1], 'mimetype': None, 'size': 1,
+                'hash_sha256': None, 'created_ts': None, 'modified_ts': None, 'ingested_ts': None})
+        self.searcher = FileSearcher(self.db)
+    
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def _names(self, pattern):
+        return [f['filename'] for f in self.searcher.search_by_filename(pattern)]
+    
+    def test_case_and_diacritic_insensitive(self):
+        """Kiểm tra tìm chuỗi con không phân biệt hoa/thường và dấu"""
+        self.assertEqual(self._names("bao_cao"), ["Báo_Cáo_Tài_Chính.pdf"])
+        self.assertEqual(self._names("TÀI_CHINH"), ["Báo_Cáo_Tài_Chính.pdf"])
+        self.assertEqual(self._names("anh"), ["ảnh.jpg"])
+        self.assertCountEqual(self._names("g"), ["ảnh.jpg", "hop-dong-thue-nha.docx"])
+    
+    def test_index_follows_rename(self):
+        """Kiểm tra chỉ mục được cập nhật khi file được đổi tên hoặc di chuyển"""
+        self.db.update_file_path(2, "/archive/hợp-đồng-2024.docx")
+        
+        self.assertEqual(self._names("thue-nha"), [])
+        self.assertEqual(self._names("hop-dong-2024"), ["hợp-đồng-2024.docx"])
+        self.assertEqual(len(self.searcher.search_by_multiple_criteria({'filename': 'dong-20'})), 1)
+
+class TestQueryCache(unittest.TestCase):
+    """Kiểm thử cho cache kết quả truy vấn"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.temp_dir, "test.db"))
+        self.cache = QueryCache(max_entries=2, ttl=60)
+        self.searcher = FileSearcher(self.db, cache=self.cache)
+        self._add("bao_cao.pdf")
+    
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def _add(self, name):
+        path = os.path.join(self.temp_dir, name)
+        Path(path).touch()
+        return self.db.add_file({
+            'abs_path': path, 'root_id': None, 'filename': name,
+            'ext': os.path.splitext(name)[1].lstrip('.'), 'mimetype': None, 'size': 1,
+            'hash_sha256': None, 'created_ts': None, 'modified_ts': None, 'ingested_ts': None})
+    
+    def test_lru_ttl_and_generation(self):
+        """Kiểm tra loại bỏ mục cũ nhất, hết hạn và đổi thế hệ"""
+        self.cache.put('a', 1, [1])
+        self.cache.put('b', 1, [2])
+        self.assertEqual(self.cache.get('a', 1), (True, [1]))
+        self.cache.put('c', 1, [3])
+        
+        self.assertEqual(self.cache.get('b', 1), (False, None))
+        self.assertEqual(self.cache.get('a', 2), (False, None))
+        
+        expired = QueryCache(ttl=0)
+        expired.put('a', 1, [1])
+        self.assertEqual(expired.get('a', 1), (False, None))
+        
+        self.assertEqual(make_key('q', '  Báo   cáo '), make_key('q', 'Báo cáo'))
+        self.assertNotEqual(make_key('q', 'Báo'), make_key('q', 'báo'))
+        self.assertEqual(self.cache.stats()['hits'], 1)
+    
+    def test_invalidated_by_writes(self):
+        """Kiểm tra kết quả cache bị vô hiệu hóa khi file hoặc thẻ thay đổi"""
+        first = self.searcher.search_by_extension('pdf')
+        first[0]['filename'] = 'đã sửa'
+        self.assertEqual(self.searcher.search_by_extension('pdf')[0]['filename'], 'bao_cao.pdf')
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        
+        # Dòng lồng trong dict (search_page) cũng phải là bản sao
+        page = self.searcher.search_page({'extension': 'pdf'})
+        page['results'][0]['filename'] = 'đã sửa'
+        self.assertEqual(self.searcher.search_page({'extension': 'pdf'})['results'][0]['filename'],
+                         'bao_cao.pdf')
+        
+        self._add("hop_dong.pdf")
+        self.assertEqual(len(self.searcher.search_by_extension('pdf')), 2)
+        
+        self.assertEqual(self.searcher.search_by_tag('quan-trong'), [])
+        FileTagger(self.db).add_tag(os.path.join(self.temp_dir, "bao_cao.pdf"), 'quan-trong')
+        self.assertEqual(len(self.searcher.search_by_tag('quan-trong')), 1)
+
+class TestPagination(unittest.TestCase):
+    """Kiểm thử cho phân trang kết quả tìm kiếm"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.temp_dir, "test.db"))
+        cursor = self.db.conn.cursor()
+        # Tên file trùng nhau để kiểm tra khóa phụ id
+        cursor.executemany(
+            "INSERT INTO files (id, abs_path, filename, ext, size) VALUES (?, ?, ?, ?, ?)",
+            [(i, f"/data/{i}.txt", f"f{i % 7}.txt", 'txt', i) for i in range(1, 101)])
+        self.db.conn.commit()
+        self.searcher = FileSearcher(self.db, cache=False)
+    
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def test_keyset_pages_cover_all_rows_once(self):
+        """Kiểm tra các trang nối tiếp nhau không trùng và không sót"""
+        expected = [f['id'] for f in self.searcher.search_by_multiple_criteria({'ext': 'txt'})]
+        
+        seen, cursor = [], None
+        while True:
+            page = self.searcher.search_page({'ext': 'txt'}, limit=15, cursor=cursor)
+            self.assertLessEqual(len(page['results']), 15)
+            seen.extend(f['id'] for f in page['results'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        
+        self.assertCountEqual(seen, expected)
+        self.assertEqual(len(set(seen)), 100)
+        
+        third = self.searcher.search_page({'ext': 'txt'}, limit=15, page=3)['results']
+        self.assertEqual([f['id'] for f in third], seen[30:45])
+        self.assertRaises(ValueError, self.searcher.search_page, {'ext': 'txt'}, cursor='khong-hop-le')
+    
+    def test_iter_search_is_bounded(self):
+        """Kiểm tra generator đọc theo lô với LIMIT trong SQL"""
+        statements = []
+        self.db.conn.set_trace_callback(statements.append)
+        
+        sizes = [f['size'] for f in self.searcher.iter_search({'min_size': 0}, batch_size=40)]
+        
+        self.assertEqual(sorted(sizes), list(range(1, 101)))
+        self.assertEqual(len(statements), 3)
+        self.assertTrue(all('LIMIT' in sql for sql in statements))
+        self.assertEqual(len(self.searcher.search_by_multiple_criteria({'ext': 'txt'}, limit=5)), 5)
+    
+    def test_search_methods_push_limit_to_sql(self):
+        """Kiểm tra các hàm search_* giới hạn số dòng trong SQL (kể cả search_by_size không có điều kiện)"""
+        statements = []
+        self.db.conn.set_trace_callback(statements.append)
+        
+        smallest = self.searcher.search_by_size()
+        
+        self.assertEqual([f['size'] for f in smallest], list(range(1, PAGE_SIZE + 1)))
+        self.assertIn('LIMIT', statements[-1])
+        self.assertEqual([f['size'] for f in self.searcher.search_by_size(min_size=95, limit=3)], [95, 96, 97])
+        self.assertEqual(len(self.searcher.search_by_extension('txt', limit=7)), 7)
+        self.assertEqual(len(self.searcher.search_by_filename('f1', limit=None)), 15)
+    
+    def test_single_criterion_searches(self):
+        """Kiểm tra tìm theo MIME, ngày và hash dùng đúng cột của bảng files"""
+        self.db.conn.executemany(
+            "UPDATE files SET mimetype = ?, created_ts = ?, modified_ts = ?, hash_sha256 = ? WHERE id = ?",
+            [('image/jpeg', '2023-05-01 10:00:00', '2024-01-01 00:00:00', 'h1', 1),
+             ('image/png', '2023-06-01 10:00:00', '2023-07-01 00:00:00', 'h1', 2),
+             ('text/plain', '2024-02-01 10:00:00', '2024-03-01 00:00:00', 'h2', 3)])
+        self.db.conn.commit()
+        
+        self.assertEqual([f['id'] for f in self.searcher.search_by_mimetype('image/')], [1, 2])
+        self.assertEqual([f['id'] for f in self.searcher.search_by_date('2023-01-01', '2023-12-31')], [1, 2])
+        self.assertEqual([f['id'] for f in self.searcher.search_by_date(
+            end_date='2023-12-31', date_type='modified')], [2])
+        self.assertEqual([f['id'] for f in self.searcher.search_by_hash('h1')], [1, 2])
+    
+    def test_paginate_ranked(self):
+        """Kiểm tra phân trang kết quả đã xếp hạng"""
+        ranked = list(range(25))
+        first = paginate_ranked(lambda count: ranked[:count], limit=10)
+        second = paginate_ranked(lambda count: ranked[:count], limit=10, cursor=first['next_cursor'])
+        last = paginate_ranked(lambda count: ranked[:count], limit=10, page=3)
+        
+        self.assertEqual(first['results'], list(range(10)))
+        self.assertEqual(second['results'], list(range(10, 20)))
+        self.assertEqual(last, {'results': list(range(20, 25)), 'next_cursor': None})
+        self.assertEqual(decode_cursor(first['next_cursor'], 1), [10])
+
+class TestGeoSearch(unittest.TestCase):
+    """Kiểm thử cho tìm kiếm theo vị trí (R*Tree + haversine)"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.temp_dir, "test.db"))
+        
+        rng = np.random.default_rng(7)
+        self.points = [(float(lat), float(lon)) for lat, lon in
+                       zip(rng.uniform(-89, 89, 400), rng.uniform(-180, 180, 400))]
+        # Các điểm gần kinh tuyến 180° và gần cực
+        self.points += [(10.0, 179.995), (10.0, -179.995), (89.99, 0.0), (89.99, 180.0)]
+        
+        cursor = self.db.conn.cursor()
+        cursor.executemany("INSERT INTO files (id, abs_path, filename) VALUES (?, ?, ?)",
+                           [(i, f"/p{i}.jpg", f"p{i}.jpg") for i in range(len(self.points))])
+        cursor.executemany("INSERT INTO metadata_media (file_id, gps_lat, gps_lon) VALUES (?, ?, ?)",
+                           [(i, lat, lon) for i, (lat, lon) in enumerate(self.points)])
+        cursor.execute("INSERT INTO metadata_media (file_id) VALUES (0)")
+        self.db.conn.commit()
+        self.searcher = FileSearcher(self.db, cache=False)
+    
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def _brute_force(self, lat, lon, radius_km):
+        distances = [(haversine_km(lat, lon, p_lat, p_lon), i) for i, (p_lat, p_lon) in enumerate(self.points)]
+        return [i for distance, i in sorted(distances) if distance <= radius_km]
+    
+    def test_bounding_boxes(self):
+        """Kiểm tra hộp giới hạn vắt qua kinh tuyến 180° và chứa cực"""
+        self.assertEqual(len(bounding_boxes(10.0, 179.99, 5.0)), 2)
+        self.assertEqual(bounding_boxes(89.99, 0.0, 5.0)[0][2:], (-180.0, 180.0))
+        self.assertAlmostEqual(haversine_km(0, 0, 0, 1), 111.195, places=2)
+    
+    def test_radius_matches_brute_force(self):
+        """Kiểm tra kết quả trong bán kính khớp với tính toán vét cạn"""
+        self.assertTrue(self.db.geo_index_enabled)
+        
+        for lat, lon, radius in ((10.0, 180.0, 5.0), (90.0, 0.0, 10.0), (0.0, 0.0, 2500.0)):
+            found = self.searcher.search_by_location(lat, lon, radius)
+            self.assertEqual([f['id'] for f in found], self._brute_force(lat, lon, radius))
+        
+        self.assertEqual(len(self.searcher.search_by_location(10.0, 180.0, 5.0)), 2)
+    
+    def test_nearest_and_index_sync(self):
+        """Kiểm tra k điểm gần nhất và chỉ mục được cập nhật theo trigger"""
+        nearest = self.searcher.search_nearest(45.0, 100.0, k=5)
+        self.assertEqual([f['id'] for f in nearest], self._brute_force(45.0, 100.0, 1e5)[:5])
+        
+        self.db.conn.execute("UPDATE metadata_media SET gps_lat = 45.0, gps_lon = 100.001 WHERE file_id = 3")
+        self.db.conn.commit()
+        self.assertEqual(self.searcher.search_nearest(45.0, 100.0, k=1)[0]['id'], 3)
+
+class TestExifSearch(unittest.TestCase):
+    """Kiểm thử cho lưu trữ và tìm kiếm EXIF dạng khóa - giá trị"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.temp_dir, "test.db"))
+        for i, (model, iso) in enumerate((("iPhone 12", 100), ("Pixel 6", 400), ("iPhone 12", 800)), start=1):
+            self.db.conn.execute("INSERT INTO files (id, abs_path, filename, ext) VALUES (?, ?, ?, 'jpg')",
+                                 (i, f"/p{i}.jpg", f"p{i}.jpg"))
+            self.db.add_exif_data(i, {'camera_model': model, 'iso': iso, 'raw': b'\x00', 'gps_info': {1: 'N'}})
+        self.db.add_media_metadata(3, {'width': 4000, 'gps_lat': 10.5, 'gps_lon': 106.7})
+        self.searcher = FileSearcher(self.db, cache=False)
+    
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def test_typed_storage(self):
+        """Kiểm tra giá trị được lưu đúng kiểu và metadata media được gộp vào"""
+        exif = self.db.get_exif_data([3, 1, 99])
+        
+        self.assertEqual(exif[1], {'camera_model': 'iPhone 12', 'iso': 100})
+        self.assertEqual(exif[3]['iso'], 800)
+        self.assertEqual(exif[3]['gps_lat'], 10.5)
+        self.assertNotIn(99, exif)
+    
+    def test_indexed_lookup(self):
+        """Kiểm tra tìm kiếm EXIF dùng chỉ mục và khớp giá trị số từ chuỗi"""
+        self.assertEqual([f['id'] for f in self.searcher.search_by_exif('camera_model', 'iPhone 12')], [1, 3])
+        self.assertEqual([f['id'] for f in self.searcher.search_by_exif('iso', '400')], [2])
+        self.assertEqual(self.searcher.search_by_exif('iso', 'abc'), [])
+        
+        found = self.searcher.search_by_multiple_criteria(
+            {'exif_field': 'camera_model', 'exif_value': 'iPhone 12', 'exif': {'iso': [800, 1600]}})
+        self.assertEqual([f['id'] for f in found], [3])
+        
+        plan = self.db.conn.execute(
+            "EXPLAIN QUERY PLAN SELECT file_id FROM exif_tags WHERE key = ? AND value IN (?)",
+            ('iso', 400)).fetchall()
+        self.assertTrue(any('idx_exif_tags_key_value' in row[3] for row in plan))
+
+class TestModelRegistry(unittest.TestCase):
+    """Kiểm thử cho registry mô hình embedding"""
+    
+    def setUp(self):
+        self.fake_module = MagicMock()
+        self.modules_patch = patch.dict(sys.modules, {'sentence_transformers': self.fake_module})
+        self.available_patch = patch.object(models, 'SENTENCE_TRANSFORMERS_AVAILABLE', True)
+        self.registry_patch = patch.dict(models._registry, clear=True)
+        for p in (self.modules_patch, self.available_patch, self.registry_patch):
+            p.start()
+            self.addCleanup(p.stop)
+    
+    def test_shared_and_lazy(self):
+        """Kiểm tra mô hình được dùng chung và chỉ tải khi encode lần đầu"""
+        model = models.get_model('test-model')
+        
+        self.assertIs(model, models.get_model('test-model'))
+        self.fake_module.SentenceTransformer.assert_not_called()
+        
+        model.encode(["a"])
+        model.encode(["b"])
+        
+        self.fake_module.SentenceTransformer.assert_called_once_with('test-model')
+        self.assertTrue(model.loaded)
+    
+    def test_preload(self):
+        """Kiểm tra tải trước mô hình"""
+        model = models.preload_model('test-model', background=False)
+        
+        self.assertTrue(model.loaded)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
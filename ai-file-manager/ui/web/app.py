@@ -8,11 +8,14 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(
 
 # Import các module cần thiết từ dự án
 try:
+    from core.cache import query_cache
     from core.database import Database
     from core.ingest import FileIngestor
     from core.search import Searcher
     from core.organize import Organizer
     from core.tag import TagManager
+    from search.models import preload_model
+    from search.pagination import paginate_ranked
 except ImportError as e:
     print(f"Lỗi khi import module: {e}")
 
@@ -46,6 +49,8 @@ def init_database():
         db.init_database()
         ingestor = FileIngestor(db)
         searcher = Searcher(db)
+        # Tải trước mô hình embedding ở nền để truy vấn đầu tiên không phải chờ
+        preload_model(background=True)
         organizer = Organizer(db)
         tag_manager = TagManager(db)
         return jsonify({"status": "success", "message": "Cơ sở dữ liệu đã được khởi tạo thành công"})
@@ -82,17 +87,26 @@ def search_files():
     
     data = request.json
     query = data.get('query')
+    file_ids = data.get('file_ids')
     
     if not query:
         return jsonify({"status": "error", "message": "Truy vấn tìm kiếm không được để trống"}), 400
     
     try:
-        results = searcher.search(query)
+        # Phân trang: limit kết quả mỗi trang, cursor (từ next_cursor) hoặc page (từ 1)
+        page = paginate_ranked(
+            lambda count: searcher.search(query, limit=count, candidate_ids=file_ids),
+            limit=int(data.get('limit', 10)), cursor=data.get('cursor'), page=data.get('page'))
+        
+        results = page['results']
         return jsonify({
             "status": "success", 
             "message": f"Tìm thấy {len(results)} kết quả", 
-            "results": results
+            "results": results,
+            "next_cursor": page['next_cursor']
         })
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": f"Lỗi khi tìm kiếm: {str(e)}"}), 500
 
@@ -214,7 +228,8 @@ def get_status():
     status = {
         "database_initialized": db is not None,
         "version": "1.0.0",
-        "data_path": data_dir
+        "data_path": data_dir,
+        "query_cache": query_cache.stats()
     }
     return jsonify(status)
 